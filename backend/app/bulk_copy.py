@@ -0,0 +1,181 @@
+"""
+Bulk COPY helpers
+==================
+Utility per caricare grandi volumi di righe in PostgreSQL con COPY FROM STDIN,
+usate da importer e pipeline ML al posto degli INSERT riga per riga.
+"""
+
+import csv
+import io
+from typing import Iterable, List, Optional, Sequence
+
+import pandas as pd
+
+NULL_MARKER = "\\N"
+
+
+def quote_ident(conn, name: str) -> str:
+    """Quota un identificatore secondo il dialetto della connessione."""
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+def column_list(conn, columns: Sequence[str]) -> str:
+    """Lista colonne quotata per SQL testuale."""
+    return ", ".join(quote_ident(conn, c) for c in columns)
+
+
+def create_staging_table(conn, name: str, source_table: str, columns: Sequence[str]):
+    """
+    Crea una tabella temporanea con le stesse colonne (e tipi) di source_table,
+    senza vincoli né default. Viene eliminata al commit.
+    Se esiste già nella transazione corrente viene ricreata.
+    """
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS pg_temp.{name}")
+    conn.exec_driver_sql(f"""
+        CREATE TEMP TABLE {name} ON COMMIT DROP AS
+        SELECT {column_list(conn, columns)} FROM {source_table} WITH NO DATA
+    """)
+
+
+def upsert_from_staging(
+    conn,
+    table: str,
+    staging: str,
+    columns: Sequence[str],
+    keys: Sequence[str],
+    update: bool = True,
+):
+    """
+    Unisce la tabella di staging in table con un solo INSERT ... SELECT.
+    In conflitto sulla chiave aggiorna le altre colonne (update=True)
+    oppure ignora la riga (update=False).
+    """
+    cols = column_list(conn, columns)
+    values = [c for c in columns if c not in keys]
+    if update and values:
+        assignments = ", ".join(
+            f"{quote_ident(conn, c)} = EXCLUDED.{quote_ident(conn, c)}" for c in values
+        )
+        action = f"DO UPDATE SET {assignments}"
+    else:
+        action = "DO NOTHING"
+    conn.exec_driver_sql(f"""
+        INSERT INTO {table} ({cols})
+        SELECT {cols} FROM {staging}
+        ON CONFLICT ({column_list(conn, keys)}) {action}
+    """)
+
+
+def update_from_staging(
+    conn,
+    table: str,
+    staging: str,
+    columns: Sequence[str],
+    keys: Sequence[str],
+) -> int:
+    """
+    Aggiorna le colonne non chiave delle righe esistenti di table con un
+    solo UPDATE ... FROM staging (le righe senza corrispondenza sono ignorate).
+
+    Returns:
+        Numero di righe aggiornate
+    """
+    assignments = ", ".join(
+        f"{quote_ident(conn, c)} = s.{quote_ident(conn, c)}" for c in columns if c not in keys
+    )
+    match = " AND ".join(f"t.{quote_ident(conn, k)} = s.{quote_ident(conn, k)}" for k in keys)
+    result = conn.exec_driver_sql(f"""
+        UPDATE {table} AS t
+        SET {assignments}
+        FROM {staging} AS s
+        WHERE {match}
+    """)
+    return result.rowcount
+
+
+def _copy_buffer(conn, table: str, columns: Sequence[str], buf: io.StringIO):
+    buf.seek(0)
+    sql = (
+        f"COPY {table} ({column_list(conn, columns)}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')"
+    )
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(sql, buf)
+    finally:
+        cursor.close()
+
+
+def _format_value(value):
+    if value is None:
+        return NULL_MARKER
+    if isinstance(value, float) and value != value:
+        return NULL_MARKER
+    if isinstance(value, (list, tuple)):
+        return "{" + ",".join(str(v) for v in value) + "}"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def copy_rows(conn, table: str, columns: Sequence[str], rows: Iterable[Sequence]) -> int:
+    """
+    Carica tuple (ordinate come columns) in table via COPY.
+    Gestisce None/NaN, date e liste (array PostgreSQL).
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    count = 0
+    for row in rows:
+        writer.writerow([_format_value(v) for v in row])
+        count += 1
+    if count:
+        _copy_buffer(conn, table, columns, buf)
+    return count
+
+
+def copy_dataframe(conn, table: str, df: pd.DataFrame, columns: List[str] = None) -> int:
+    """Carica un DataFrame colonnare in table via COPY."""
+    columns = list(columns or df.columns)
+    if df.empty:
+        return 0
+    buf = io.StringIO()
+    df[columns].to_csv(buf, header=False, index=False, na_rep=NULL_MARKER, date_format="%Y-%m-%d")
+    _copy_buffer(conn, table, columns, buf)
+    return len(df)
+
+
+class AdaptiveBatch:
+    """
+    Dimensione di batch adattiva per i flush.
+    Stima il throughput (righe/s) con una media mobile esponenziale e
+    sceglie la dimensione che porta ogni flush a circa target_seconds,
+    entro [min_size, max_size].
+    """
+
+    def __init__(
+        self,
+        size: int,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        target_seconds: float = 2.0,
+        smoothing: float = 0.3,
+    ):
+        self.min_size = min_size or size
+        self.max_size = max_size or size
+        self.size = min(max(size, self.min_size), self.max_size)
+        self.target_seconds = target_seconds
+        self.smoothing = smoothing
+        self.rate: Optional[float] = None
+
+    def record(self, rows: int, seconds: float):
+        """Registra un flush di rows righe durato seconds e ricalcola la dimensione."""
+        if rows <= 0 or seconds <= 0:
+            return
+        rate = rows / seconds
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate = (1 - self.smoothing) * self.rate + self.smoothing * rate
+        target = int(self.rate * self.target_seconds)
+        self.size = min(max(target, self.min_size), self.max_size)
@@ -8,6 +8,7 @@ from app.models.player import Player
 from app.models.match import Match
 
 from app.services.scheduler import start_scheduler
+from app.services.serving_snapshot import SERVING_MODE, load_snapshot
 from app.routes.predict import router as predict_router
 from app.routes.value_bets import router as value_bets_router
 from app.routes.players import router as players_router
@@ -52,6 +53,13 @@ def startup_db():
     Base.metadata.create_all(bind=engine)
     logger.info("Database ready")
 
+@app.on_event("startup")
+def startup_serving_snapshot():
+    if SERVING_MODE == "snapshot":
+        logger.info("Loading serving snapshot")
+        load_snapshot()
+        logger.info("Serving snapshot ready")
+
 @app.on_event("startup")
 def startup_scheduler():
     logger.info("Starting scheduler")
@@ -15,6 +15,11 @@ class Match(Base):
 
     id = Column(Integer, primary_key=True)
 
+    # Chiave naturale: "tourney_id#match_num" (o hash di data/giocatori/round/score)
+    match_key = Column(String, unique=True, index=True)
+    # Famiglia del file sorgente: main, qual_chall, futures, amateur
+    source = Column(String(16), index=True)
+
     # Info torneo
     match_date = Column(Date, nullable=False, index=True)
     surface = Column(String)
@@ -7,12 +7,15 @@ Endpoint per predizioni match.
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional, Dict
+import numpy as np
 import pandas as pd
 import joblib
 from pathlib import Path
 
 from ml.feature_pipeline import (
+    compute_batch_features,
     compute_features_row,
+    diff_features,
     get_features_with_details,
     FEATURE_COLUMNS,
 )
@@ -21,6 +24,8 @@ MODEL_PATH = Path("/data/ml/models/tennis_model_calibrated.joblib")
 
 router = APIRouter(tags=["predictions"])
 
+EDGE_THRESHOLD = 0.03
+
 # Carica modello all'avvio
 try:
     model = joblib.load(MODEL_PATH)
@@ -108,35 +113,16 @@ def predict(req: PredictRequest):
         edge_b = None
         value_bet = None
         
-        EDGE_THRESHOLD = 0.03
-        
         if req.odds_a and req.odds_b:
             implied_a = 1 / req.odds_a
             implied_b = 1 / req.odds_b
             
             edge_a = prob_a - implied_a
             edge_b = prob_b - implied_b
-            
-            if edge_a >= EDGE_THRESHOLD:
-                value_bet = f"BET {req.player_a} (edge: {edge_a:.1%})"
-            elif edge_b >= EDGE_THRESHOLD:
-                value_bet = f"BET {req.player_b} (edge: {edge_b:.1%})"
-            else:
-                value_bet = "NO VALUE"
+            value_bet = value_bet_label(req, edge_a, edge_b)
         
-        return PredictResponse(
-            player_a=req.player_a,
-            player_b=req.player_b,
-            surface=req.surface,
-            prob_a=round(prob_a, 4),
-            prob_b=round(prob_b, 4),
-            features={k: round(v, 3) for k, v in model_features.items()},
-            player_a_details={k: round(v, 3) for k, v in feat_a.items()},
-            player_b_details={k: round(v, 3) for k, v in feat_b.items()},
-            edge_a=round(edge_a, 4) if edge_a else None,
-            edge_b=round(edge_b, 4) if edge_b else None,
-            value_bet=value_bet,
-        )
+        return prediction_response(req, prob_a, prob_b, model_features, feat_a, feat_b,
+                                   edge_a, edge_b, value_bet)
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -144,25 +130,102 @@ def predict(req: PredictRequest):
         raise HTTPException(status_code=500, detail=f"Errore predizione: {str(e)}")
 
 
+def value_bet_label(req: PredictRequest, edge_a: float, edge_b: float) -> str:
+    if edge_a >= EDGE_THRESHOLD:
+        return f"BET {req.player_a} (edge: {edge_a:.1%})"
+    if edge_b >= EDGE_THRESHOLD:
+        return f"BET {req.player_b} (edge: {edge_b:.1%})"
+    return "NO VALUE"
+
+
+def prediction_response(
+    req: PredictRequest,
+    prob_a: float,
+    prob_b: float,
+    model_features: Dict[str, float],
+    feat_a: Dict[str, float],
+    feat_b: Dict[str, float],
+    edge_a: Optional[float],
+    edge_b: Optional[float],
+    value_bet: Optional[str],
+) -> PredictResponse:
+    return PredictResponse(
+        player_a=req.player_a,
+        player_b=req.player_b,
+        surface=req.surface,
+        prob_a=round(prob_a, 4),
+        prob_b=round(prob_b, 4),
+        features={k: round(v, 3) for k, v in model_features.items()},
+        player_a_details={k: round(v, 3) for k, v in feat_a.items()},
+        player_b_details={k: round(v, 3) for k, v in feat_b.items()},
+        edge_a=round(edge_a, 4) if edge_a else None,
+        edge_b=round(edge_b, 4) if edge_b else None,
+        value_bet=value_bet,
+    )
+
+
 @router.post("/predict/batch")
 def predict_batch(matches: list[PredictRequest]):
-    """Predizione batch per più partite."""
+    """
+    Predizione batch per più partite: feature di tutte le partite lette
+    in blocco, una sola matrice e una sola chiamata a predict_proba,
+    edge calcolati in forma vettoriale.
+    """
     
     if not MODEL_LOADED:
         raise HTTPException(status_code=503, detail="Modello non disponibile")
     
-    results = []
+    def error(match: PredictRequest, detail: str) -> Dict:
+        return {"player_a": match.player_a, "player_b": match.player_b, "error": detail}
     
-    for match in matches:
-        try:
-            result = predict(match)
-            results.append(result.model_dump())
-        except HTTPException as e:
-            results.append({
-                "player_a": match.player_a,
-                "player_b": match.player_b,
-                "error": e.detail
-            })
+    try:
+        features = compute_batch_features(
+            [(m.player_a, m.player_b, m.surface, "A") for m in matches]
+        )
+    except Exception as e:
+        # Lettura delle feature fallita: nessun risultato per nessuna partita
+        return [error(m, f"Errore predizione: {str(e)}") for m in matches]
+    
+    # Giocatori non trovati: errore solo sulla propria partita
+    results = [
+        error(m, str(f)) if isinstance(f, ValueError) else None
+        for m, f in zip(matches, features)
+    ]
+    valid = [i for i, f in enumerate(features) if not isinstance(f, ValueError)]
+    if not valid:
+        return results
+    
+    diffs = [diff_features(*features[i]) for i in valid]
+    X = pd.DataFrame(diffs, columns=FEATURE_COLUMNS)
+    try:
+        prob = model.predict_proba(X)
+    except Exception as e:
+        for i in valid:
+            results[i] = error(matches[i], f"Errore predizione: {str(e)}")
+        return results
+    prob_a, prob_b = prob[:, 1].astype(float), prob[:, 0].astype(float)
+    
+    # Edge solo dove entrambe le quote sono presenti (e non nulle)
+    odds_a = np.array([matches[i].odds_a or np.nan for i in valid], dtype=float)
+    odds_b = np.array([matches[i].odds_b or np.nan for i in valid], dtype=float)
+    has_odds = ~np.isnan(odds_a) & ~np.isnan(odds_b)
+    edge_a = prob_a - 1 / odds_a
+    edge_b = prob_b - 1 / odds_b
+    
+    for j, i in enumerate(valid):
+        match = matches[i]
+        feat_a, feat_b = features[i]
+        model_features = {k: v for k, v in diffs[j].items() if k in FEATURE_COLUMNS}
+        
+        e_a = e_b = value_bet = None
+        if has_odds[j]:
+            e_a, e_b = float(edge_a[j]), float(edge_b[j])
+            value_bet = value_bet_label(match, e_a, e_b)
+        
+        results[i] = prediction_response(
+            match, float(prob_a[j]), float(prob_b[j]), model_features, feat_a, feat_b,
+            e_a, e_b, value_bet,
+        ).model_dump()
     
     return results
 
@@ -5,11 +5,20 @@ Funzioni per recuperare feature dal feature store per predizioni live.
 """
 
 from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
 from sqlalchemy import text
 from app.database import engine
 
 BASE_ELO = 1500.0
 
+# Colonne di player_serve_state lette per le statistiche servizio
+SERVE_TOTALS = (
+    "ace_total", "df_total", "svpt_total",
+    "first_in_total", "first_won_total", "second_won_total",
+    "bp_faced_total", "bp_saved_total",
+)
+
 
 def get_player_id(name: str) -> int:
     """Ottiene l'ID di un giocatore dal nome."""
@@ -32,6 +41,11 @@ def get_surface_state(pid: int, surface: str):
             WHERE player_id = :pid AND surface = :surface
         """), {"pid": pid, "surface": surface}).fetchone()
 
+    return surface_values(r)
+
+
+def surface_values(r) -> Tuple[float, float]:
+    """(elo, win rate) da una riga (elo, matches_cnt, wins_cnt) o None."""
     if not r:
         return BASE_ELO, 0.0
 
@@ -49,10 +63,15 @@ def get_form(pid: int):
             WHERE player_id = :pid
         """), {"pid": pid}).fetchone()
 
-    if not r or not r.last_results:
+    return form_values(r.last_results if r else None)
+
+
+def form_values(last_results) -> Tuple[float, float]:
+    """(recent_5, recent_10) dagli ultimi risultati (0/1) o None."""
+    if not last_results:
         return 0.0, 0.0
 
-    results = list(r.last_results)
+    results = list(last_results)
     last_5 = results[-5:] if len(results) >= 5 else results
     last_10 = results[-10:] if len(results) >= 10 else results
 
@@ -77,10 +96,8 @@ def get_latest_rank(pid: int) -> int:
     with engine.connect() as conn:
         r = conn.execute(text("""
             SELECT rank
-            FROM player_match_features
-            WHERE player_id = :pid AND rank IS NOT NULL
-            ORDER BY match_date DESC
-            LIMIT 1
+            FROM player_latest_state
+            WHERE player_id = :pid
         """), {"pid": pid}).scalar()
     if r is None:
         return 500  # Default se non disponibile
@@ -96,10 +113,15 @@ def get_days_since_last_match(pid: int) -> int:
             WHERE player_id = :pid
         """), {"pid": pid}).scalar()
     
-    if r is None:
+    return days_since(r)
+
+
+def days_since(last_match_date) -> int:
+    """Giorni da last_match_date a oggi (7 se sconosciuta)."""
+    if last_match_date is None:
         return 7  # Default: una settimana
     
-    days = (date.today() - r).days
+    days = (date.today() - last_match_date).days
     return max(0, days)
 
 
@@ -112,10 +134,15 @@ def get_player_age(pid: int) -> float:
             WHERE id = :pid
         """), {"pid": pid}).scalar()
     
-    if r is None:
+    return age_from_birth_date(r)
+
+
+def age_from_birth_date(birth_date) -> float:
+    """Età a oggi (25.0 se la data di nascita manca)."""
+    if birth_date is None:
         return 25.0  # Default
     
-    age = (date.today() - r).days / 365.25
+    age = (date.today() - birth_date).days / 365.25
     return round(age, 1)
 
 
@@ -125,12 +152,19 @@ def get_matches_last_30_days(pid: int) -> int:
     
     with engine.connect() as conn:
         r = conn.execute(text("""
-            SELECT COUNT(*)
-            FROM player_match_features
-            WHERE player_id = :pid AND match_date >= :cutoff
-        """), {"pid": pid, "cutoff": cutoff}).scalar()
+            SELECT recent_match_dates
+            FROM player_latest_state
+            WHERE player_id = :pid
+        """), {"pid": pid}).scalar()
     
-    return int(r) if r else 0
+    return count_since(r, cutoff)
+
+
+def count_since(match_dates, cutoff: date) -> int:
+    """Numero di date (recent_match_dates o None) da cutoff in poi."""
+    if not match_dates:
+        return 0
+    return sum(1 for d in match_dates if d >= cutoff)
 
 
 def get_serve_stats(pid: int):
@@ -144,6 +178,11 @@ def get_serve_stats(pid: int):
             WHERE player_id = :pid
         """), {"pid": pid}).fetchone()
     
+    return serve_values(r)
+
+
+def serve_values(r) -> Dict[str, float]:
+    """Percentuali servizio da una riga con le colonne SERVE_TOTALS o None."""
     if not r or not r.svpt_total or r.svpt_total == 0:
         return {
             "ace_pct": 0.0,
@@ -174,7 +213,150 @@ def get_level_experience(pid: int, level: str) -> float:
             WHERE player_id = :pid AND level = :level
         """), {"pid": pid, "level": level}).fetchone()
     
+    return level_values(r)
+
+
+def level_values(r) -> float:
+    """Win rate da una riga (matches_cnt, wins_cnt) o None."""
     if not r or not r.matches_cnt or r.matches_cnt == 0:
         return 0.0
     
     return r.wins_cnt / r.matches_cnt
+
+
+# =============================================================================
+# BATCH FETCH
+# =============================================================================
+
+def get_player_ids(names: Iterable[str], conn=None) -> Dict[str, int]:
+    """Nome -> id per tutti i nomi trovati, con una sola query."""
+    names = list(dict.fromkeys(names))
+    if conn is None:
+        with engine.connect() as conn:
+            return get_player_ids(names, conn)
+
+    rows = conn.execute(
+        text("SELECT id, name FROM players WHERE name = ANY(:names)"),
+        {"names": names},
+    )
+    return {r.name: int(r.id) for r in rows}
+
+
+def resolve_player_ids(names: Sequence[str], conn=None) -> List[int]:
+    """Id dei giocatori nell'ordine di names (ValueError se uno manca)."""
+    ids = get_player_ids(names, conn)
+    for name in names:
+        if name not in ids:
+            raise ValueError(f"Giocatore non trovato: {name}")
+    return [ids[name] for name in names]
+
+
+def get_features_batch(
+    player_ids: Iterable[int],
+    surfaces: Optional[Iterable[str]],
+    levels: Optional[Iterable[str]],
+    conn=None,
+) -> Dict[str, Dict]:
+    """
+    Stato raw di un insieme di giocatori con tre query set-based sulla
+    stessa connessione (player_latest_state, superficie/livello, h2h),
+    negli stessi formati delle funzioni get_* singole.
+    surfaces/levels None: tutte le superfici/tutti i livelli.
+
+    Returns:
+        Dict con chiavi surface {(pid, surface)}, level {(pid, level)},
+        h2h {(pid, opponent_id)} e player {pid} (form, rank, riposo,
+        età, match ultimi 30 giorni, servizio)
+    """
+    ids = sorted({int(pid) for pid in player_ids})
+    if conn is None:
+        with engine.connect() as conn:
+            return get_features_batch(ids, surfaces, levels, conn)
+
+    cutoff = date.today() - timedelta(days=30)
+    params = {"ids": ids}
+    surface_filter = level_filter = ""
+    if surfaces is not None:
+        params["surfaces"] = list(set(surfaces))
+        surface_filter = "AND surface = ANY(:surfaces)"
+    if levels is not None:
+        params["levels"] = list(set(levels))
+        level_filter = "AND level = ANY(:levels)"
+
+    player = {}
+    for r in conn.execute(text(f"""
+        SELECT
+            ids.player_id,
+            p.birth_date,
+            l.last_results,
+            l.last_match_date,
+            {", ".join(f"l.{c}" for c in SERVE_TOTALS)},
+            l.rank,
+            l.recent_match_dates
+        FROM unnest(CAST(:ids AS INTEGER[])) AS ids(player_id)
+        LEFT JOIN player_latest_state l ON l.player_id = ids.player_id
+        LEFT JOIN players p ON p.id = ids.player_id
+    """), params):
+        recent_5, recent_10 = form_values(r.last_results)
+        player[r.player_id] = {
+            "recent_5": recent_5,
+            "recent_10": recent_10,
+            "rank": int(r.rank) if r.rank is not None else 500,
+            "days_rest": days_since(r.last_match_date),
+            "age": age_from_birth_date(r.birth_date),
+            "matches_30d": count_since(r.recent_match_dates, cutoff),
+            "serve": serve_values(r),
+        }
+
+    surface, level = {}, {}
+    for r in conn.execute(text(f"""
+        SELECT 'surface' AS kind, player_id, surface AS key, elo, matches_cnt, wins_cnt
+        FROM player_surface_state
+        WHERE player_id = ANY(:ids) {surface_filter}
+        UNION ALL
+        SELECT 'level', player_id, level, NULL, matches_cnt, wins_cnt
+        FROM player_level_state
+        WHERE player_id = ANY(:ids) {level_filter}
+    """), params):
+        if r.kind == "surface":
+            surface[(r.player_id, r.key)] = surface_values((r.elo, r.matches_cnt, r.wins_cnt))
+        else:
+            level[(r.player_id, r.key)] = level_values(r)
+
+    h2h = get_h2h_batch(ids, conn)
+
+    return {"player": player, "surface": surface, "level": level, "h2h": h2h}
+
+
+def get_h2h_batch(player_ids: Iterable[int], conn) -> Dict[Tuple[int, int], int]:
+    """Vittorie (pid, opponent_id) per tutte le coppie tra player_ids."""
+    rows = conn.execute(text("""
+        SELECT player_id, opponent_id, wins
+        FROM h2h_state
+        WHERE player_id = ANY(:ids) AND opponent_id = ANY(:ids)
+    """), {"ids": sorted({int(pid) for pid in player_ids})})
+    return {(r.player_id, r.opponent_id): int(r.wins) if r.wins else 0 for r in rows}
+
+
+def player_features(batch: Dict[str, Dict], pid: int, opponent_id: int, surface: str, level: str) -> Dict:
+    """Feature raw di un giocatore da get_features_batch() (stessi default dei get_*)."""
+    elo, surface_wr = batch["surface"].get((pid, surface), (BASE_ELO, 0.0))
+    p = batch["player"][pid]
+    serve = p["serve"]
+    return {
+        "elo": elo,
+        "surface_wr": surface_wr,
+        "recent_5": p["recent_5"],
+        "recent_10": p["recent_10"],
+        "h2h_wins": batch["h2h"].get((pid, opponent_id), 0),
+        "rank": p["rank"],
+        "days_rest": p["days_rest"],
+        "age": p["age"],
+        "matches_30d": p["matches_30d"],
+        "ace_pct": serve["ace_pct"],
+        "df_pct": serve["df_pct"],
+        "first_serve_pct": serve["first_serve_pct"],
+        "first_won_pct": serve["first_won_pct"],
+        "bp_save_pct": serve["bp_save_pct"],
+        "level_wr": batch["level"].get((pid, level), 0.0),
+    }
@@ -0,0 +1,219 @@
+"""
+Player State Cache
+===================
+Cache in-process dello stato per giocatore letto da feature_service.
+
+Lo stato cambia solo quando feature_store_build scrive un flush, che
+incrementa feature_store_cursor.version: le voci in cache valgono per una
+versione (e per la data di oggi, da cui dipendono riposo, età e match
+negli ultimi 30 giorni). La versione è riletta al massimo ogni
+FEATURE_CACHE_VERSION_TTL secondi; se è cambiata la cache si svuota e si
+riempie di nuovo alla prima richiesta. Le predizioni ripetute sugli
+stessi giocatori non toccano il database.
+
+Dimensione: FEATURE_CACHE_SIZE giocatori (LRU, 0 disabilita la cache).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.services.feature_service import get_features_batch, get_h2h_batch, get_player_ids
+
+CACHE_SIZE = int(os.getenv("FEATURE_CACHE_SIZE", "4096"))
+VERSION_TTL = float(os.getenv("FEATURE_CACHE_VERSION_TTL", "10"))
+
+# Coppie h2h in cache per giocatore (entrambe le direzioni)
+H2H_PER_PLAYER = 8
+
+
+def get_store_version(conn) -> int:
+    """Versione del feature store (0 se il builder non ha mai scritto)."""
+    try:
+        version = conn.execute(text("""
+            SELECT version FROM feature_store_cursor WHERE id = 1
+        """)).scalar()
+    except Exception:
+        conn.rollback()
+        return 0
+    return int(version) if version is not None else 0
+
+
+class LRU(OrderedDict):
+    """OrderedDict con limite di voci: get() aggiorna l'ordine d'uso."""
+
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.max_size:
+            self.popitem(last=False)
+
+
+class PlayerStateCache:
+    """
+    Nomi -> id, stato per giocatore (tutte le superfici e i livelli) e h2h,
+    validi per (versione del feature store, data di oggi).
+    """
+
+    def __init__(self, max_players: int = CACHE_SIZE, version_ttl: float = VERSION_TTL):
+        self.version_ttl = version_ttl
+        self.names = LRU(max_players)
+        self.players = LRU(max_players)
+        self.h2h = LRU(max_players * H2H_PER_PLAYER)
+        self.key: Optional[Tuple[int, date]] = None
+        self.checked_at = float("-inf")
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.players.max_size > 0
+
+    def clear(self):
+        with self.lock:
+            self.names.clear()
+            self.players.clear()
+            self.h2h.clear()
+
+    def _validate(self):
+        """Svuota la cache se versione o data sono cambiate (controllo ogni version_ttl)."""
+        now = time.monotonic()
+        today = date.today()
+        if self.key is not None and self.key[1] == today and now - self.checked_at < self.version_ttl:
+            return
+        with engine.connect() as conn:
+            key = (get_store_version(conn), today)
+        with self.lock:
+            if key != self.key:
+                self.names.clear()
+                self.players.clear()
+                self.h2h.clear()
+                self.key = key
+            self.checked_at = now
+
+    # -------------------------------------------------------------------------
+
+    def lookup(self, names: Iterable[str]) -> Dict[str, int]:
+        """Nome -> id per i nomi trovati (una query per i nomi non in cache)."""
+        if self.enabled:
+            self._validate()
+        with self.lock:
+            ids = {name: self.names.get(name) for name in names}
+        missing = [name for name, pid in ids.items() if pid is None]
+        if missing:
+            found = get_player_ids(missing)
+            with self.lock:
+                for name, pid in found.items():
+                    self.names.put(name, pid)
+            ids.update(found)
+        return {name: pid for name, pid in ids.items() if pid is not None}
+
+    def resolve(self, names: Sequence[str]) -> List[int]:
+        """Id dei giocatori nell'ordine di names (ValueError se uno manca)."""
+        ids = self.lookup(names)
+        for name in names:
+            if name not in ids:
+                raise ValueError(f"Giocatore non trovato: {name}")
+        return [ids[name] for name in names]
+
+    def features_batch(
+        self,
+        player_ids: Iterable[int],
+        pairs: Optional[Iterable[Tuple[int, int]]] = None,
+    ) -> Dict[str, Dict]:
+        """
+        Stato dei giocatori nel formato di get_features_batch(), con
+        tutte le superfici e i livelli e l'h2h delle coppie in pairs
+        (default tutte le coppie tra player_ids): solo giocatori e coppie
+        mancanti vengono letti dal database (una connessione).
+        """
+        ids = sorted({int(pid) for pid in player_ids})
+        if pairs is None:
+            pairs = [(a, b) for a in ids for b in ids if a != b]
+        if self.enabled:
+            self._validate()
+
+        with self.lock:
+            key = self.key
+            cached = {pid: self.players.get(pid) for pid in ids}
+            h2h = {(int(a), int(b)): self.h2h.get((int(a), int(b))) for a, b in pairs}
+        missing = [pid for pid, entry in cached.items() if entry is None]
+        missing_pairs = [pair for pair, wins in h2h.items() if wins is None]
+        self.hits += len(ids) - len(missing)
+        self.misses += len(missing)
+
+        if missing or missing_pairs:
+            with engine.connect() as conn:
+                todo = missing_pairs
+                if missing:
+                    batch = get_features_batch(missing, None, None, conn)
+                    cached.update(split_batch(batch))
+                    # Coppie tra giocatori appena letti: h2h già nel batch
+                    fetched = set(missing)
+                    for pair in missing_pairs:
+                        if pair[0] in fetched and pair[1] in fetched:
+                            h2h[pair] = batch["h2h"].get(pair, 0)
+                    todo = [pair for pair in missing_pairs if h2h[pair] is None]
+                if todo:
+                    wins = get_h2h_batch({pid for pair in todo for pid in pair}, conn)
+                    for pair in todo:
+                        h2h[pair] = wins.get(pair, 0)
+            with self.lock:
+                if self.key != key:
+                    # Versione cambiata durante la lettura: non salvare
+                    return merge_batch(cached, h2h)
+                for pid in missing:
+                    self.players.put(pid, cached[pid])
+                for pair in missing_pairs:
+                    self.h2h.put(pair, h2h[pair])
+
+        return merge_batch(cached, h2h)
+
+
+def split_batch(batch: Dict[str, Dict]) -> Dict[int, Dict]:
+    """get_features_batch() -> voce di cache per giocatore."""
+    entries = {
+        pid: {"player": player, "surface": {}, "level": {}}
+        for pid, player in batch["player"].items()
+    }
+    for kind in ("surface", "level"):
+        for (pid, key), value in batch[kind].items():
+            entries[pid][kind][key] = value
+    return entries
+
+
+def merge_batch(entries: Dict[int, Dict], h2h: Dict[Tuple[int, int], int]) -> Dict[str, Dict]:
+    """Voci di cache per giocatore -> formato di get_features_batch()."""
+    return {
+        "player": {pid: entry["player"] for pid, entry in entries.items()},
+        "surface": {
+            (pid, key): value
+            for pid, entry in entries.items() for key, value in entry["surface"].items()
+        },
+        "level": {
+            (pid, key): value
+            for pid, entry in entries.items() for key, value in entry["level"].items()
+        },
+        "h2h": h2h,
+    }
+
+
+# Cache condivisa dal processo (API, odds pipeline)
+player_cache = PlayerStateCache()
@@ -0,0 +1,337 @@
+"""
+Serving Snapshot
+=================
+Stato di TUTTI i giocatori in array NumPy densi, per calcolare le feature
+live senza query (FEATURE_SERVING=snapshot).
+
+- una riga per giocatore: ranking, date (giorni), form e percentuali
+  servizio già calcolate, Elo/win rate per superficie, win rate per livello
+- date recenti dei match in formato CSR (offset per giocatore)
+- h2h come indice ordinato di coppie (player_id << 32 | opponent_id)
+
+Lo snapshot è caricato all'avvio in una sola transazione REPEATABLE READ
+(coerente con feature_store_cursor.version). La versione è riletta al
+massimo ogni FEATURE_CACHE_VERSION_TTL secondi: se è cambiata un thread
+carica il nuovo snapshot e lo sostituisce con un solo assegnamento,
+mentre le richieste continuano a leggere il precedente.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from app.database import engine
+from app.services.feature_service import BASE_ELO, SERVE_TOTALS, form_values
+from app.services.player_cache import VERSION_TTL, get_store_version
+
+logger = logging.getLogger(__name__)
+
+SERVING_MODE = os.getenv("FEATURE_SERVING", "cache").lower()
+
+SERVE_FEATURES = ("ace_pct", "df_pct", "first_serve_pct", "first_won_pct", "bp_save_pct")
+
+# Default come in feature_service
+DEFAULT_RANK = 500
+DEFAULT_DAYS_REST = 7
+DEFAULT_AGE = 25.0
+ACTIVITY_DAYS = 30
+
+NO_DAY = np.iinfo(np.int64).min
+EPOCH = date(1970, 1, 1)
+
+
+def to_days(values: pd.Series) -> np.ndarray:
+    """Date (o None) -> giorni dal 1970 (NO_DAY se mancanti)."""
+    days = pd.to_datetime(values).to_numpy("datetime64[D]")
+    return np.where(np.isnat(days), NO_DAY, days.astype(np.int64))
+
+
+def day_number(d: date) -> int:
+    return (d - EPOCH).days
+
+
+def pair_keys(player_ids, opponent_ids) -> np.ndarray:
+    return (np.asarray(player_ids, dtype=np.int64) << 32) | np.asarray(opponent_ids, dtype=np.int64)
+
+
+# =============================================================================
+# SNAPSHOT
+# =============================================================================
+
+class ServingSnapshot:
+    """Stato di serving immutabile, valido per una versione del feature store."""
+
+    def __init__(
+        self,
+        version: int,
+        players: pd.DataFrame,
+        latest: pd.DataFrame,
+        surface: pd.DataFrame,
+        level: pd.DataFrame,
+        h2h: pd.DataFrame,
+    ):
+        self.version = version
+        self.names: Dict[str, int] = dict(zip(players["name"], players["id"].astype(int)))
+
+        # Tutti i giocatori di players: anche senza stato hanno data di nascita
+        self.player_ids = np.unique(np.concatenate([
+            players["id"].to_numpy(np.int64),
+            latest["player_id"].to_numpy(np.int64),
+            surface["player_id"].to_numpy(np.int64),
+            level["player_id"].to_numpy(np.int64),
+        ]))
+        n = len(self.player_ids)
+
+        # Stato per giocatore (player_latest_state)
+        idx = self.index_of(latest["player_id"])
+        self.rank = np.full(n, DEFAULT_RANK, dtype=np.int64)
+        ranks = latest["rank"].to_numpy(np.float64)
+        has_rank = ~np.isnan(ranks)
+        self.rank[idx[has_rank]] = ranks[has_rank]
+        self.last_day = np.full(n, NO_DAY, dtype=np.int64)
+        self.last_day[idx] = to_days(latest["last_match_date"])
+        self.birth_day = np.full(n, NO_DAY, dtype=np.int64)
+        self.birth_day[self.index_of(players["id"])] = to_days(players["birth_date"])
+
+        self.recent_5 = np.zeros(n)
+        self.recent_10 = np.zeros(n)
+        form = np.array([form_values(r) for r in latest["last_results"]], dtype=np.float64).reshape(-1, 2)
+        self.recent_5[idx], self.recent_10[idx] = form[:, 0], form[:, 1]
+
+        serve = serve_arrays(latest)
+        self.serve = {}
+        for name in SERVE_FEATURES:
+            self.serve[name] = np.zeros(n)
+            self.serve[name][idx] = serve[name]
+
+        # Date recenti in CSR: recent_days[recent_offsets[i]:recent_offsets[i + 1]]
+        recent = [list(r) if r is not None else [] for r in latest["recent_match_dates"]]
+        counts = np.zeros(n, dtype=np.int64)
+        counts[idx] = [len(r) for r in recent]
+        self.recent_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.recent_days = np.empty(self.recent_offsets[-1], dtype=np.int64)
+        for i, dates in zip(idx.tolist(), recent):
+            start = self.recent_offsets[i]
+            self.recent_days[start:start + len(dates)] = sorted(day_number(d) for d in dates)
+
+        # Elo e win rate per superficie
+        self.surfaces = {s: i for i, s in enumerate(sorted(surface["surface"].unique()))}
+        self.surface_elo = np.full((n, len(self.surfaces)), BASE_ELO)
+        self.surface_wr = np.zeros((n, len(self.surfaces)))
+        rows = self.index_of(surface["player_id"])
+        cols = surface["surface"].map(self.surfaces).to_numpy(np.int64)
+        self.surface_elo[rows, cols] = surface["elo"].to_numpy(np.float64)
+        self.surface_wr[rows, cols] = win_rates(surface)
+
+        # Win rate per livello torneo
+        self.levels = {lv: i for i, lv in enumerate(sorted(level["level"].unique()))}
+        self.level_wr = np.zeros((n, len(self.levels)))
+        rows = self.index_of(level["player_id"])
+        cols = level["level"].map(self.levels).to_numpy(np.int64)
+        self.level_wr[rows, cols] = win_rates(level)
+
+        # h2h: coppie ordinate per searchsorted
+        keys = pair_keys(h2h["player_id"], h2h["opponent_id"])
+        order = np.argsort(keys)
+        self.h2h_keys = keys[order]
+        self.h2h_wins = h2h["wins"].fillna(0).to_numpy(np.int64)[order]
+
+    @classmethod
+    def load(cls) -> "ServingSnapshot":
+        """Legge tutto lo stato di serving in una transazione coerente."""
+        with engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+            version = get_store_version(conn)
+            players = pd.read_sql(text("SELECT id, name, birth_date FROM players"), conn)
+            latest = pd.read_sql(text(f"""
+                SELECT player_id, rank, last_match_date, recent_match_dates, last_results,
+                       {", ".join(SERVE_TOTALS)}
+                FROM player_latest_state
+            """), conn)
+            surface = pd.read_sql(text("""
+                SELECT player_id, surface, elo, matches_cnt, wins_cnt
+                FROM player_surface_state
+            """), conn)
+            level = pd.read_sql(text("""
+                SELECT player_id, level, matches_cnt, wins_cnt
+                FROM player_level_state
+            """), conn)
+            h2h = pd.read_sql(text("""
+                SELECT player_id, opponent_id, wins
+                FROM h2h_state
+            """), conn)
+        return cls(version, players, latest, surface, level, h2h)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [v for v in vars(self).values() if isinstance(v, np.ndarray)]
+        return sum(a.nbytes for a in arrays + list(self.serve.values()))
+
+    def index_of(self, player_ids) -> np.ndarray:
+        """Posizione dei giocatori negli array (-1 se senza stato)."""
+        ids = np.asarray(player_ids, dtype=np.int64)
+        if len(self.player_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.player_ids, ids), len(self.player_ids) - 1)
+        return np.where(self.player_ids[pos] == ids, pos, -1)
+
+    # -------------------------------------------------------------------------
+
+    def lookup(self, names: Iterable[str]) -> Dict[str, int]:
+        """Nome -> id per i nomi trovati."""
+        return {name: self.names[name] for name in names if name in self.names}
+
+    def resolve(self, names: Sequence[str]) -> List[int]:
+        """Id dei giocatori nell'ordine di names (ValueError se uno manca)."""
+        ids = []
+        for name in names:
+            pid = self.names.get(name)
+            if pid is None:
+                raise ValueError(f"Giocatore non trovato: {name}")
+            ids.append(pid)
+        return ids
+
+    def h2h(self, pid: int, opponent_id: int) -> int:
+        key = (int(pid) << 32) | int(opponent_id)
+        pos = int(np.searchsorted(self.h2h_keys, key))
+        if pos < len(self.h2h_keys) and self.h2h_keys[pos] == key:
+            return int(self.h2h_wins[pos])
+        return 0
+
+    def matches_since(self, i: int, cutoff: int) -> int:
+        days = self.recent_days[self.recent_offsets[i]:self.recent_offsets[i + 1]]
+        return int(len(days) - np.searchsorted(days, cutoff))
+
+    def player_features(self, pid: int, opponent_id: int, surface: str, level: str,
+                        today: Optional[date] = None) -> Dict:
+        """Stesso dict di feature_service.player_features()."""
+        today = today or date.today()
+        i = int(self.index_of([pid])[0])
+        h2h_wins = self.h2h(pid, opponent_id)
+        if i < 0:
+            return {
+                "elo": BASE_ELO, "surface_wr": 0.0, "recent_5": 0.0, "recent_10": 0.0,
+                "h2h_wins": h2h_wins, "rank": DEFAULT_RANK, "days_rest": DEFAULT_DAYS_REST,
+                "age": DEFAULT_AGE, "matches_30d": 0,
+                **{name: 0.0 for name in SERVE_FEATURES}, "level_wr": 0.0,
+            }
+
+        today_day = day_number(today)
+        s = self.surfaces.get(surface)
+        lv = self.levels.get(level)
+        last_day, birth_day = int(self.last_day[i]), int(self.birth_day[i])
+        return {
+            "elo": float(self.surface_elo[i, s]) if s is not None else BASE_ELO,
+            "surface_wr": float(self.surface_wr[i, s]) if s is not None else 0.0,
+            "recent_5": float(self.recent_5[i]),
+            "recent_10": float(self.recent_10[i]),
+            "h2h_wins": h2h_wins,
+            "rank": int(self.rank[i]),
+            "days_rest": max(0, today_day - last_day) if last_day != NO_DAY else DEFAULT_DAYS_REST,
+            "age": round((today_day - birth_day) / 365.25, 1) if birth_day != NO_DAY else DEFAULT_AGE,
+            "matches_30d": self.matches_since(i, today_day - ACTIVITY_DAYS),
+            **{name: float(self.serve[name][i]) for name in SERVE_FEATURES},
+            "level_wr": float(self.level_wr[i, lv]) if lv is not None else 0.0,
+        }
+
+    def match_features(self, player_a: str, player_b: str, surface: str, level: str) -> Tuple[Dict, Dict]:
+        id_a, id_b = self.resolve([player_a, player_b])
+        today = date.today()
+        return (
+            self.player_features(id_a, id_b, surface, level, today),
+            self.player_features(id_b, id_a, surface, level, today),
+        )
+
+
+def win_rates(df: pd.DataFrame) -> np.ndarray:
+    """wins_cnt / matches_cnt (0 senza match), come surface_values/level_values."""
+    matches = df["matches_cnt"].fillna(0).to_numpy(np.float64)
+    wins = df["wins_cnt"].fillna(0).to_numpy(np.float64)
+    return np.divide(wins, matches, out=np.zeros(len(df)), where=matches > 0)
+
+
+def serve_arrays(latest: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Percentuali servizio vettoriali, come feature_service.serve_values()."""
+    t = {c: latest[c].fillna(0).to_numpy(np.float64) for c in SERVE_TOTALS}
+    svpt, first_in = t["svpt_total"], t["first_in_total"]
+    has_svpt = svpt > 0
+    zeros = np.zeros(len(latest))
+    values = {
+        "ace_pct": np.divide(t["ace_total"], svpt, out=zeros.copy(), where=has_svpt),
+        "df_pct": np.divide(t["df_total"], svpt, out=zeros.copy(), where=has_svpt),
+        "first_serve_pct": np.divide(first_in, svpt, out=zeros.copy(), where=has_svpt),
+        "first_won_pct": np.divide(t["first_won_total"], first_in, out=zeros.copy(),
+                                   where=has_svpt & (first_in > 0)),
+        "bp_save_pct": np.where(
+            has_svpt, t["bp_saved_total"] / np.where(t["bp_faced_total"] > 0, t["bp_faced_total"], 1), 0.0
+        ),
+    }
+    return values
+
+
+# =============================================================================
+# HOT SWAP
+# =============================================================================
+
+_snapshot: Optional[ServingSnapshot] = None
+_checked_at = float("-inf")
+_lock = threading.Lock()
+_loading = False
+
+
+def load_snapshot() -> ServingSnapshot:
+    """Carica un nuovo snapshot e lo pubblica (assegnamento atomico)."""
+    global _snapshot, _checked_at
+    start = time.perf_counter()
+    snapshot = ServingSnapshot.load()
+    _snapshot = snapshot
+    _checked_at = time.monotonic()
+    logger.info(
+        "Snapshot serving v%d: %d giocatori, %d h2h, %.1f MB in %.1fs",
+        snapshot.version, len(snapshot.player_ids), len(snapshot.h2h_keys),
+        snapshot.nbytes / 1e6, time.perf_counter() - start,
+    )
+    return snapshot
+
+
+def _reload():
+    global _loading
+    try:
+        load_snapshot()
+    except Exception:
+        logger.exception("Snapshot serving non aggiornato")
+    finally:
+        _loading = False
+
+
+def current_snapshot() -> ServingSnapshot:
+    """
+    Snapshot corrente (caricato alla prima chiamata). Se la versione del
+    feature store è cambiata avvia il caricamento in background e
+    continua a rispondere con lo snapshot precedente.
+    """
+    global _checked_at, _loading
+    snapshot = _snapshot
+    if snapshot is None:
+        with _lock:
+            return _snapshot or load_snapshot()
+
+    now = time.monotonic()
+    if now - _checked_at < VERSION_TTL or _loading:
+        return snapshot
+    with _lock:
+        if _loading or now - _checked_at < VERSION_TTL:
+            return snapshot
+        _checked_at = now
+        with engine.connect() as conn:
+            version = get_store_version(conn)
+        if version != snapshot.version:
+            _loading = True
+            threading.Thread(target=_reload, name="serving-snapshot", daemon=True).start()
+    return snapshot
@@ -5,175 +5,375 @@ Importa i CSV di Jeff Sackmann (tennis_atp) nel database.
 Cattura tutti i campi disponibili: dati biografici, età, statistiche servizio.
 """
 
-import glob
+import argparse
+import hashlib
 import os
-from datetime import datetime, date
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, List, Tuple
 
 import pandas as pd
 from tqdm import tqdm
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from app.database import SessionLocal
-from app.models.player import Player
+from app.bulk_copy import column_list, copy_dataframe, create_staging_table, quote_ident
+from app.database import SessionLocal, engine
 from app.models.match import Match
+from importer.manifest import changed_files, ensure_manifest_table, load_manifest, record_file
+from importer.normalize import format_rejects, to_birth_date
+from importer.sources import (
+    DATA_DIR, DEFAULT_FAMILIES, LEVEL_ALIASES, MATCH_CSV_COLUMNS, SINGLES_FAMILIES,
+    discover_files, normalize_csv, source_family,
+)
+from importer.player_registry import PlayerRegistry
+from importer.staging import iter_staged_batches, stage_file
+
+# Righe per chunk nella lettura in streaming
+CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", "50000"))
+
+MATCH_COLUMNS = ["match_key", "source", "match_date", "winner_id", "loser_id", *MATCH_CSV_COLUMNS]
+
+# Worker per il parsing parallelo (0 = import sequenziale)
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", "0"))
+
+# Lettura dallo staging Parquet invece che dai CSV
+USE_STAGING = os.environ.get("IMPORT_STAGING", "true").lower() == "true"
+
+
+def hash_match_key(match_date, winner, loser, round_, score) -> str:
+    """Chiave di fallback per righe senza tourney_id/match_num."""
+    raw = f"{match_date:%Y%m%d}|{winner}|{loser}|{round_}|{score}"
+    return "h:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def build_match_keys(norm: pd.DataFrame) -> pd.Series:
+    """
+    Chiave naturale per ogni riga (colonne già normalizzate):
+    tourney_id#match_num, altrimenti hash.
+    """
+    keys = norm["tourney_id"].astype("string") + "#" + norm["match_num"].astype("string")
+
+    missing = keys.isna()
+    if missing.any():
+        rows = norm.loc[missing]
+        keys[missing] = [
+            hash_match_key(*values)
+            for values in zip(
+                rows["tourney_date"], rows["winner_name"], rows["loser_name"],
+                rows["round"], rows["score"],
+            )
+        ]
+    return keys.astype(object)
+
+
+def ensure_import_schema(conn):
+    """
+    Manifest, colonna match_key (con indice univoco) per import idempotenti
+    e colonna source con la famiglia del file.
+    I match già presenti restano con match_key NULL (matches non ha
+    tourney_id/match_num): l'import li riconosce per chiave naturale,
+    vedi adopt_legacy_matches().
+    """
+    ensure_manifest_table(conn)
+    conn.execute(text("ALTER TABLE matches ADD COLUMN IF NOT EXISTS match_key VARCHAR"))
+    conn.execute(text("ALTER TABLE matches ADD COLUMN IF NOT EXISTS source VARCHAR(16)"))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_matches_match_key ON matches (match_key)
+    """))
 
-DATA_DIR = "/data/raw"
-
-
-def clean_int(value):
-    """Converte in int, gestendo NaN e None."""
-    if value is None:
-        return None
-    if isinstance(value, float) and pd.isna(value):
-        return None
-    try:
-        return int(value)
-    except (ValueError, TypeError):
-        return None
-
-
-def clean_float(value):
-    """Converte in float, gestendo NaN e None."""
-    if value is None:
-        return None
-    if isinstance(value, float) and pd.isna(value):
-        return None
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
-
-
-def parse_date(value):
-    """Parsa data nel formato YYYYMMDD."""
-    if pd.isna(value):
-        return None
-    try:
-        return datetime.strptime(str(int(value)), "%Y%m%d").date()
-    except (ValueError, TypeError):
-        return None
-
-
-def parse_birth_date(value):
-    """Parsa data di nascita nel formato YYYYMMDD."""
-    if pd.isna(value):
-        return None
-    try:
-        val_str = str(int(value))
-        if len(val_str) == 8:
-            return datetime.strptime(val_str, "%Y%m%d").date()
-        elif len(val_str) == 4:
-            # Solo anno
-            return date(int(val_str), 1, 1)
-    except (ValueError, TypeError):
-        pass
-    return None
-
-
-def get_or_create_player(db: Session, name, hand, height, country, birth_date=None):
-    """Ottiene o crea un giocatore."""
-    player = db.query(Player).filter_by(name=name).first()
-    
-    if player:
-        # Aggiorna birth_date se mancante
-        if birth_date and not player.birth_date:
-            player.birth_date = birth_date
-        return player
-
-    player = Player(
-        name=name,
-        hand=hand,
-        height=clean_int(height),
-        country=country,
-        birth_date=birth_date,
-    )
-    db.add(player)
-    db.flush()
-    return player
 
+# Chiave naturale dei match importati prima di match_key
+LEGACY_KEY_COLUMNS = ["match_key", "match_date", "winner_id", "loser_id", "round", "score"]
+
+
+def adopt_legacy_matches(conn, staging: str) -> int:
+    """
+    Assegna la match_key delle righe di staging ai match importati prima
+    di match_key (match_key NULL) con stessi data, giocatori, round e
+    score: l'upsert li aggiorna invece di duplicarli. Una sola riga
+    legacy per chiave naturale, solo chiavi non ancora presenti.
 
-def import_csv_file(csv_path: str, db: Session):
+    Returns:
+        Numero di match legacy adottati
+    """
+    return conn.execute(text(f"""
+        WITH legacy AS (
+            SELECT DISTINCT ON (m.match_date, m.winner_id, m.loser_id, m.round, m.score)
+                   m.id, s.match_key
+            FROM matches m
+            JOIN {staging} s
+              ON m.match_date = s.match_date
+             AND m.winner_id = s.winner_id
+             AND m.loser_id = s.loser_id
+             AND m.round IS NOT DISTINCT FROM s.round
+             AND m.score IS NOT DISTINCT FROM s.score
+            WHERE m.match_key IS NULL
+              AND NOT EXISTS (SELECT 1 FROM matches k WHERE k.match_key = s.match_key)
+            ORDER BY m.match_date, m.winner_id, m.loser_id, m.round, m.score, m.id
+        )
+        UPDATE matches m
+        SET match_key = legacy.match_key
+        FROM legacy
+        WHERE m.id = legacy.id
+    """)).rowcount
+
+
+def import_csv_file(csv_path: str, db: Session, registry: PlayerRegistry = None):
     """Importa un singolo file CSV."""
     
+    if registry is None:
+        registry = PlayerRegistry().load(db.connection())
+
     df = pd.read_csv(csv_path, low_memory=False)
-    df = df.where(pd.notna(df), None)
-
-    for _, row in tqdm(df.iterrows(), total=len(df), desc=os.path.basename(csv_path)):
-        # Parsing date di nascita se disponibili
-        winner_dob = parse_birth_date(row.get("winner_dob"))
-        loser_dob = parse_birth_date(row.get("loser_dob"))
-        
-        # Crea/ottieni giocatori
-        winner = get_or_create_player(
-            db,
-            name=row["winner_name"],
-            hand=row.get("winner_hand"),
-            height=row.get("winner_ht"),
-            country=row.get("winner_ioc"),
-            birth_date=winner_dob,
-        )
+    players, frame, skipped, rejects = prepare_frame(df, source_family(csv_path))
+    report_rejects(skipped, rejects)
 
-        loser = get_or_create_player(
-            db,
-            name=row["loser_name"],
-            hand=row.get("loser_hand"),
-            height=row.get("loser_ht"),
-            country=row.get("loser_ioc"),
-            birth_date=loser_dob,
-        )
+    # Registra i giocatori del file e scrivi i nuovi in blocco
+    registry.add_many(players.to_dict("records"))
+    registry.flush(db.connection())
+
+    frame["match_date"] = frame["match_date"].dt.date
+    frame["winner_id"] = frame["winner_name"].map(registry.ids).astype("Int64")
+    frame["loser_id"] = frame["loser_name"].map(registry.ids).astype("Int64")
+
+    # Match importati prima di match_key: ricevono la chiave della riga CSV
+    conn = db.connection()
+    create_staging_table(conn, "legacy_keys_staging", "matches", LEGACY_KEY_COLUMNS)
+    copy_dataframe(conn, "legacy_keys_staging", frame, LEGACY_KEY_COLUMNS)
+    adopt_legacy_matches(conn, "legacy_keys_staging")
+
+    # Match già presenti (stessa chiave naturale): vengono aggiornati, non duplicati
+    existing = dict(db.execute(
+        text("SELECT match_key, id FROM matches WHERE match_key = ANY(:keys)"),
+        {"keys": frame["match_key"].tolist()},
+    ).all())
+
+    frame = frame.astype(object).where(frame.notna(), None)
+    match_fields = [c for c in MATCH_COLUMNS if c not in ("winner_id", "loser_id")]
 
-        # Crea match
+    for row in tqdm(frame.to_dict("records"), desc=os.path.basename(csv_path)):
         match = Match(
-            match_date=parse_date(row["tourney_date"]),
-            surface=row.get("surface"),
-            tournament_name=row.get("tourney_name"),
-            tournament_level=row.get("tourney_level"),
-            round=row.get("round"),
-            best_of=clean_int(row.get("best_of")),
-            minutes=clean_int(row.get("minutes")),
-            
-            winner_id=winner.id,
-            loser_id=loser.id,
-            
-            winner_rank=clean_int(row.get("winner_rank")),
-            loser_rank=clean_int(row.get("loser_rank")),
-            winner_seed=clean_int(row.get("winner_seed")),
-            loser_seed=clean_int(row.get("loser_seed")),
-            
-            winner_age=clean_float(row.get("winner_age")),
-            loser_age=clean_float(row.get("loser_age")),
-            
-            score=row.get("score"),
-            
-            # Statistiche winner
-            w_ace=clean_int(row.get("w_ace")),
-            w_df=clean_int(row.get("w_df")),
-            w_svpt=clean_int(row.get("w_svpt")),
-            w_1stIn=clean_int(row.get("w_1stIn")),
-            w_1stWon=clean_int(row.get("w_1stWon")),
-            w_2ndWon=clean_int(row.get("w_2ndWon")),
-            w_SvGms=clean_int(row.get("w_SvGms")),
-            w_bpSaved=clean_int(row.get("w_bpSaved")),
-            w_bpFaced=clean_int(row.get("w_bpFaced")),
-            
-            # Statistiche loser
-            l_ace=clean_int(row.get("l_ace")),
-            l_df=clean_int(row.get("l_df")),
-            l_svpt=clean_int(row.get("l_svpt")),
-            l_1stIn=clean_int(row.get("l_1stIn")),
-            l_1stWon=clean_int(row.get("l_1stWon")),
-            l_2ndWon=clean_int(row.get("l_2ndWon")),
-            l_SvGms=clean_int(row.get("l_SvGms")),
-            l_bpSaved=clean_int(row.get("l_bpSaved")),
-            l_bpFaced=clean_int(row.get("l_bpFaced")),
+            id=existing.get(row["match_key"]),
+            winner_id=registry.get(row["winner_name"]),
+            loser_id=registry.get(row["loser_name"]),
+            **{field: row[field] for field in match_fields},
         )
 
-        db.add(match)
+        if match.id is None:
+            db.add(match)
+        else:
+            db.merge(match)
 
     db.commit()
+    return len(frame)
+
+
+# =============================================================================
+# BULK IMPORT (COPY)
+# =============================================================================
+
+def extract_players(norm: pd.DataFrame) -> pd.DataFrame:
+    """
+    Estrae i giocatori distinti (winner + loser) da colonne già normalizzate.
+    A parità di nome vale la prima occorrenza.
+    """
+    frames = []
+    for side in ("winner", "loser"):
+        frames.append(pd.DataFrame({
+            "name": norm[f"{side}_name"],
+            "hand": norm[f"{side}_hand"],
+            "height": norm[f"{side}_ht"],
+            "country": norm[f"{side}_ioc"],
+            "birth_date": norm[f"{side}_dob"].dt.date,
+        }))
+
+    players = pd.concat(frames, ignore_index=True)
+    players = players[players["name"].notna()].drop_duplicates("name", keep="first")
+    players = players.astype(object).where(players.notna(), None)
+    return players.reset_index(drop=True)
+
+
+def build_match_frame(norm: pd.DataFrame, source: str) -> pd.DataFrame:
+    """
+    Costruisce le colonne della tabella matches da colonne già normalizzate.
+    I giocatori restano per nome (winner_name/loser_name): gli id sono
+    assegnati dal writer al momento del caricamento.
+    """
+    frame = pd.DataFrame({
+        "match_key": build_match_keys(norm),
+        "source": source,
+        "match_date": norm["tourney_date"],
+        "winner_name": norm["winner_name"],
+        "loser_name": norm["loser_name"],
+        **{column: norm[csv_column] for column, csv_column in MATCH_CSV_COLUMNS.items()},
+    })
+    frame["tournament_level"] = frame["tournament_level"].replace(LEVEL_ALIASES)
+    # Una riga per chiave (ON CONFLICT non accetta duplicati nello stesso INSERT)
+    frame = frame.drop_duplicates("match_key", keep="last")
+    # Ordine cronologico stabile: a parità di data resta l'ordine del file
+    return frame.sort_values("match_date", kind="stable").reset_index(drop=True)
+
+
+def prepare_frame(df: pd.DataFrame, source: str) -> Tuple[pd.DataFrame, pd.DataFrame, int, Dict[str, int]]:
+    """
+    Pulisce e normalizza un blocco di righe CSV senza toccare il database.
+
+    Returns:
+        Tuple di (players, matches, righe scartate, valori scartati per colonna)
+    """
+    norm, rejects = normalize_csv(df)
+
+    valid = norm["winner_name"].notna() & norm["loser_name"].notna()
+    valid &= norm["tourney_date"].notna()
+    skipped = int((~valid).sum())
+    norm = norm[valid]
+
+    return extract_players(norm), build_match_frame(norm, source), skipped, rejects
+
+
+def report_rejects(skipped: int, rejects: Dict[str, int]):
+    """Stampa righe e valori scartati durante la normalizzazione."""
+    if skipped:
+        print(f"   ⚠️  {skipped} righe scartate (nomi o data mancanti)")
+    if rejects:
+        print(f"   ⚠️  Valori non validi: {format_rejects(rejects)}")
+
+
+def merge_rejects(total: Dict[str, int], rejects: Dict[str, int]):
+    for column, count in rejects.items():
+        total[column] = total.get(column, 0) + count
 
 
-def import_players_csv(csv_path: str, db: Session):
+def prepare_csv_file(
+    csv_path: str, digest: str = None, use_staging: bool = USE_STAGING,
+) -> Tuple[pd.DataFrame, pd.DataFrame, int, Dict[str, int]]:
+    """
+    Legge e prepara un file intero (dallo staging Parquet o dal CSV).
+    Eseguibile in un processo worker.
+    """
+    if use_staging:
+        df = pd.read_parquet(stage_file(csv_path, digest))
+    else:
+        df = pd.read_csv(csv_path, low_memory=False)
+    return prepare_frame(df, source_family(csv_path))
+
+
+def iter_csv_chunks(
+    csv_path: str, chunksize: int = CHUNK_ROWS, digest: str = None, use_staging: bool = USE_STAGING,
+):
+    """
+    Legge un file a blocchi di chunksize righe (memoria limitata), dallo
+    staging Parquet (creato se manca) o dal CSV, restituendo per ogni blocco
+    l'output di prepare_frame().
+    """
+    source = source_family(csv_path)
+    if use_staging:
+        chunks = iter_staged_batches(stage_file(csv_path, digest), chunksize)
+    else:
+        chunks = pd.read_csv(csv_path, chunksize=chunksize, low_memory=False)
+    for chunk in chunks:
+        yield prepare_frame(chunk, source)
+
+
+def load_prepared_file(conn, players: pd.DataFrame, frame: pd.DataFrame, registry: PlayerRegistry) -> int:
+    """
+    Carica un file già preparato: il registry assegna gli id dei giocatori
+    (nuovi inseriti in blocco), i match passano da una tabella di staging
+    e vengono inseriti con un solo INSERT ... SELECT. I match già presenti
+    (stessa match_key, o stessa chiave naturale se importati prima di
+    match_key) vengono aggiornati.
+    """
+    registry.add_many(players.to_dict("records"))
+    registry.flush(conn)
+
+    frame = frame.assign(
+        winner_id=frame["winner_name"].map(registry.ids).astype("Int64"),
+        loser_id=frame["loser_name"].map(registry.ids).astype("Int64"),
+    )
+
+    create_staging_table(conn, "matches_staging", "matches", MATCH_COLUMNS)
+    copy_dataframe(conn, "matches_staging", frame, MATCH_COLUMNS)
+
+    adopt_legacy_matches(conn, "matches_staging")
+
+    cols = column_list(conn, MATCH_COLUMNS)
+    updates = ", ".join(
+        f"{c} = EXCLUDED.{c}"
+        for c in (quote_ident(conn, name) for name in MATCH_COLUMNS if name != "match_key")
+    )
+    conn.execute(text(f"""
+        INSERT INTO matches ({cols})
+        SELECT {cols} FROM matches_staging
+        ON CONFLICT (match_key) DO UPDATE
+        SET {updates}
+    """))
+    return len(frame)
+
+
+def import_csv_file_bulk(
+    csv_path: str, conn, registry: PlayerRegistry, chunksize: int = CHUNK_ROWS,
+    digest: str = None, use_staging: bool = USE_STAGING,
+) -> int:
+    """
+    Importa un singolo file CSV con COPY, in streaming a blocchi.
+    Tutti i blocchi di un file stanno nella transazione di conn.
+    """
+    imported = 0
+    skipped = 0
+    rejects: Dict[str, int] = {}
+    chunks = iter_csv_chunks(csv_path, chunksize, digest, use_staging)
+    for players, frame, chunk_skipped, chunk_rejects in chunks:
+        imported += load_prepared_file(conn, players, frame, registry)
+        skipped += chunk_skipped
+        merge_rejects(rejects, chunk_rejects)
+    report_rejects(skipped, rejects)
+    return imported
+
+
+def import_files_parallel(
+    csv_files: List[Tuple[str, int, str]], registry: PlayerRegistry, workers: int,
+    use_staging: bool = USE_STAGING,
+) -> int:
+    """
+    Importa più file in parallelo: i worker leggono e puliscono i CSV,
+    il processo principale (unico writer) assegna gli id e carica i file
+    nell'ordine dato, così id e ordinamento restano deterministici.
+
+    csv_files: lista di (path, size_bytes, sha256) come da changed_files()
+    """
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Finestra limitata di file in volo per contenere la memoria
+        pending = deque()
+        files = iter(csv_files)
+        for entry in islice(files, workers * 2):
+            pending.append((entry, pool.submit(prepare_csv_file, entry[0], entry[2], use_staging)))
+
+        while pending:
+            (csv_file, size, digest), future = pending.popleft()
+            players, frame, skipped, rejects = future.result()
+
+            next_entry = next(files, None)
+            if next_entry is not None:
+                pending.append((
+                    next_entry,
+                    pool.submit(prepare_csv_file, next_entry[0], next_entry[2], use_staging),
+                ))
+
+            with engine.begin() as conn:
+                imported = load_prepared_file(conn, players, frame, registry)
+                record_file(conn, csv_file, size, digest, imported)
+            total += imported
+
+            print(f"📥 {os.path.basename(csv_file)}: {imported} match caricati")
+            report_rejects(skipped, rejects)
+
+    return total
+
+
+def import_players_csv(csv_path: str, db: Session, registry: PlayerRegistry = None):
     """
     Importa il file atp_players.csv per aggiornare le date di nascita.
     Questo file ha: player_id, name_first, name_last, hand, dob, ioc
@@ -184,63 +384,119 @@ def import_players_csv(csv_path: str, db: Session):
     
     print(f"\n📥 Importo dati giocatori da {csv_path}")
     
+    if registry is None:
+        registry = PlayerRegistry().load(db.connection())
+
     df = pd.read_csv(csv_path, low_memory=False)
-    df = df.where(pd.notna(df), None)
-    
+
+    # Nomi e date di nascita normalizzati per colonna
+    birth_dates, rejected = to_birth_date(df["dob"])
+    if rejected:
+        print(f"   ⚠️  Valori non validi: dob={rejected}")
+    full_names = df["name_first"].astype("string") + " " + df["name_last"].astype("string")
+    valid = full_names.notna() & birth_dates.notna()
+
     updated = 0
     
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="Players"):
-        name_first = row.get("name_first", "")
-        name_last = row.get("name_last", "")
-        
-        if not name_first or not name_last:
-            continue
-            
-        full_name = f"{name_first} {name_last}"
-        birth_date = parse_birth_date(row.get("dob"))
-        
-        if not birth_date:
-            continue
-        
-        # Cerca giocatore esistente
-        player = db.query(Player).filter_by(name=full_name).first()
-        
-        if player and not player.birth_date:
-            player.birth_date = birth_date
+    for full_name, birth_date in tqdm(
+        zip(full_names[valid], birth_dates[valid].dt.date), total=int(valid.sum()), desc="Players"
+    ):
+        # Backfill solo per giocatori esistenti senza data di nascita
+        if registry.set_birth_date(full_name, birth_date):
             updated += 1
     
+    # Un solo UPDATE ... FROM per tutti i backfill
+    registry.flush(db.connection())
     db.commit()
     print(f"   Aggiornati {updated} giocatori con data di nascita")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import CSV Sackmann nel database")
+    parser.add_argument(
+        "--bulk", action="store_true",
+        default=os.environ.get("IMPORT_BULK", "").lower() == "true",
+        help="COPY + INSERT ... SELECT invece di INSERT ORM riga per riga",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=IMPORT_WORKERS,
+        help="Processi worker per parsing/pulizia dei CSV (implica --bulk)",
+    )
+    parser.add_argument(
+        "--families", default=DEFAULT_FAMILIES,
+        help=f"Famiglie da importare, separate da virgola ({', '.join(SINGLES_FAMILIES)})",
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=CHUNK_ROWS,
+        help="Righe per blocco nella lettura in streaming (modalità bulk)",
+    )
+    parser.add_argument(
+        "--staging", action=argparse.BooleanOptionalAction, default=USE_STAGING,
+        help="Legge dallo staging Parquet (creato/aggiornato se serve) invece che dai CSV",
+    )
+    parser.add_argument(
+        "--full", action="store_true",
+        help="Ignora il manifest e reimporta tutti i file",
+    )
+    return parser.parse_args()
+
+
 def main():
     """Entry point principale."""
     
+    args = parse_args()
+
     print("=" * 60)
     print("🎾 TENNIS DATA IMPORTER")
     print("=" * 60)
     
     db = SessionLocal()
 
+    with engine.begin() as conn:
+        ensure_import_schema(conn)
+        manifest = {} if args.full else load_manifest(conn)
+
+    # Identity map dei giocatori condivisa da tutti i file
+    registry = PlayerRegistry().load(db.connection())
+    print(f"👥 Giocatori già presenti: {len(registry)}")
+
     # Importa match
-    csv_files = sorted(
-        glob.glob(os.path.join(DATA_DIR, "atp_matches_[0-9][0-9][0-9][0-9].csv"))
-    )
+    families = [f.strip() for f in args.families.split(",") if f.strip()]
+    csv_files = discover_files(families)
 
     if not csv_files:
         print(f"❌ Nessun CSV trovato in {DATA_DIR}/")
         print("   Scarica i file da: https://github.com/JeffSackmann/tennis_atp")
         return
 
-    print(f"\n📂 Trovati {len(csv_files)} file CSV")
+    print(f"\n📂 Trovati {len(csv_files)} file CSV ({', '.join(families)})")
     
-    for csv_file in csv_files:
-        print(f"\n📥 Importo {csv_file}")
-        import_csv_file(csv_file, db)
+    # Solo file nuovi o modificati rispetto al manifest
+    to_import = changed_files(csv_files, manifest)
+    print(f"   Da importare (nuovi o modificati): {len(to_import)}")
+
+    if args.workers > 1:
+        print(f"⚙️  Import parallelo con {args.workers} worker")
+        imported = import_files_parallel(to_import, registry, args.workers, args.staging)
+        print(f"   {imported} match caricati (COPY)")
+    else:
+        for csv_file, size, digest in to_import:
+            print(f"\n📥 Importo {csv_file}")
+            if args.bulk:
+                with engine.begin() as conn:
+                    imported = import_csv_file_bulk(
+                        csv_file, conn, registry, args.chunksize, digest, args.staging,
+                    )
+                    record_file(conn, csv_file, size, digest, imported)
+                print(f"   {imported} match caricati (COPY)")
+            else:
+                imported = import_csv_file(csv_file, db, registry)
+                with engine.begin() as conn:
+                    record_file(conn, csv_file, size, digest, imported)
 
     # Importa dati giocatori per date di nascita mancanti
     players_csv = os.path.join(DATA_DIR, "atp_players.csv")
-    import_players_csv(players_csv, db)
+    import_players_csv(players_csv, db, registry)
 
     db.close()
     
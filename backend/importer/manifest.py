@@ -0,0 +1,71 @@
+"""
+Import Manifest
+================
+Registro dei file CSV già importati (path, dimensione, hash del contenuto).
+Permette import incrementali: vengono riprocessati solo i file nuovi o modificati.
+"""
+
+import hashlib
+import os
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+
+HASH_CHUNK = 1 << 20
+
+
+def ensure_manifest_table(conn):
+    """Crea la tabella import_manifest se non esiste."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS import_manifest (
+            path VARCHAR PRIMARY KEY,
+            size_bytes BIGINT NOT NULL,
+            sha256 VARCHAR(64) NOT NULL,
+            rows_imported INTEGER,
+            imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def file_sha256(path: str) -> str:
+    """Hash SHA-256 del contenuto di un file, letto a blocchi."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(conn) -> Dict[str, Tuple[int, str]]:
+    """Ritorna path -> (size_bytes, sha256) dei file già importati."""
+    rows = conn.execute(text("SELECT path, size_bytes, sha256 FROM import_manifest"))
+    return {r.path: (int(r.size_bytes), r.sha256) for r in rows}
+
+
+def changed_files(paths: List[str], manifest: Dict[str, Tuple[int, str]]) -> List[Tuple[str, int, str]]:
+    """
+    Filtra i file nuovi o modificati rispetto al manifest.
+
+    Returns:
+        Lista di (path, size_bytes, sha256) da importare, nell'ordine dato
+    """
+    changed = []
+    for path in paths:
+        size = os.path.getsize(path)
+        digest = file_sha256(path)
+        if manifest.get(os.path.basename(path)) != (size, digest):
+            changed.append((path, size, digest))
+    return changed
+
+
+def record_file(conn, path: str, size: int, digest: str, rows: int):
+    """Registra (o aggiorna) un file importato. Da chiamare nella stessa transazione dell'import."""
+    conn.execute(text("""
+        INSERT INTO import_manifest (path, size_bytes, sha256, rows_imported, imported_at)
+        VALUES (:path, :size, :sha, :rows, CURRENT_TIMESTAMP)
+        ON CONFLICT (path) DO UPDATE
+        SET size_bytes = EXCLUDED.size_bytes,
+            sha256 = EXCLUDED.sha256,
+            rows_imported = EXCLUDED.rows_imported,
+            imported_at = EXCLUDED.imported_at
+    """), {"path": os.path.basename(path), "size": size, "sha": digest, "rows": rows})
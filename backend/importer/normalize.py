@@ -0,0 +1,107 @@
+"""
+Column Normalization
+=====================
+Pulizia vettoriale delle colonne CSV Sackmann: interi e float nullable,
+date YYYYMMDD e date di nascita (YYYYMMDD o solo anno).
+
+Ogni conversione lavora sull'intera colonna in un solo passaggio e conta
+i valori scartati (presenti nel CSV ma non convertibili).
+Riutilizzabile da qualsiasi loader che legga i CSV grezzi; le conversioni
+sono idempotenti, quindi si possono riapplicare a dati già tipizzati
+(es. lo staging Parquet).
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+INT = "int"
+FLOAT = "float"
+DATE = "date"
+BIRTH_DATE = "birth_date"
+STRING = "string"
+
+
+def _rejected(before: pd.Series, after: pd.Series) -> int:
+    return int((before.notna() & after.isna()).sum())
+
+
+def to_nullable_int(series: pd.Series) -> Tuple[pd.Series, int]:
+    """Colonna -> Int64 (valori decimali troncati come int())."""
+    numeric = pd.to_numeric(series, errors="coerce")
+    numeric = numeric.where(np.isfinite(numeric))
+    result = np.trunc(numeric).astype("Int64")
+    return result, _rejected(series, result)
+
+
+def to_nullable_float(series: pd.Series) -> Tuple[pd.Series, int]:
+    """Colonna -> Float64."""
+    result = pd.to_numeric(series, errors="coerce").astype("Float64")
+    return result, _rejected(series, result)
+
+
+def to_date(series: pd.Series) -> Tuple[pd.Series, int]:
+    """Colonna YYYYMMDD (int, float o stringa) -> datetime64 (NaT se non valida)."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series, 0
+    digits, _ = to_nullable_int(series)
+    result = pd.to_datetime(digits.astype("string"), format="%Y%m%d", errors="coerce")
+    return result, _rejected(series, result)
+
+
+def to_birth_date(series: pd.Series) -> Tuple[pd.Series, int]:
+    """
+    Data di nascita -> datetime64.
+    Accetta YYYYMMDD oppure solo l'anno (YYYY -> 1 gennaio).
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series, 0
+    digits, _ = to_nullable_int(series)
+    text = digits.astype("string")
+    full = pd.to_datetime(text.where(text.str.len() == 8), format="%Y%m%d", errors="coerce")
+    year_only = pd.to_datetime(text.where(text.str.len() == 4), format="%Y", errors="coerce")
+    result = full.fillna(year_only)
+    return result, _rejected(series, result)
+
+
+def to_string(series: pd.Series) -> Tuple[pd.Series, int]:
+    """Colonna -> stringhe (object) con None per i mancanti."""
+    if pd.api.types.is_float_dtype(series) and (series.dropna() % 1 == 0).all():
+        # Interi letti come float per via dei NaN: niente ".0" nel testo
+        series = series.astype("Int64")
+    result = series.astype("string")
+    result = result.astype(object).where(result.notna(), None)
+    return result, 0
+
+
+CONVERTERS = {
+    INT: to_nullable_int,
+    FLOAT: to_nullable_float,
+    DATE: to_date,
+    BIRTH_DATE: to_birth_date,
+    STRING: to_string,
+}
+
+
+def normalize_columns(df: pd.DataFrame, spec: Dict[str, str]) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Converte le colonne di df secondo spec (colonna -> tipo).
+    Le colonne assenti in df diventano tutte nulle.
+
+    Returns:
+        Tuple di (DataFrame normalizzato, colonna -> valori scartati)
+    """
+    out = {}
+    rejects = {}
+    for column, kind in spec.items():
+        source = df[column] if column in df else pd.Series(None, index=df.index, dtype=object)
+        out[column], rejected = CONVERTERS[kind](source)
+        if rejected:
+            rejects[column] = rejected
+    return pd.DataFrame(out, index=df.index), rejects
+
+
+def format_rejects(rejects: Dict[str, int]) -> str:
+    """Riepilogo leggibile dei valori scartati per colonna."""
+    return ", ".join(f"{col}={n}" for col, n in sorted(rejects.items()))
@@ -0,0 +1,138 @@
+"""
+Player Registry
+================
+Identity map nome -> id dei giocatori, condivisa per tutta la durata di un import.
+
+Carica la tabella players una sola volta, serve le lookup da un dict e
+accumula i nuovi giocatori e i backfill delle date di nascita, scritti poi
+in blocco da flush().
+"""
+
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+
+from app.bulk_copy import column_list, copy_rows, create_staging_table
+
+PLAYER_COLUMNS = ["name", "hand", "height", "country", "birth_date"]
+PLAYER_BATCH = 5000
+
+
+class PlayerRegistry:
+    """Cache in memoria di players(name -> id, birth_date)."""
+
+    def __init__(self, batch_size: int = PLAYER_BATCH):
+        self.batch_size = batch_size
+        self.ids: Dict[str, int] = {}
+        self.birth_dates: Dict[str, Optional[date]] = {}
+        # Nuovi giocatori da inserire: name -> tupla PLAYER_COLUMNS
+        self.pending: Dict[str, tuple] = {}
+        # Giocatori esistenti senza birth_date: name -> birth_date
+        self.birth_backfill: Dict[str, date] = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.ids
+
+    def load(self, conn):
+        """Carica tutti i giocatori esistenti con una sola query."""
+        for r in conn.execute(text("SELECT id, name, birth_date FROM players")):
+            self.ids[r.name] = int(r.id)
+            self.birth_dates[r.name] = r.birth_date
+        return self
+
+    def get(self, name: str) -> Optional[int]:
+        return self.ids.get(name)
+
+    def add(self, name, hand=None, height=None, country=None, birth_date=None):
+        """
+        Registra un giocatore visto nei dati.
+        Se esiste già, accoda solo l'eventuale backfill della data di nascita.
+        """
+        if name in self.ids:
+            self.set_birth_date(name, birth_date)
+            return
+
+        current = self.pending.get(name)
+        if current is None:
+            self.pending[name] = (name, hand, height, country, birth_date)
+        elif birth_date and not current[4]:
+            self.pending[name] = (*current[:4], birth_date)
+
+    def set_birth_date(self, name: str, birth_date: Optional[date]) -> bool:
+        """Accoda il backfill della birth_date per un giocatore esistente che non l'ha."""
+        if not birth_date or name not in self.ids or self.birth_dates.get(name):
+            return False
+        self.birth_dates[name] = birth_date
+        self.birth_backfill[name] = birth_date
+        return True
+
+    def add_many(self, players: Iterable[dict]):
+        for p in players:
+            self.add(**p)
+
+    def flush(self, conn):
+        """Scrive nuovi giocatori e backfill birth_date pendenti."""
+        self._flush_new_players(conn)
+        self._flush_birth_dates(conn)
+
+    def _flush_new_players(self, conn):
+        if not self.pending:
+            return
+
+        rows = list(self.pending.values())
+        cursor = conn.connection.cursor()
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                returned = execute_values(
+                    cursor,
+                    f"""
+                    INSERT INTO players ({column_list(conn, PLAYER_COLUMNS)})
+                    VALUES %s
+                    ON CONFLICT (name) DO NOTHING
+                    RETURNING id, name
+                    """,
+                    batch,
+                    page_size=len(batch),
+                    fetch=True,
+                )
+                for pid, name in returned:
+                    self.ids[name] = int(pid)
+        finally:
+            cursor.close()
+
+        # Nomi inseriti nel frattempo da un altro processo: recupera gli id
+        missing = [r[0] for r in rows if r[0] not in self.ids]
+        if missing:
+            for r in conn.execute(
+                text("SELECT id, name FROM players WHERE name = ANY(:names)"),
+                {"names": missing},
+            ):
+                self.ids[r.name] = int(r.id)
+
+        for name, *_, birth_date in rows:
+            self.birth_dates[name] = birth_date
+        self.pending.clear()
+
+    def _flush_birth_dates(self, conn):
+        if not self.birth_backfill:
+            return
+
+        create_staging_table(conn, "players_birth_backfill", "players", ["name", "birth_date"])
+        copy_rows(
+            conn, "players_birth_backfill", ["name", "birth_date"],
+            self.birth_backfill.items(),
+        )
+        conn.execute(text("""
+            UPDATE players p
+            SET birth_date = b.birth_date
+            FROM players_birth_backfill b
+            WHERE p.name = b.name
+              AND p.birth_date IS NULL
+        """))
+        self.birth_backfill.clear()
@@ -0,0 +1,135 @@
+"""
+Sackmann Sources
+=================
+Sorgenti CSV di Jeff Sackmann (tennis_atp): famiglie di file, mapping
+colonne CSV -> tabella matches e tipi per la normalizzazione vettoriale.
+Condiviso da importer e staging Parquet.
+"""
+
+import fnmatch
+import glob
+import os
+import re
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from app.models.match import Match
+from importer.normalize import BIRTH_DATE, DATE, FLOAT, INT, STRING, normalize_columns
+
+DATA_DIR = "/data/raw"
+
+# Famiglie di file Sackmann -> pattern glob
+SOURCE_FAMILIES = {
+    "main": "atp_matches_[0-9][0-9][0-9][0-9].csv",
+    "qual_chall": "atp_matches_qual_chall_*.csv",
+    "futures": "atp_matches_futures_*.csv",
+    "amateur": "atp_matches_amateur.csv",
+    "doubles": "atp_matches_doubles_*.csv",
+}
+# Il doppio ha uno schema a 4 giocatori non rappresentabile nella tabella matches
+SINGLES_FAMILIES = ("main", "qual_chall", "futures", "amateur")
+DEFAULT_FAMILIES = os.environ.get("IMPORT_FAMILIES", "main")
+
+# Livelli ITF dei futures (M15/M25) -> "S" (satellite/ITF), come negli anni
+# precedenti: tournament_level è un solo carattere
+LEVEL_ALIASES = {"15": "S", "25": "S"}
+
+# Colonne matches popolate dal CSV -> colonna sorgente Sackmann
+# (winner_id/loser_id e match_date sono risolti a parte)
+MATCH_CSV_COLUMNS = {
+    "surface": "surface",
+    "tournament_name": "tourney_name",
+    "tournament_level": "tourney_level",
+    "round": "round",
+    "best_of": "best_of",
+    "minutes": "minutes",
+    "winner_rank": "winner_rank",
+    "loser_rank": "loser_rank",
+    "winner_seed": "winner_seed",
+    "loser_seed": "loser_seed",
+    "winner_age": "winner_age",
+    "loser_age": "loser_age",
+    "score": "score",
+    "w_ace": "w_ace",
+    "w_df": "w_df",
+    "w_svpt": "w_svpt",
+    "w_1stIn": "w_1stIn",
+    "w_1stWon": "w_1stWon",
+    "w_2ndWon": "w_2ndWon",
+    "w_SvGms": "w_SvGms",
+    "w_bpSaved": "w_bpSaved",
+    "w_bpFaced": "w_bpFaced",
+    "l_ace": "l_ace",
+    "l_df": "l_df",
+    "l_svpt": "l_svpt",
+    "l_1stIn": "l_1stIn",
+    "l_1stWon": "l_1stWon",
+    "l_2ndWon": "l_2ndWon",
+    "l_SvGms": "l_SvGms",
+    "l_bpSaved": "l_bpSaved",
+    "l_bpFaced": "l_bpFaced",
+}
+
+
+def file_year(csv_path: str) -> int:
+    """Anno nel nome del file (0 per file multi-anno, es. amateur)."""
+    year = re.search(r"(\d{4})\.csv$", csv_path)
+    return int(year.group(1)) if year else 0
+
+
+def _column_kind(column: str) -> str:
+    """Tipo di normalizzazione per una colonna della tabella matches."""
+    python_type = Match.__table__.columns[column].type.python_type
+    if python_type is int:
+        return INT
+    if python_type is float:
+        return FLOAT
+    return STRING
+
+
+# Tipi delle colonne CSV per la normalizzazione vettoriale
+CSV_SPEC = {
+    "tourney_id": STRING,
+    "match_num": INT,
+    "tourney_date": DATE,
+    **{source: _column_kind(column) for column, source in MATCH_CSV_COLUMNS.items()},
+    **{
+        f"{side}_{field}": kind
+        for side in ("winner", "loser")
+        for field, kind in (
+            ("name", STRING), ("hand", STRING), ("ht", INT),
+            ("ioc", STRING), ("dob", BIRTH_DATE),
+        )
+    },
+}
+
+
+def normalize_csv(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """Normalizza in un passaggio tutte le colonne CSV usate dall'import."""
+    return normalize_columns(df, CSV_SPEC)
+
+
+def source_family(csv_path: str) -> str:
+    """Famiglia sorgente di un file (main, qual_chall, futures, ...)."""
+    name = os.path.basename(csv_path)
+    for family, pattern in SOURCE_FAMILIES.items():
+        if fnmatch.fnmatch(name, pattern):
+            return family
+    raise ValueError(f"File non riconosciuto: {name}")
+
+
+def discover_files(families: List[str]) -> List[str]:
+    """
+    File CSV delle famiglie selezionate, in ordine cronologico
+    (anno nel nome file, poi ordine delle famiglie).
+    """
+    files = []
+    for order, family in enumerate(families):
+        if family not in SINGLES_FAMILIES:
+            print(f"⚠️  Famiglia '{family}' non supportata (solo singolare), skip")
+            continue
+        for path in glob.glob(os.path.join(DATA_DIR, SOURCE_FAMILIES[family])):
+            files.append((file_year(path), order, path))
+    return [path for _, _, path in sorted(files)]
+
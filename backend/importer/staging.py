@@ -0,0 +1,158 @@
+"""
+Parquet Staging
+================
+Cache colonnare dei CSV Sackmann grezzi.
+
+Ogni CSV viene convertito una sola volta in un file Parquet tipizzato
+(compressione zstd), partizionato per famiglia e anno:
+
+    /data/staging/family=<famiglia>/year=<anno>/<nome>-<hash>.parquet
+
+Il nome contiene l'hash del CSV sorgente: se il CSV cambia viene riscritto,
+altrimenti la conversione è saltata. Le colonne usate dall'importer sono
+normalizzate (date, interi e float nullable), le altre tipizzate con
+EXTRA_SPEC o salvate come stringhe, così lo schema è uguale tra file.
+
+Eseguire con: python -m importer.staging [--families main,qual_chall]
+"""
+
+import argparse
+import glob
+import os
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from importer.manifest import file_sha256
+from importer.normalize import INT, STRING, format_rejects, normalize_columns
+from importer.sources import DEFAULT_FAMILIES, discover_files, file_year, normalize_csv, source_family
+
+STAGING_DIR = os.environ.get("STAGING_DIR", "/data/staging")
+HASH_LEN = 16
+COMPRESSION = "zstd"
+
+# Colonne CSV non usate dall'importer ma tipizzate nello staging;
+# le altre colonne extra sono salvate come stringhe
+EXTRA_SPEC = {
+    "draw_size": STRING,
+    "winner_id": INT,
+    "loser_id": INT,
+    "winner_entry": STRING,
+    "loser_entry": STRING,
+    "winner_rank_points": INT,
+    "loser_rank_points": INT,
+}
+
+
+def _arrow_type(series: pd.Series) -> pa.DataType:
+    """Tipo Arrow stabile tra file (anche per colonne tutte nulle)."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pa.timestamp("us")
+    if pd.api.types.is_integer_dtype(series):
+        return pa.int64()
+    if pd.api.types.is_float_dtype(series):
+        return pa.float64()
+    return pa.string()
+
+
+def staged_path(csv_path: str, digest: str) -> str:
+    """Percorso Parquet di staging per un CSV con un dato hash."""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(
+        STAGING_DIR,
+        f"family={source_family(csv_path)}",
+        f"year={file_year(csv_path)}",
+        f"{stem}-{digest[:HASH_LEN]}.parquet",
+    )
+
+
+def stage_file(csv_path: str, digest: Optional[str] = None) -> str:
+    """
+    Converte un CSV in Parquet se non già presente per il suo hash.
+    Rimuove le versioni precedenti dello stesso file.
+
+    Returns:
+        Percorso del file Parquet
+    """
+    digest = digest or file_sha256(csv_path)
+    target = staged_path(csv_path, digest)
+    if os.path.exists(target):
+        return target
+
+    df = pd.read_csv(csv_path, low_memory=False)
+    norm, rejects = normalize_csv(df)
+    if rejects:
+        print(f"   ⚠️  {os.path.basename(csv_path)}: valori non validi {format_rejects(rejects)}")
+
+    # Colonne normalizzate + colonne extra del CSV
+    extra_spec = {c: EXTRA_SPEC.get(c, STRING) for c in df.columns if c not in norm.columns}
+    extra, _ = normalize_columns(df, extra_spec)
+    staged = pd.concat([norm, extra], axis=1)
+    schema = pa.schema([(c, _arrow_type(staged[c])) for c in staged.columns])
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = target + ".tmp"
+    table = pa.Table.from_pandas(staged, schema=schema, preserve_index=False)
+    pq.write_table(table, tmp, compression=COMPRESSION)
+    os.replace(tmp, target)
+
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    for old in glob.glob(os.path.join(os.path.dirname(target), f"{stem}-*.parquet")):
+        if old != target:
+            os.remove(old)
+
+    return target
+
+
+def iter_staged_batches(path: str, batch_size: int, columns: Optional[List[str]] = None):
+    """Legge un file di staging a blocchi di batch_size righe (DataFrame)."""
+    parquet = pq.ParquetFile(path)
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def read_staged(
+    families: Optional[List[str]] = None,
+    years: Optional[List[int]] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Legge lo staging come un unico dataset, con proiezione delle colonne
+    e filtro sulle partizioni (famiglia, anno). Per analisi ad-hoc.
+    """
+    filters = []
+    if families:
+        filters.append(("family", "in", list(families)))
+    if years:
+        filters.append(("year", "in", list(years)))
+    return pd.read_parquet(
+        STAGING_DIR,
+        engine="pyarrow",
+        columns=columns,
+        filters=filters or None,
+    )
+
+
+def stage_all(families: List[str]) -> List[str]:
+    """Converte tutti i CSV delle famiglie selezionate."""
+    staged = []
+    for csv_path in discover_files(families):
+        staged.append(stage_file(csv_path))
+    return staged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Staging Parquet dei CSV Sackmann")
+    parser.add_argument("--families", default=DEFAULT_FAMILIES)
+    args = parser.parse_args()
+
+    families = [f.strip() for f in args.families.split(",") if f.strip()]
+    print(f"📦 Staging Parquet in {STAGING_DIR} ({', '.join(families)})")
+    staged = stage_all(families)
+    print(f"✅ {len(staged)} file in staging")
+
+
+if __name__ == "__main__":
+    main()
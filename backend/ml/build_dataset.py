@@ -5,14 +5,120 @@ Costruisce il dataset ML dal feature store (player_match_features).
 Usa le feature PRE-MATCH calcolate da feature_store_build.py.
 """
 
+import os
+
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
-from tqdm import tqdm
 
 from app.database import engine
 
 OUTPUT_PATH = "/data/ml/tennis_dataset.parquet"
 
+# Feature per giocatore (colonne winner_<nome>/loser_<nome>) -> default se mancante
+PLAYER_FEATURE_DEFAULTS = {
+    "elo": 1500.0,
+    "recent_5": 0.0,
+    "recent_10": 0.0,
+    "surface_wr": 0.0,
+    "h2h": 0,
+    "rank": 500,
+    "days_rest": 7,
+    "age": 25.0,
+    "matches_30d": 0,
+    "ace_pct": 0.0,
+    "df_pct": 0.0,
+    "first_serve_pct": 0.0,
+    "first_won_pct": 0.0,
+    "bp_save_pct": 0.0,
+    "level_wr": 0.0,
+    # Rating di ml.rating_engine (solo dataset offline)
+    "elo_overall": 1500.0,
+    "elo_blend": 1500.0,
+    "elo_kdecay": 1500.0,
+    "glicko": 1500.0,
+    "glicko_rd": 350.0,
+}
+
+# Colonna differenziale -> (feature, cifre decimali, segno invertito)
+# Le differenze sono sempre A - B, tranne fatigue_diff (B - A):
+# positivo = avversario più riposato
+DIFF_COLUMNS = {
+    "elo_diff": ("elo", 2, False),
+    "ranking_diff": ("rank", None, False),
+    "recent_5_diff": ("recent_5", 4, False),
+    "recent_10_diff": ("recent_10", 4, False),
+    "surface_diff": ("surface_wr", 4, False),
+    "h2h_diff": ("h2h", None, False),
+    "fatigue_diff": ("days_rest", None, True),
+    "age_diff": ("age", None, False),
+    "workload_diff": ("matches_30d", None, False),  # Match giocati ultimi 30gg
+    "ace_diff": ("ace_pct", 4, False),
+    "df_diff": ("df_pct", 4, False),  # Negativo è meglio
+    "first_serve_diff": ("first_serve_pct", 4, False),
+    "first_won_diff": ("first_won_pct", 4, False),
+    "bp_save_diff": ("bp_save_pct", 4, False),
+    "level_exp_diff": ("level_wr", 4, False),
+    "elo_overall_diff": ("elo_overall", 2, False),
+    "elo_blend_diff": ("elo_blend", 2, False),
+    "elo_kdecay_diff": ("elo_kdecay", 2, False),
+    "glicko_diff": ("glicko", 2, False),
+    "glicko_rd_diff": ("glicko_rd", 2, False),
+}
+
+
+def player_feature(df: pd.DataFrame, side: str, feature: str) -> np.ndarray:
+    """Colonna side_feature con il default al posto dei valori mancanti."""
+    default = PLAYER_FEATURE_DEFAULTS[feature]
+    values = pd.to_numeric(df[f"{side}_{feature}"]).astype("float64").fillna(default)
+    return values.to_numpy(np.int64 if isinstance(default, int) else np.float64)
+
+
+def round_values(values: np.ndarray, decimals: int) -> np.ndarray:
+    """
+    round() di Python elemento per elemento: arrotonda sul valore decimale
+    esatto, np.round (scala e divide) può scegliere l'altro lato nei casi
+    limite e cambiare il dataset.
+    """
+    return np.fromiter((round(v, decimals) for v in values.tolist()), np.float64, len(values))
+
+
+def differential_dataset(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Righe simmetriche del dataset da un match per riga (colonne
+    winner_<feature>/loser_<feature>): per ogni match una riga con il
+    winner come player A (target = 1) e una con il loser (target = 0).
+    Le differenze di feature assenti in df (es. rating) sono saltate.
+    """
+    n = len(df)
+    dataset = {
+        "match_id": np.repeat(df["match_id"].to_numpy(), 2),
+        "match_date": np.repeat(df["match_date"].to_numpy(), 2),
+        "surface": np.repeat(df["surface"].to_numpy(), 2),
+    }
+
+    for column, (feature, decimals, inverted) in DIFF_COLUMNS.items():
+        if f"winner_{feature}" not in df.columns:
+            continue
+        winner = player_feature(df, "winner", feature)
+        loser = player_feature(df, "loser", feature)
+        if inverted:
+            winner, loser = loser, winner
+        # Entrambe le differenze calcolate (niente -0.0 dalla negazione)
+        a_minus_b, b_minus_a = winner - loser, loser - winner
+        if decimals is not None:
+            a_minus_b = round_values(a_minus_b, decimals)
+            b_minus_a = round_values(b_minus_a, decimals)
+        values = np.empty(2 * n, dtype=a_minus_b.dtype)
+        values[0::2] = a_minus_b
+        values[1::2] = b_minus_a
+        dataset[column] = values
+
+    target = np.zeros(2 * n, dtype=np.int64)
+    target[0::2] = 1
+    dataset["target"] = target
+    return pd.DataFrame(dataset)
+
 
 def build_dataset():
     """
@@ -86,114 +192,17 @@ def build_dataset():
         return
     
     print("🔧 Costruzione feature differenziali...")
-    
-    rows = []
-    
-    for _, m in tqdm(df.iterrows(), total=len(df), desc="Building dataset"):
-        # Feature base
-        winner_elo = m.winner_elo if pd.notna(m.winner_elo) else 1500.0
-        loser_elo = m.loser_elo if pd.notna(m.loser_elo) else 1500.0
-        
-        winner_r5 = m.winner_recent_5 if pd.notna(m.winner_recent_5) else 0.0
-        loser_r5 = m.loser_recent_5 if pd.notna(m.loser_recent_5) else 0.0
-        
-        winner_r10 = m.winner_recent_10 if pd.notna(m.winner_recent_10) else 0.0
-        loser_r10 = m.loser_recent_10 if pd.notna(m.loser_recent_10) else 0.0
-        
-        winner_surf = m.winner_surface_wr if pd.notna(m.winner_surface_wr) else 0.0
-        loser_surf = m.loser_surface_wr if pd.notna(m.loser_surface_wr) else 0.0
-        
-        winner_h2h = int(m.winner_h2h) if pd.notna(m.winner_h2h) else 0
-        loser_h2h = int(m.loser_h2h) if pd.notna(m.loser_h2h) else 0
-        
-        winner_rank = int(m.winner_rank) if pd.notna(m.winner_rank) else 500
-        loser_rank = int(m.loser_rank) if pd.notna(m.loser_rank) else 500
-        
-        # Nuove feature
-        winner_days_rest = int(m.winner_days_rest) if pd.notna(m.winner_days_rest) else 7
-        loser_days_rest = int(m.loser_days_rest) if pd.notna(m.loser_days_rest) else 7
-        
-        winner_age = float(m.winner_age) if pd.notna(m.winner_age) else 25.0
-        loser_age = float(m.loser_age) if pd.notna(m.loser_age) else 25.0
-        
-        winner_m30d = int(m.winner_matches_30d) if pd.notna(m.winner_matches_30d) else 0
-        loser_m30d = int(m.loser_matches_30d) if pd.notna(m.loser_matches_30d) else 0
-        
-        winner_ace = float(m.winner_ace_pct) if pd.notna(m.winner_ace_pct) else 0.0
-        loser_ace = float(m.loser_ace_pct) if pd.notna(m.loser_ace_pct) else 0.0
-        
-        winner_df = float(m.winner_df_pct) if pd.notna(m.winner_df_pct) else 0.0
-        loser_df = float(m.loser_df_pct) if pd.notna(m.loser_df_pct) else 0.0
-        
-        winner_1st_pct = float(m.winner_first_serve_pct) if pd.notna(m.winner_first_serve_pct) else 0.0
-        loser_1st_pct = float(m.loser_first_serve_pct) if pd.notna(m.loser_first_serve_pct) else 0.0
-        
-        winner_1st_won = float(m.winner_first_won_pct) if pd.notna(m.winner_first_won_pct) else 0.0
-        loser_1st_won = float(m.loser_first_won_pct) if pd.notna(m.loser_first_won_pct) else 0.0
-        
-        winner_bp_save = float(m.winner_bp_save_pct) if pd.notna(m.winner_bp_save_pct) else 0.0
-        loser_bp_save = float(m.loser_bp_save_pct) if pd.notna(m.loser_bp_save_pct) else 0.0
-        
-        winner_level_wr = float(m.winner_level_wr) if pd.notna(m.winner_level_wr) else 0.0
-        loser_level_wr = float(m.loser_level_wr) if pd.notna(m.loser_level_wr) else 0.0
-        
-        # Riga 1: Winner come player A (target = 1)
-        rows.append({
-            "match_id": m.match_id,
-            "match_date": m.match_date,
-            "surface": m.surface,
-            # Feature originali
-            "elo_diff": round(winner_elo - loser_elo, 2),
-            "ranking_diff": winner_rank - loser_rank,
-            "recent_5_diff": round(winner_r5 - loser_r5, 4),
-            "recent_10_diff": round(winner_r10 - loser_r10, 4),
-            "surface_diff": round(winner_surf - loser_surf, 4),
-            "h2h_diff": winner_h2h - loser_h2h,
-            # Nuove feature
-            "fatigue_diff": loser_days_rest - winner_days_rest,  # Positivo = avversario più riposato
-            "age_diff": winner_age - loser_age,
-            "workload_diff": winner_m30d - loser_m30d,  # Match giocati ultimi 30gg
-            "ace_diff": round(winner_ace - loser_ace, 4),
-            "df_diff": round(winner_df - loser_df, 4),  # Negativo è meglio
-            "first_serve_diff": round(winner_1st_pct - loser_1st_pct, 4),
-            "first_won_diff": round(winner_1st_won - loser_1st_won, 4),
-            "bp_save_diff": round(winner_bp_save - loser_bp_save, 4),
-            "level_exp_diff": round(winner_level_wr - loser_level_wr, 4),
-            "target": 1,
-        })
-        
-        # Riga 2: Loser come player A (target = 0, simmetrica)
-        rows.append({
-            "match_id": m.match_id,
-            "match_date": m.match_date,
-            "surface": m.surface,
-            # Feature originali (invertite)
-            "elo_diff": round(loser_elo - winner_elo, 2),
-            "ranking_diff": loser_rank - winner_rank,
-            "recent_5_diff": round(loser_r5 - winner_r5, 4),
-            "recent_10_diff": round(loser_r10 - winner_r10, 4),
-            "surface_diff": round(loser_surf - winner_surf, 4),
-            "h2h_diff": loser_h2h - winner_h2h,
-            # Nuove feature (invertite)
-            "fatigue_diff": winner_days_rest - loser_days_rest,
-            "age_diff": loser_age - winner_age,
-            "workload_diff": loser_m30d - winner_m30d,
-            "ace_diff": round(loser_ace - winner_ace, 4),
-            "df_diff": round(loser_df - winner_df, 4),
-            "first_serve_diff": round(loser_1st_pct - winner_1st_pct, 4),
-            "first_won_diff": round(loser_1st_won - winner_1st_won, 4),
-            "bp_save_diff": round(loser_bp_save - winner_bp_save, 4),
-            "level_exp_diff": round(loser_level_wr - winner_level_wr, 4),
-            "target": 0,
-        })
-    
-    # Crea DataFrame
-    dataset = pd.DataFrame(rows)
-    
-    # Salva
-    dataset.to_parquet(OUTPUT_PATH, index=False)
-    
-    print(f"\n✅ Dataset salvato: {OUTPUT_PATH}")
+    dataset = differential_dataset(df)
+
+    save_dataset(dataset)
+
+
+def save_dataset(dataset: pd.DataFrame, output_path: str = OUTPUT_PATH):
+    """Salva il dataset in Parquet e stampa le statistiche."""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    dataset.to_parquet(output_path, index=False)
+
+    print(f"\n✅ Dataset salvato: {output_path}")
     print(f"   Righe totali: {len(dataset):,}")
     print(f"   Match unici: {dataset['match_id'].nunique():,}")
     print(f"\n📊 Statistiche feature:")
@@ -201,15 +210,15 @@ def build_dataset():
     print(f"\n📅 Range date: {dataset['match_date'].min()} → {dataset['match_date'].max()}")
 
 
-def verify_dataset():
+def verify_dataset(path: str = OUTPUT_PATH):
     """Verifica che il dataset sia valido."""
     
     print("\n🔍 Verifica dataset...")
     
     try:
-        df = pd.read_parquet(OUTPUT_PATH)
+        df = pd.read_parquet(path)
     except FileNotFoundError:
-        print(f"❌ Dataset non trovato: {OUTPUT_PATH}")
+        print(f"❌ Dataset non trovato: {path}")
         return False
     
     required_cols = [
@@ -1,32 +1,57 @@
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
 from app.database import engine
 
 OUTPUT_PATH = "/data/ml/tennis_dataset.parquet"
 BASE_ELO = 1500.0
+SURFACES = ("Hard", "Clay", "Grass")
 
 # ==========================================================
 # Recupero Elo PRE-match (per superficie)
 # ==========================================================
 
 ELO_SQL = """
-SELECT pe.elo
+SELECT pe.player_id, pe.surface, pe.match_id, pe.elo
 FROM player_elo pe
-WHERE pe.player_id = :pid
-  AND pe.surface = :surface
-  AND pe.match_id < :mid
-ORDER BY pe.match_id DESC
-LIMIT 1;
+WHERE pe.surface IN ('Hard', 'Clay', 'Grass');
 """
 
 
-def get_elo(pid: int, surface: str, match_id: int) -> float:
-    with engine.connect() as conn:
-        v = conn.execute(
-            text(ELO_SQL),
-            {"pid": pid, "surface": surface, "mid": match_id}
-        ).scalar()
-    return float(v) if v is not None else BASE_ELO
+class EloAsOfIndex:
+    """
+    player_elo caricato una sola volta in array ordinati per
+    (giocatore, superficie, match_id): l'Elo "prima di match_id" di molti
+    giocatori si ottiene con un solo searchsorted vettoriale.
+    """
+
+    def __init__(self, elo: pd.DataFrame):
+        self.mid_span = int(elo["match_id"].max()) + 2 if len(elo) else 2
+        keys = self._keys(elo["player_id"], elo["surface"], elo["match_id"])
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.groups = self.keys // self.mid_span
+        self.elo = elo["elo"].to_numpy(np.float64)[order]
+
+    @classmethod
+    def load(cls) -> "EloAsOfIndex":
+        with engine.connect() as conn:
+            return cls(pd.read_sql(text(ELO_SQL), conn))
+
+    def _keys(self, player_ids, surfaces, match_ids) -> np.ndarray:
+        """Chiave int64 ordinabile: (giocatore, superficie) poi match_id."""
+        codes = pd.Series(surfaces).map({s: i for i, s in enumerate(SURFACES)}).to_numpy(np.int64)
+        groups = np.asarray(player_ids, dtype=np.int64) * len(SURFACES) + codes
+        return groups * self.mid_span + np.asarray(match_ids, dtype=np.int64)
+
+    def lookup(self, player_ids, surfaces, match_ids) -> np.ndarray:
+        """Elo dell'ultima riga con match_id < match_ids (BASE_ELO se nessuna)."""
+        if len(self.keys) == 0:
+            return np.full(len(match_ids), BASE_ELO)
+        queries = self._keys(player_ids, surfaces, np.minimum(match_ids, self.mid_span - 1))
+        pos = np.searchsorted(self.keys, queries, side="left") - 1
+        found = (pos >= 0) & (self.groups[np.maximum(pos, 0)] == queries // self.mid_span)
+        return np.where(found, self.elo[np.maximum(pos, 0)], BASE_ELO)
 
 
 # ==========================================================
@@ -48,38 +73,25 @@ def build_dataset():
 
     df = pd.read_sql(matches_sql, engine)
     df["match_date"] = pd.to_datetime(df["match_date"]).dt.date
-
-    rows = []
-
-    for _, m in df.iterrows():
-        surface = m.surface
-        if surface not in ("Hard", "Clay", "Grass"):
-            continue
-
-        mid = int(m.id)
-        date = m.match_date
-
-        A = int(m.winner_id)
-        B = int(m.loser_id)
-
-        elo_A = get_elo(A, surface, mid)
-        elo_B = get_elo(B, surface, mid)
-
-        # A vince
-        rows.append({
-            "elo_diff": elo_A - elo_B,
-            "target": 1,
-            "match_date": date
-        })
-
-        # B perde (simmetrica)
-        rows.append({
-            "elo_diff": elo_B - elo_A,
-            "target": 0,
-            "match_date": date
-        })
-
-    dataset = pd.DataFrame(rows)
+    df = df[df["surface"].isin(SURFACES)]
+
+    index = EloAsOfIndex.load()
+    elo_A = index.lookup(df["winner_id"], df["surface"], df["id"])
+    elo_B = index.lookup(df["loser_id"], df["surface"], df["id"])
+
+    # A vince (target 1), B perde (riga simmetrica, target 0)
+    n = len(df)
+    elo_diff = np.empty(2 * n, dtype=np.float64)
+    elo_diff[0::2] = elo_A - elo_B
+    elo_diff[1::2] = elo_B - elo_A
+    target = np.zeros(2 * n, dtype=np.int64)
+    target[0::2] = 1
+
+    dataset = pd.DataFrame({
+        "elo_diff": elo_diff,
+        "target": target,
+        "match_date": np.repeat(df["match_date"].to_numpy(object), 2),
+    })
     dataset.to_parquet(OUTPUT_PATH, index=False)
 
     print(f"✅ Dataset ML Elo-only salvato in {OUTPUT_PATH}")
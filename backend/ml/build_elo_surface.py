@@ -1,94 +1,185 @@
-from collections import defaultdict
+"""
+Player Elo History
+===================
+Mantiene player_elo (Elo per superficie post-match, una riga per
+giocatore e match) in modo incrementale:
+
+- i match successivi al cursore (match_date, match_id) sono letti in
+  streaming a blocchi
+- il replay riparte dall'ultimo Elo salvato di ogni (giocatore, superficie)
+- le righe nuove sono accodate via COPY, insieme al cursore nella stessa
+  transazione: lo storico esistente non viene mai cancellato né riscritto
+
+Eseguire con: python -m ml.build_elo_surface [--full]
+(--full ricostruisce la tabella da zero, es. dopo un cambio di K)
+"""
+
+import argparse
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
 from sqlalchemy import text
+
+from app.bulk_copy import copy_dataframe, create_staging_table, upsert_from_staging
 from app.database import engine
+from ml.feature_families import SURFACES
+from ml.rating_engine import RatingState, iter_rating_matches, prepare_rating_matches, rate_matches
+
+ELO_COLUMNS = ["player_id", "surface", "match_id", "match_date", "elo"]
+ELO_KEYS = ["player_id", "surface", "match_id"]
+
 
-K = 32
-BASE_ELO = 1500.0
-
-
-def expected_score(elo_a, elo_b):
-    return 1 / (1 + 10 ** ((elo_b - elo_a) / 400))
-
-
-def build_elo_surface():
-    with engine.connect() as conn:
-        matches = conn.execute(text("""
-            SELECT
-                id,
-                match_date,
-                surface,
-                winner_id,
-                loser_id
-            FROM matches
-            WHERE surface IN ('Hard', 'Clay', 'Grass')
-            ORDER BY match_date ASC, id ASC
-        """)).fetchall()
-
-    # elo[player_id][surface]
-    elo = defaultdict(lambda: {
-        "Hard": BASE_ELO,
-        "Clay": BASE_ELO,
-        "Grass": BASE_ELO
+def create_tables():
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS player_elo (
+                player_id INTEGER NOT NULL,
+                surface VARCHAR(10) NOT NULL,
+                match_id INTEGER NOT NULL,
+                match_date DATE,
+                elo FLOAT,
+                PRIMARY KEY (player_id, surface, match_id)
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS player_elo_cursor (
+                id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                last_match_date DATE,
+                last_match_id INTEGER,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+
+
+# =============================================================================
+# CURSORE E STATO
+# =============================================================================
+
+def get_elo_cursor(conn):
+    """
+    Ultimo match processato (match_date, match_id), oppure None.
+    Senza cursore salvato (tabella costruita dalla versione precedente)
+    usa l'ultima riga di player_elo.
+    """
+    row = conn.execute(text("""
+        SELECT last_match_date AS match_date, last_match_id AS match_id
+        FROM player_elo_cursor
+        WHERE id = 1
+    """)).fetchone()
+    if not row:
+        row = conn.execute(text("""
+            SELECT match_date, match_id
+            FROM player_elo
+            ORDER BY match_date DESC, match_id DESC
+            LIMIT 1
+        """)).fetchone()
+    return (row.match_date, int(row.match_id)) if row else None
+
+
+def save_elo_cursor(conn, match_date, match_id: int):
+    conn.execute(text("""
+        INSERT INTO player_elo_cursor (id, last_match_date, last_match_id, updated_at)
+        VALUES (1, :d, :id, CURRENT_TIMESTAMP)
+        ON CONFLICT (id) DO UPDATE
+        SET last_match_date = EXCLUDED.last_match_date,
+            last_match_id = EXCLUDED.last_match_id,
+            updated_at = EXCLUDED.updated_at
+    """), {"d": match_date, "id": int(match_id)})
+
+
+def load_latest_elo(conn) -> Dict[Tuple[int, str], float]:
+    """Ultimo Elo salvato per (giocatore, superficie)."""
+    rows = conn.execute(text("""
+        SELECT DISTINCT ON (player_id, surface) player_id, surface, elo
+        FROM player_elo
+        ORDER BY player_id, surface, match_date DESC, match_id DESC
+    """))
+    return {(int(r.player_id), r.surface): float(r.elo) for r in rows}
+
+
+def state_from_latest(latest: Dict[Tuple[int, str], float]) -> RatingState:
+    """RatingState con l'Elo per superficie ripreso da player_elo."""
+    surface_codes = {s: i for i, s in enumerate(SURFACES)}
+    latest = {key: elo for key, elo in latest.items() if key[1] in surface_codes}
+    pids = np.fromiter((pid for pid, _ in latest), np.int64, len(latest))
+    surfaces = np.fromiter((surface_codes[surface] for _, surface in latest), np.int64, len(latest))
+    elos = np.fromiter(latest.values(), np.float64, len(latest))
+
+    state = RatingState(np.unique(pids))
+    state.surface_elo[state.index_of(pids), surfaces] = elos
+    return state
+
+
+# =============================================================================
+# BUILD
+# =============================================================================
+
+def elo_rows(df: pd.DataFrame, state: RatingState) -> pd.DataFrame:
+    """Replay di un blocco di match: righe player_elo (solo Hard/Clay/Grass)."""
+    matches = prepare_rating_matches(df)
+    state.extend_for(matches)
+    ratings = rate_matches(matches, state)
+
+    keep = np.repeat(df["surface"].isin(SURFACES).to_numpy(), 2)
+    return pd.DataFrame({
+        "player_id": ratings["player_id"][keep],
+        "surface": np.repeat(df["surface"].to_numpy(object), 2)[keep],
+        "match_id": ratings["match_id"][keep],
+        "match_date": np.repeat(pd.to_datetime(df["match_date"]).dt.date.to_numpy(object), 2)[keep],
+        "elo": ratings["surface_elo_post"][keep],
     })
 
-    rows = []
 
-    for m in matches:
-        surface = m.surface
-        match_id = m.id
-        match_date = m.match_date
+def append_elo_rows(conn, rows: pd.DataFrame):
+    """Accoda righe a player_elo via COPY (righe già presenti ignorate)."""
+    create_staging_table(conn, "player_elo_staging", "player_elo", ELO_COLUMNS)
+    copy_dataframe(conn, "player_elo_staging", rows, ELO_COLUMNS)
+    upsert_from_staging(conn, "player_elo", "player_elo_staging", ELO_COLUMNS, ELO_KEYS, update=False)
 
-        A = m.winner_id
-        B = m.loser_id
 
-        elo_A = elo[A][surface]
-        elo_B = elo[B][surface]
+def build_elo_surface(full: bool = False) -> int:
+    """
+    Aggiorna player_elo con i match dopo il cursore.
 
-        exp_A = expected_score(elo_A, elo_B)
-        exp_B = expected_score(elo_B, elo_A)
+    Returns:
+        Numero di righe accodate
+    """
+    create_tables()
 
-        elo_A_new = elo_A + K * (1 - exp_A)
-        elo_B_new = elo_B + K * (0 - exp_B)
+    with engine.begin() as conn:
+        if full:
+            conn.execute(text("DELETE FROM player_elo"))
+            conn.execute(text("DELETE FROM player_elo_cursor"))
+        cursor = get_elo_cursor(conn)
+        latest = load_latest_elo(conn) if cursor else {}
 
-        elo[A][surface] = elo_A_new
-        elo[B][surface] = elo_B_new
+    if cursor:
+        print(f"▶ Resume from > ({cursor[0]}, {cursor[1]}), giocatori: {len(latest)}")
+    state = state_from_latest(latest)
 
-        rows.append({
-            "pid": A,
-            "surface": surface,
-            "mid": match_id,
-            "date": match_date,
-            "elo": elo_A_new
-        })
-        rows.append({
-            "pid": B,
-            "surface": surface,
-            "mid": match_id,
-            "date": match_date,
-            "elo": elo_B_new
-        })
+    appended = 0
+    for df in iter_rating_matches(cursor):
+        rows = elo_rows(df, state)
+        last = df.iloc[-1]
+        # Righe e cursore nella stessa transazione
+        with engine.begin() as conn:
+            append_elo_rows(conn, rows)
+            save_elo_cursor(conn, last["match_date"], last["id"])
+        appended += len(rows)
+        print(f"   Processati fino al {last['match_date']}: {appended} righe")
 
-    return rows
+    return appended
 
 
-def save_to_db(rows):
-    with engine.begin() as conn:
-        conn.execute(text("DELETE FROM player_elo"))
+def main():
+    parser = argparse.ArgumentParser(description="Storico Elo per superficie (player_elo)")
+    parser.add_argument("--full", action="store_true", help="ricostruisce player_elo da zero")
+    args = parser.parse_args()
 
-        conn.execute(
-            text("""
-                INSERT INTO player_elo
-                    (player_id, surface, match_id, match_date, elo)
-                VALUES
-                    (:pid, :surface, :mid, :date, :elo)
-                ON CONFLICT (player_id, surface, match_id)
-                DO NOTHING
-            """),
-            rows
-        )
+    rows = build_elo_surface(full=args.full)
+    print(f"✅ Elo per superficie aggiornato ({rows} record nuovi)")
 
 
 if __name__ == "__main__":
-    rows = build_elo_surface()
-    save_to_db(rows)
-    print(f"✅ Elo per superficie calcolato e salvato ({len(rows)} record)")
+    main()
@@ -0,0 +1,208 @@
+"""
+Elo Sweep
+==========
+Valuta molte configurazioni Elo in un solo replay dei match.
+
+Lo stato ha un asse di configurazione: rating di forma
+(giocatori, superfici, configurazioni), aggiornati per ogni match con
+operazioni NumPy su tutte le configurazioni insieme. Ogni configurazione
+ha un K della forma del rating engine:
+
+    K = k / (match giocati + offset) ** shape
+
+(shape = 0 -> K fisso = k, come il feature store). Il rating iniziale è
+BASE_ELO per tutte: l'expected score dipende solo dalle differenze di
+rating, quindi cambiare il valore iniziale non cambia le metriche.
+Per ogni configurazione vengono riportati log-loss e Brier score
+dell'expected score PRE-MATCH del vincitore.
+
+Eseguire con:
+    python -m ml.elo_sweep [--overall] [--eval-from 1990-01-01] [--output sweep.csv]
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import time
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from ml.feature_families import BASE_ELO, K, SURFACES
+from ml.rating_engine import NO_SURFACE, load_rating_matches, prepare_rating_matches
+
+PROGRESS_EVERY = 100000
+PROB_EPSILON = 1e-15
+
+# Griglia di default: K fisso + K decrescente (116 configurazioni)
+FIXED_K = tuple(range(8, 72, 2))
+DECAY_K = (100.0, 150.0, 200.0, 250.0, 300.0, 350.0, 400.0)
+DECAY_OFFSETS = (2.0, 5.0, 10.0)
+DECAY_SHAPES = (0.3, 0.4, 0.5, 0.6)
+
+
+# =============================================================================
+# CONFIGURAZIONI
+# =============================================================================
+
+def config_grid(
+    fixed_k: Sequence[float] = FIXED_K,
+    decay_k: Sequence[float] = DECAY_K,
+    offsets: Sequence[float] = DECAY_OFFSETS,
+    shapes: Sequence[float] = DECAY_SHAPES,
+) -> pd.DataFrame:
+    """Una riga per configurazione (k, offset, shape)."""
+    rows = [{"k": float(k), "offset": 0.0, "shape": 0.0} for k in fixed_k]
+    rows += [
+        {"k": float(k), "offset": float(offset), "shape": float(shape)}
+        for k, offset, shape in itertools.product(decay_k, offsets, shapes)
+    ]
+    return pd.DataFrame(rows)
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+def sweep(
+    matches: Dict[str, np.ndarray],
+    configs: pd.DataFrame,
+    by_surface: bool = True,
+    eval_from: Optional[date] = None,
+) -> pd.DataFrame:
+    """
+    Replay dei match con tutte le configurazioni in parallelo.
+
+    by_surface: Elo per (giocatore, superficie) come il feature store,
+    altrimenti Elo overall. Solo i match da eval_from in poi entrano
+    nelle metriche (i precedenti scaldano i rating).
+
+    Returns:
+        configs con le colonne log_loss, brier, accuracy, ordinato per log_loss
+    """
+    k = configs["k"].to_numpy(np.float64)
+    offset = configs["offset"].to_numpy(np.float64)
+    shape = configs["shape"].to_numpy(np.float64)
+    n_configs = len(configs)
+
+    surfaces = matches["surface"]
+    if by_surface:
+        keep = surfaces != NO_SURFACE
+        matches = {key: values[keep] for key, values in matches.items() if key != "n"}
+        matches["n"] = int(keep.sum())
+        surfaces = matches["surface"].astype(np.int64)
+    else:
+        surfaces = np.zeros(matches["n"], dtype=np.int64)
+    n_slots = len(SURFACES) if by_surface else 1
+
+    player_ids = np.unique(np.concatenate([matches["winner_id"], matches["loser_id"]]))
+    n_players = len(player_ids)
+
+    # (giocatore, superficie, configurazione)
+    elo = np.full((n_players, n_slots, n_configs), BASE_ELO, dtype=np.float64)
+    played = np.zeros((n_players, n_slots), dtype=np.int64)
+
+    first_eval = 0
+    if eval_from is not None:
+        first_eval = int(np.searchsorted(matches["day"], np.datetime64(eval_from, "D").astype(np.int64)))
+
+    log_loss = np.zeros(n_configs, dtype=np.float64)
+    brier = np.zeros(n_configs, dtype=np.float64)
+    correct = np.zeros(n_configs, dtype=np.float64)
+
+    # Liste Python per l'accesso scalare nel loop
+    idx_a = np.searchsorted(player_ids, matches["winner_id"]).tolist()
+    idx_b = np.searchsorted(player_ids, matches["loser_id"]).tolist()
+    slots = surfaces.tolist()
+
+    for i in range(matches["n"]):
+        a, b, s = idx_a[i], idx_b[i], slots[i]
+
+        elo_A, elo_B = elo[a, s], elo[b, s]
+        exp_A = 1.0 / (1.0 + 10 ** ((elo_B - elo_A) / 400.0))
+
+        if i >= first_eval:
+            log_loss -= np.log(np.maximum(exp_A, PROB_EPSILON))
+            brier += (1.0 - exp_A) ** 2
+            correct += exp_A > 0.5
+
+        n_A, n_B = int(played[a, s]), int(played[b, s])
+        k_A = k / (n_A + offset) ** shape
+        k_B = k / (n_B + offset) ** shape
+        elo[a, s] = elo_A + k_A * (1.0 - exp_A)
+        elo[b, s] = elo_B + k_B * (0.0 - (1.0 - exp_A))
+        played[a, s] = n_A + 1
+        played[b, s] = n_B + 1
+
+        if (i + 1) % PROGRESS_EVERY == 0:
+            print(f"   Processati {i + 1} match...")
+
+    evaluated = max(matches["n"] - first_eval, 1)
+    results = configs.copy()
+    results["log_loss"] = log_loss / evaluated
+    results["brier"] = brier / evaluated
+    results["accuracy"] = correct / evaluated
+    results.attrs["evaluated"] = matches["n"] - first_eval
+    return results.sort_values("log_loss").reset_index(drop=True)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def parse_values(raw: Optional[str], default: Sequence[float]) -> List[float]:
+    if raw is None:
+        return list(default)
+    return [float(v) for v in raw.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep delle configurazioni Elo")
+    parser.add_argument("--overall", action="store_true",
+                        help="Elo overall invece che per superficie")
+    parser.add_argument("--eval-from", type=date.fromisoformat,
+                        help="data (YYYY-MM-DD) da cui calcolare le metriche")
+    parser.add_argument("--k", help="K fissi, separati da virgola")
+    parser.add_argument("--decay-k", help="k del K decrescente, separati da virgola")
+    parser.add_argument("--offsets", help="offset del K decrescente")
+    parser.add_argument("--shapes", help="esponenti del K decrescente")
+    parser.add_argument("--output", help="CSV con i risultati di tutte le configurazioni")
+    args = parser.parse_args()
+
+    configs = config_grid(
+        parse_values(args.k, FIXED_K),
+        parse_values(args.decay_k, DECAY_K),
+        parse_values(args.offsets, DECAY_OFFSETS),
+        parse_values(args.shapes, DECAY_SHAPES),
+    )
+
+    print("=" * 60)
+    print(f"🎯 ELO SWEEP: {len(configs)} configurazioni")
+    print("=" * 60)
+
+    start = time.perf_counter()
+    matches = prepare_rating_matches(load_rating_matches())
+    print(f"📊 Match caricati: {matches['n']:,}")
+
+    results = sweep(matches, configs, by_surface=not args.overall, eval_from=args.eval_from)
+    print(f"\n⏱️  Replay: {time.perf_counter() - start:.1f}s, "
+          f"match valutati: {results.attrs['evaluated']:,}")
+
+    print("\n📊 Migliori configurazioni (log-loss)\n")
+    print(results.head(15).round(5).to_string(index=False))
+
+    current = results[(results["k"] == K) & (results["shape"] == 0.0)]
+    if not current.empty:
+        rank = int(current.index[0]) + 1
+        print(f"\n📌 Configurazione attuale (K={K:g}): posizione {rank}/{len(results)}")
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"\n✅ Risultati salvati: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
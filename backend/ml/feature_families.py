@@ -0,0 +1,852 @@
+"""
+Feature Families
+=================
+Registro delle famiglie di feature del feature store.
+
+Ogni famiglia dichiara in un solo posto:
+- columns: colonne di player_match_features che emette (nome -> tipo SQL)
+- table / table_columns / table_keys / table_ddl: tabella stato persistita
+- state_slot: campo di FeatureStates scritto nella tabella stato
+  (memory_slots: campi solo in memoria, salvati in checkpoint e snapshot)
+- empty_state(): stato vuoto dei propri campi
+- encode() / decode(): colonne NumPy dei propri campi nel checkpoint
+- emit(): feature PRE-MATCH dei due giocatori dallo stato
+- update(): aggiornamento POST-MATCH dello stato (e degli stati dirty)
+- load() / state_rows(): lettura e scrittura della tabella stato
+
+FeatureReplay esegue il replay con le sole famiglie selezionate, così una
+famiglia si può misurare o ricalcolare senza pagare le altre.
+Una nuova famiglia si aggiunge con @register_family: FeatureStates,
+empty_states() e il checkpoint sono costruiti dal registro.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict, namedtuple
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+import numpy as np
+from sqlalchemy import text
+
+from ml.rolling_windows import RollingDates, RollingResults, day_number
+
+SURFACES = ("Hard", "Clay", "Grass")
+TOURNAMENT_LEVELS = ("G", "M", "A", "B", "C", "D", "F")  # Grand Slam, Masters, etc.
+BASE_ELO = 1500.0
+K = 32.0
+
+# Finestre mobili: ultimi N match per la form, ultimi N giorni per l'attività
+FORM_WINDOWS = (5, 10)
+FORM_HISTORY = 10  # risultati persistiti in player_form_state
+ACTIVITY_WINDOWS = (30,)
+# Una colonna feature per finestra
+FORM_COLUMNS = tuple(f"recent_{n}" for n in FORM_WINDOWS)
+ACTIVITY_COLUMNS = tuple(f"matches_last_{d}d" for d in ACTIVITY_WINDOWS)
+
+# Data mancante nelle colonne giorno del checkpoint
+NO_DATE = np.iinfo(np.int64).min
+
+
+# =============================================================================
+# UTILITY FUNCTIONS
+# =============================================================================
+
+def expected_score(elo_a: float, elo_b: float) -> float:
+    return 1.0 / (1.0 + 10 ** ((elo_b - elo_a) / 400.0))
+
+
+def safe_ratio(numerator: int, denominator: int, default: float = 0.0) -> float:
+    """Calcola ratio evitando divisione per zero."""
+    if denominator is None or denominator == 0:
+        return default
+    if numerator is None:
+        return default
+    return float(numerator) / float(denominator)
+
+
+def calculate_serve_percentages(stats: Dict[str, int]) -> Dict[str, float]:
+    """Calcola percentuali servizio dai totali."""
+    svpt = stats.get("svpt", 0)
+    first_in = stats.get("1stIn", 0)
+
+    return {
+        "ace_pct": safe_ratio(stats.get("ace", 0), svpt),
+        "df_pct": safe_ratio(stats.get("df", 0), svpt),
+        "first_serve_pct": safe_ratio(first_in, svpt),
+        "first_serve_won_pct": safe_ratio(stats.get("1stWon", 0), first_in),
+        "second_serve_won_pct": safe_ratio(
+            stats.get("2ndWon", 0),
+            svpt - first_in if svpt > first_in else 0
+        ),
+        "bp_save_pct": safe_ratio(
+            stats.get("bpSaved", 0),
+            stats.get("bpFaced", 0)
+        ),
+    }
+
+
+def _ids(values) -> np.ndarray:
+    return np.fromiter(values, dtype=np.int64)
+
+
+# =============================================================================
+# MATCH CONTEXT
+# =============================================================================
+
+# Colonne di player_match_features che non dipendono da nessuno stato
+BASE_COLUMNS = {
+    "match_id": "INTEGER",
+    "player_id": "INTEGER",
+    "opponent_id": "INTEGER",
+    "match_date": "DATE",
+    "surface": "VARCHAR(10)",
+    "rank": "INTEGER",
+    "age": "FLOAT",
+}
+
+
+class MatchContext:
+    """Un match di MATCHES_SQL, con i campi usati da tutte le famiglie."""
+
+    __slots__ = ("row", "match_id", "match_date", "day", "surface", "level", "winner", "loser")
+
+    def __init__(self, row):
+        self.row = row
+        self.match_id = int(row.id)
+        self.match_date = row.match_date
+        self.day = day_number(row.match_date)
+        self.surface = row.surface
+        self.level = row.tournament_level or "A"
+        self.winner = int(row.winner_id)
+        self.loser = int(row.loser_id)
+
+    @property
+    def cursor(self) -> Tuple[date, int]:
+        return self.match_date, self.match_id
+
+    def base_rows(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Righe feature (winner, loser) con le sole colonne di BASE_COLUMNS."""
+        m = self.row
+        A, B = self.winner, self.loser
+        return (
+            {
+                "match_id": self.match_id,
+                "player_id": A,
+                "opponent_id": B,
+                "match_date": self.match_date,
+                "surface": self.surface,
+                "rank": int(m.winner_rank) if m.winner_rank else None,
+                "age": float(m.winner_age) if m.winner_age else None,
+            },
+            {
+                "match_id": self.match_id,
+                "player_id": B,
+                "opponent_id": A,
+                "match_date": self.match_date,
+                "surface": self.surface,
+                "rank": int(m.loser_rank) if m.loser_rank else None,
+                "age": float(m.loser_age) if m.loser_age else None,
+            },
+        )
+
+
+# =============================================================================
+# REGISTRY
+# =============================================================================
+
+class FeatureFamily:
+    """
+    Una famiglia di feature con il suo stato.
+
+    L'istanza lavora sui dict di FeatureStates (condivisi con checkpoint e
+    snapshot) e tiene in self.dirty le voci di state_slot da riscrivere.
+    emit() è chiamata per tutte le famiglie prima di update(): i valori
+    PRE-MATCH letti in emit() restano nell'istanza fino a update().
+    """
+
+    name: str = ""
+    columns: Dict[str, str] = {}
+    table: str = ""
+    table_columns: List[str] = []
+    table_keys: List[str] = []
+    table_ddl: str = ""
+    state_slot: str = ""
+    memory_slots: Tuple[str, ...] = ()
+
+    def __init__(self, states: FeatureStates):
+        self.states = states
+        self.dirty: Dict[Any, Any] = {}
+
+    @classmethod
+    def slots(cls) -> Tuple[str, ...]:
+        """Campi di FeatureStates di proprietà della famiglia."""
+        return (cls.state_slot,) + cls.memory_slots
+
+    @classmethod
+    def empty_state(cls) -> Dict[str, Any]:
+        """Campo -> stato vuoto, per ogni campo di slots() (default dict vuoti)."""
+        return {slot: {} for slot in cls.slots()}
+
+    def emit(self, m: MatchContext, row_a: Dict[str, Any], row_b: Dict[str, Any]):
+        raise NotImplementedError
+
+    def update(self, m: MatchContext):
+        raise NotImplementedError
+
+    @classmethod
+    def state_rows(cls, items: Dict[Any, Any]) -> List[Dict[str, Any]]:
+        """Voci di state_slot -> righe della tabella stato."""
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, conn, states: FeatureStates):
+        """Carica la tabella stato in states (tabella assente = stato vuoto)."""
+        raise NotImplementedError
+
+    @classmethod
+    def encode(cls, states: FeatureStates) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """
+        Campi della famiglia -> colonne NumPy del checkpoint.
+
+        Returns:
+            Tuple di (nome colonna -> array, metadati JSON per decode())
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def decode(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Colonne e metadati di encode() -> campo -> stato."""
+        raise NotImplementedError
+
+
+FAMILIES: Dict[str, Type[FeatureFamily]] = {}
+
+# Stato completo del feature store (formato di load_states()): un campo per
+# ogni slot delle famiglie registrate, ricostruito da register_family()
+FeatureStates = namedtuple("FeatureStates", [])
+
+
+def register_family(cls: Type[FeatureFamily]) -> Type[FeatureFamily]:
+    global FeatureStates
+    owners = {slot: family.name for family in FAMILIES.values() for slot in family.slots()}
+    for slot in cls.slots():
+        if owners.get(slot, cls.name) != cls.name:
+            raise ValueError(f"Campo di stato {slot} già usato dalla famiglia {owners[slot]}")
+    FAMILIES[cls.name] = cls
+    FeatureStates = namedtuple(
+        "FeatureStates", [slot for family in FAMILIES.values() for slot in family.slots()]
+    )
+    return cls
+
+
+def empty_states() -> FeatureStates:
+    """Stati vuoti nel formato di load_states() (replay da zero)."""
+    slots: Dict[str, Any] = {}
+    for family in FAMILIES.values():
+        slots.update(family.empty_state())
+    return FeatureStates(**slots)
+
+
+def check_slots(names: Iterable[str]):
+    """ValueError se un nome non è un campo di FeatureStates."""
+    unknown = set(names) - set(FeatureStates._fields)
+    if unknown:
+        raise ValueError(
+            f"Campi di stato sconosciuti: {', '.join(sorted(unknown))} "
+            f"(disponibili: {', '.join(FeatureStates._fields)})"
+        )
+
+
+def as_states(states) -> FeatureStates:
+    """Tupla di stati nell'ordine dei campi -> FeatureStates del registro corrente."""
+    if isinstance(states, FeatureStates):
+        return states
+    return FeatureStates(*states)
+
+
+def select_families(names: Optional[Iterable[str]] = None) -> List[Type[FeatureFamily]]:
+    """Famiglie selezionate (tutte se names è None), nell'ordine del registro."""
+    if names is None:
+        return list(FAMILIES.values())
+    names = set(names)
+    unknown = names - set(FAMILIES)
+    if unknown:
+        raise ValueError(
+            f"Famiglie sconosciute: {', '.join(sorted(unknown))} "
+            f"(disponibili: {', '.join(FAMILIES)})"
+        )
+    return [cls for name, cls in FAMILIES.items() if name in names]
+
+
+def feature_columns(families: Optional[Iterable[Type[FeatureFamily]]] = None) -> List[str]:
+    """Colonne di player_match_features: base + colonne delle famiglie."""
+    columns = list(BASE_COLUMNS)
+    for cls in families if families is not None else FAMILIES.values():
+        columns.extend(cls.columns)
+    return columns
+
+
+# =============================================================================
+# FAMILIES
+# =============================================================================
+
+@register_family
+class SurfaceEloFamily(FeatureFamily):
+    """Elo e win rate per superficie."""
+
+    name = "surface_elo"
+    columns = {"elo": "FLOAT", "surface_wr": "FLOAT"}
+    table = "player_surface_state"
+    table_columns = ["player_id", "surface", "elo", "matches_cnt", "wins_cnt"]
+    table_keys = ["player_id", "surface"]
+    table_ddl = """
+        CREATE TABLE IF NOT EXISTS player_surface_state (
+            player_id INTEGER NOT NULL,
+            surface VARCHAR(10) NOT NULL,
+            elo FLOAT,
+            matches_cnt INTEGER,
+            wins_cnt INTEGER,
+            PRIMARY KEY (player_id, surface)
+        )
+    """
+    # (player_id, surface) -> (elo, matches_cnt, wins_cnt)
+    state_slot = "surface"
+
+    def emit(self, m, row_a, row_b):
+        surface_state = self.states.surface
+        elo_A, mcnt_A, wcnt_A = surface_state.get((m.winner, m.surface), (BASE_ELO, 0, 0))
+        elo_B, mcnt_B, wcnt_B = surface_state.get((m.loser, m.surface), (BASE_ELO, 0, 0))
+        row_a["elo"] = float(elo_A)
+        row_a["surface_wr"] = safe_ratio(wcnt_A, mcnt_A)
+        row_b["elo"] = float(elo_B)
+        row_b["surface_wr"] = safe_ratio(wcnt_B, mcnt_B)
+        self.pre = (elo_A, mcnt_A, wcnt_A, elo_B, mcnt_B, wcnt_B)
+
+    def update(self, m):
+        elo_A, mcnt_A, wcnt_A, elo_B, mcnt_B, wcnt_B = self.pre
+        key_A, key_B = (m.winner, m.surface), (m.loser, m.surface)
+
+        exp_A = expected_score(elo_A, elo_B)
+        elo_A_new = elo_A + K * (1.0 - exp_A)
+        elo_B_new = elo_B + K * (0.0 - (1.0 - exp_A))
+
+        surface_state = self.states.surface
+        surface_state[key_A] = (elo_A_new, mcnt_A + 1, wcnt_A + 1)
+        surface_state[key_B] = (elo_B_new, mcnt_B + 1, wcnt_B)
+        self.dirty[key_A] = surface_state[key_A]
+        self.dirty[key_B] = surface_state[key_B]
+
+    @classmethod
+    def state_rows(cls, items):
+        return [
+            {"player_id": pid, "surface": surf, "elo": elo,
+             "matches_cnt": mcnt, "wins_cnt": wcnt}
+            for (pid, surf), (elo, mcnt, wcnt) in items.items()
+        ]
+
+    @classmethod
+    def load(cls, conn, states):
+        try:
+            for r in conn.execute(text("""
+                SELECT player_id, surface, elo, matches_cnt, wins_cnt
+                FROM player_surface_state
+            """)):
+                states.surface[(r.player_id, r.surface)] = (
+                    float(r.elo), int(r.matches_cnt), int(r.wins_cnt)
+                )
+        except Exception:
+            pass  # Tabella non esiste ancora
+
+    @classmethod
+    def encode(cls, states):
+        surface_codes = {s: i for i, s in enumerate(SURFACES)}
+        items = [(k, v) for k, v in states.surface.items() if k[1] in surface_codes]
+        return {
+            "player": _ids(pid for (pid, _), _ in items),
+            "code": np.fromiter((surface_codes[s] for (_, s), _ in items), np.int8),
+            "elo": np.fromiter((v[0] for _, v in items), np.float64),
+            "matches": _ids(v[1] for _, v in items),
+            "wins": _ids(v[2] for _, v in items),
+        }, {}
+
+    @classmethod
+    def decode(cls, arrays, meta):
+        return {"surface": {
+            (pid, SURFACES[code]): (elo, m, w)
+            for pid, code, elo, m, w in zip(
+                arrays["player"].tolist(), arrays["code"].tolist(), arrays["elo"].tolist(),
+                arrays["matches"].tolist(), arrays["wins"].tolist(),
+            )
+        }}
+
+
+@register_family
+class FormFamily(FeatureFamily):
+    """Win rate negli ultimi N match, per ogni finestra di FORM_WINDOWS."""
+
+    name = "form"
+    columns = {column: "FLOAT" for column in FORM_COLUMNS}
+    table = "player_form_state"
+    table_columns = ["player_id", "last_results"]
+    table_keys = ["player_id"]
+    table_ddl = """
+        CREATE TABLE IF NOT EXISTS player_form_state (
+            player_id INTEGER PRIMARY KEY,
+            last_results INTEGER[]
+        )
+    """
+    # player_id -> ultimi risultati [0/1] con somme per finestra
+    state_slot = "form"
+
+    def emit(self, m, row_a, row_b):
+        form_state = self.states.form
+        form_A = form_state.get(m.winner) or RollingResults(FORM_WINDOWS, FORM_HISTORY)
+        form_B = form_state.get(m.loser) or RollingResults(FORM_WINDOWS, FORM_HISTORY)
+        row_a.update(zip(FORM_COLUMNS, form_A.means()))
+        row_b.update(zip(FORM_COLUMNS, form_B.means()))
+        self.pre = (form_A, form_B)
+
+    def update(self, m):
+        form_A, form_B = self.pre
+        form_A.push(1)
+        form_B.push(0)
+        self.states.form[m.winner] = form_A
+        self.states.form[m.loser] = form_B
+        self.dirty[m.winner] = form_A
+        self.dirty[m.loser] = form_B
+
+    @classmethod
+    def state_rows(cls, items):
+        return [
+            {"player_id": pid, "last_results": list(dq)}
+            for pid, dq in items.items()
+        ]
+
+    @classmethod
+    def load(cls, conn, states):
+        try:
+            for r in conn.execute(text("""
+                SELECT player_id, last_results
+                FROM player_form_state
+            """)):
+                states.form[int(r.player_id)] = RollingResults.from_values(
+                    r.last_results, FORM_WINDOWS, FORM_HISTORY
+                )
+        except Exception:
+            pass
+
+    @classmethod
+    def encode(cls, states):
+        values = [list(results) for results in states.form.values()]
+        return {
+            "player": _ids(states.form.keys()),
+            "offsets": np.cumsum([0] + [len(v) for v in values], dtype=np.int64),
+            "values": np.fromiter((x for v in values for x in v), np.int8),
+        }, {}
+
+    @classmethod
+    def decode(cls, arrays, meta):
+        offsets = arrays["offsets"].tolist()
+        values = arrays["values"].tolist()
+        return {"form": {
+            pid: RollingResults.from_values(values[offsets[i]:offsets[i + 1]], FORM_WINDOWS, FORM_HISTORY)
+            for i, pid in enumerate(arrays["player"].tolist())
+        }}
+
+
+@register_family
+class H2HFamily(FeatureFamily):
+    """Vittorie negli scontri diretti."""
+
+    name = "h2h"
+    columns = {"h2h_wins": "INTEGER"}
+    table = "h2h_state"
+    table_columns = ["player_id", "opponent_id", "wins"]
+    table_keys = ["player_id", "opponent_id"]
+    table_ddl = """
+        CREATE TABLE IF NOT EXISTS h2h_state (
+            player_id INTEGER NOT NULL,
+            opponent_id INTEGER NOT NULL,
+            wins INTEGER,
+            PRIMARY KEY (player_id, opponent_id)
+        )
+    """
+    # (player_id, opponent_id) -> wins
+    state_slot = "h2h"
+
+    def emit(self, m, row_a, row_b):
+        h2h = self.states.h2h
+        h2h_A = h2h.get((m.winner, m.loser), 0)
+        row_a["h2h_wins"] = int(h2h_A)
+        row_b["h2h_wins"] = int(h2h.get((m.loser, m.winner), 0))
+        self.pre = h2h_A
+
+    def update(self, m):
+        key = (m.winner, m.loser)
+        self.states.h2h[key] = self.pre + 1
+        self.dirty[key] = self.states.h2h[key]
+
+    @classmethod
+    def state_rows(cls, items):
+        return [
+            {"player_id": a, "opponent_id": b, "wins": wins}
+            for (a, b), wins in items.items()
+        ]
+
+    @classmethod
+    def load(cls, conn, states):
+        try:
+            for r in conn.execute(text("""
+                SELECT player_id, opponent_id, wins
+                FROM h2h_state
+            """)):
+                states.h2h[(int(r.player_id), int(r.opponent_id))] = int(r.wins)
+        except Exception:
+            pass
+
+    @classmethod
+    def encode(cls, states):
+        h2h = states.h2h
+        return {
+            "player": _ids(a for a, _ in h2h),
+            "opponent": _ids(b for _, b in h2h),
+            "wins": _ids(h2h.values()),
+        }, {}
+
+    @classmethod
+    def decode(cls, arrays, meta):
+        return {"h2h": dict(zip(
+            zip(arrays["player"].tolist(), arrays["opponent"].tolist()),
+            arrays["wins"].tolist(),
+        ))}
+
+
+@register_family
+class ActivityFamily(FeatureFamily):
+    """Giorni dall'ultimo match e match negli ultimi N giorni (ACTIVITY_WINDOWS)."""
+
+    name = "activity"
+    columns = {
+        "days_since_last_match": "INTEGER",
+        **{column: "INTEGER" for column in ACTIVITY_COLUMNS},
+    }
+    table = "player_activity_state"
+    table_columns = ["player_id", "last_match_date"]
+    table_keys = ["player_id"]
+    table_ddl = """
+        CREATE TABLE IF NOT EXISTS player_activity_state (
+            player_id INTEGER PRIMARY KEY,
+            last_match_date DATE
+        )
+    """
+    # player_id -> data ultimo match
+    state_slot = "last_match"
+    # player_id -> date dei match recenti (solo checkpoint e snapshot)
+    memory_slots = ("recent",)
+
+    def emit(self, m, row_a, row_b):
+        last_match, recent_matches = self.states.last_match, self.states.recent
+        for row, pid in ((row_a, m.winner), (row_b, m.loser)):
+            last = last_match.get(pid)
+            row["days_since_last_match"] = (m.match_date - last).days if last else None
+            recent = recent_matches.get(pid)
+            counts = recent.counts(m.day) if recent else [0] * len(ACTIVITY_COLUMNS)
+            row.update(zip(ACTIVITY_COLUMNS, counts))
+
+    def update(self, m):
+        recent_matches = self.states.recent
+        for pid in (m.winner, m.loser):
+            self.states.last_match[pid] = m.match_date
+            self.dirty[pid] = m.match_date
+            recent = recent_matches.get(pid)
+            if recent is None:
+                recent = recent_matches[pid] = RollingDates(ACTIVITY_WINDOWS)
+            recent.push(m.day)
+
+    @classmethod
+    def state_rows(cls, items):
+        return [
+            {"player_id": pid, "last_match_date": dt}
+            for pid, dt in items.items()
+        ]
+
+    @classmethod
+    def load(cls, conn, states):
+        try:
+            for r in conn.execute(text("""
+                SELECT player_id, last_match_date
+                FROM player_activity_state
+            """)):
+                states.last_match[int(r.player_id)] = r.last_match_date
+        except Exception:
+            pass
+
+    @classmethod
+    def encode(cls, states):
+        last_match, recent = states.last_match, states.recent
+        recent_days = [list(days) for days in recent.values()]
+        return {
+            "player": _ids(last_match.keys()),
+            "day": _ids(
+                NO_DATE if d is None else int(np.datetime64(d, "D").astype(np.int64))
+                for d in last_match.values()
+            ),
+            "recent_player": _ids(recent.keys()),
+            "recent_offsets": np.cumsum([0] + [len(d) for d in recent_days], dtype=np.int64),
+            "recent_days": _ids(x for d in recent_days for x in d),
+        }, {}
+
+    @classmethod
+    def decode(cls, arrays, meta):
+        days = arrays["day"]
+        dates = days.astype("datetime64[D]").astype(object)
+        last_match = {
+            pid: (None if day == NO_DATE else d)
+            for pid, day, d in zip(arrays["player"].tolist(), days.tolist(), dates.tolist())
+        }
+        offsets = arrays["recent_offsets"].tolist()
+        recent_days = arrays["recent_days"].tolist()
+        recent = {
+            pid: RollingDates.from_days(recent_days[offsets[i]:offsets[i + 1]], ACTIVITY_WINDOWS)
+            for i, pid in enumerate(arrays["recent_player"].tolist())
+        }
+        return {"last_match": last_match, "recent": recent}
+
+
+# Colonne servizio di MATCHES_SQL per chiave dei totali
+SERVE_STAT_COLUMNS = (
+    ("ace", "ace"), ("df", "df"), ("svpt", "svpt"), ("1stIn", "1stin"),
+    ("1stWon", "1stwon"), ("2ndWon", "2ndwon"), ("bpFaced", "bpfaced"), ("bpSaved", "bpsaved"),
+)
+
+
+@register_family
+class ServeFamily(FeatureFamily):
+    """Percentuali al servizio dai totali di carriera."""
+
+    name = "serve"
+    columns = {
+        "ace_pct": "FLOAT",
+        "df_pct": "FLOAT",
+        "first_serve_pct": "FLOAT",
+        "first_serve_won_pct": "FLOAT",
+        "second_serve_won_pct": "FLOAT",
+        "bp_save_pct": "FLOAT",
+    }
+    table = "player_serve_state"
+    table_columns = ["player_id", "ace_total", "df_total", "svpt_total",
+                     "first_in_total", "first_won_total", "second_won_total",
+                     "bp_faced_total", "bp_saved_total"]
+    table_keys = ["player_id"]
+    table_ddl = """
+        CREATE TABLE IF NOT EXISTS player_serve_state (
+            player_id INTEGER PRIMARY KEY,
+            ace_total INTEGER DEFAULT 0,
+            df_total INTEGER DEFAULT 0,
+            svpt_total INTEGER DEFAULT 0,
+            first_in_total INTEGER DEFAULT 0,
+            first_won_total INTEGER DEFAULT 0,
+            second_won_total INTEGER DEFAULT 0,
+            bp_faced_total INTEGER DEFAULT 0,
+            bp_saved_total INTEGER DEFAULT 0
+        )
+    """
+    # player_id -> {ace, df, svpt, 1stIn, 1stWon, 2ndWon, bpFaced, bpSaved} (totali)
+    state_slot = "serve"
+
+    @classmethod
+    def empty_state(cls):
+        return {"serve": defaultdict(lambda: defaultdict(int))}
+
+    def emit(self, m, row_a, row_b):
+        serve_stats = self.states.serve
+        row_a.update(calculate_serve_percentages(serve_stats.get(m.winner, {})))
+        row_b.update(calculate_serve_percentages(serve_stats.get(m.loser, {})))
+
+    def update(self, m):
+        # Solo match con statistiche (svpt > 0)
+        row = m.row
+        for pid, prefix in ((m.winner, "w_"), (m.loser, "l_")):
+            if getattr(row, prefix + "svpt") > 0:
+                ss = self.states.serve[pid]
+                for key, col in SERVE_STAT_COLUMNS:
+                    ss[key] += getattr(row, prefix + col)
+                self.dirty[pid] = ss
+
+    @classmethod
+    def state_rows(cls, items):
+        return [
+            {
+                "player_id": pid,
+                "ace_total": ss["ace"],
+                "df_total": ss["df"],
+                "svpt_total": ss["svpt"],
+                "first_in_total": ss["1stIn"],
+                "first_won_total": ss["1stWon"],
+                "second_won_total": ss["2ndWon"],
+                "bp_faced_total": ss["bpFaced"],
+                "bp_saved_total": ss["bpSaved"],
+            }
+            for pid, ss in items.items()
+        ]
+
+    @classmethod
+    def load(cls, conn, states):
+        try:
+            for r in conn.execute(text("""
+                SELECT player_id, ace_total, df_total, svpt_total,
+                       first_in_total, first_won_total, second_won_total,
+                       bp_faced_total, bp_saved_total
+                FROM player_serve_state
+            """)):
+                states.serve[int(r.player_id)] = {
+                    "ace": int(r.ace_total or 0),
+                    "df": int(r.df_total or 0),
+                    "svpt": int(r.svpt_total or 0),
+                    "1stIn": int(r.first_in_total or 0),
+                    "1stWon": int(r.first_won_total or 0),
+                    "2ndWon": int(r.second_won_total or 0),
+                    "bpFaced": int(r.bp_faced_total or 0),
+                    "bpSaved": int(r.bp_saved_total or 0),
+                }
+        except Exception:
+            pass
+
+    @classmethod
+    def encode(cls, states):
+        serve_keys = [key for key, _ in SERVE_STAT_COLUMNS]
+        serve_stats = states.serve
+        return {
+            "player": _ids(serve_stats.keys()),
+            "totals": np.array(
+                [[ss.get(k, 0) for k in serve_keys] for ss in serve_stats.values()], dtype=np.int64
+            ).reshape(-1, len(serve_keys)),
+        }, {"serve_keys": serve_keys}
+
+    @classmethod
+    def decode(cls, arrays, meta):
+        serve_stats = cls.empty_state()["serve"]
+        for pid, totals in zip(arrays["player"].tolist(), arrays["totals"].tolist()):
+            serve_stats[pid] = dict(zip(meta["serve_keys"], totals))
+        return {"serve": serve_stats}
+
+
+@register_family
+class LevelFamily(FeatureFamily):
+    """Win rate per livello di torneo."""
+
+    name = "level"
+    columns = {"level_win_rate": "FLOAT"}
+    table = "player_level_state"
+    table_columns = ["player_id", "level", "matches_cnt", "wins_cnt"]
+    table_keys = ["player_id", "level"]
+    table_ddl = """
+        CREATE TABLE IF NOT EXISTS player_level_state (
+            player_id INTEGER NOT NULL,
+            level VARCHAR(1) NOT NULL,
+            matches_cnt INTEGER DEFAULT 0,
+            wins_cnt INTEGER DEFAULT 0,
+            PRIMARY KEY (player_id, level)
+        )
+    """
+    # (player_id, level) -> (matches, wins)
+    state_slot = "level"
+
+    def emit(self, m, row_a, row_b):
+        level_exp = self.states.level
+        level_m_A, level_w_A = level_exp.get((m.winner, m.level), (0, 0))
+        level_m_B, level_w_B = level_exp.get((m.loser, m.level), (0, 0))
+        row_a["level_win_rate"] = safe_ratio(level_w_A, level_m_A)
+        row_b["level_win_rate"] = safe_ratio(level_w_B, level_m_B)
+        self.pre = (level_m_A, level_w_A, level_m_B, level_w_B)
+
+    def update(self, m):
+        level_m_A, level_w_A, level_m_B, level_w_B = self.pre
+        key_A, key_B = (m.winner, m.level), (m.loser, m.level)
+        level_exp = self.states.level
+        level_exp[key_A] = (level_m_A + 1, level_w_A + 1)
+        level_exp[key_B] = (level_m_B + 1, level_w_B)
+        self.dirty[key_A] = level_exp[key_A]
+        self.dirty[key_B] = level_exp[key_B]
+
+    @classmethod
+    def state_rows(cls, items):
+        return [
+            {"player_id": pid, "level": lvl, "matches_cnt": m, "wins_cnt": w}
+            for (pid, lvl), (m, w) in items.items()
+        ]
+
+    @classmethod
+    def load(cls, conn, states):
+        try:
+            for r in conn.execute(text("""
+                SELECT player_id, level, matches_cnt, wins_cnt
+                FROM player_level_state
+            """)):
+                states.level[(int(r.player_id), r.level)] = (
+                    int(r.matches_cnt), int(r.wins_cnt)
+                )
+        except Exception:
+            pass
+
+    @classmethod
+    def encode(cls, states):
+        level_exp = states.level
+        levels = sorted({lvl for _, lvl in level_exp})
+        level_codes = {lvl: i for i, lvl in enumerate(levels)}
+        return {
+            "player": _ids(pid for pid, _ in level_exp),
+            "code": np.fromiter((level_codes[lvl] for _, lvl in level_exp), np.int8),
+            "matches": _ids(m for m, _ in level_exp.values()),
+            "wins": _ids(w for _, w in level_exp.values()),
+        }, {"levels": levels}
+
+    @classmethod
+    def decode(cls, arrays, meta):
+        levels = meta["levels"]
+        return {"level": {
+            (pid, levels[code]): (m, w)
+            for pid, code, m, w in zip(
+                arrays["player"].tolist(), arrays["code"].tolist(),
+                arrays["matches"].tolist(), arrays["wins"].tolist(),
+            )
+        }}
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+class FeatureReplay:
+    """
+    Replay match per match con le famiglie selezionate.
+    step() ritorna le righe feature PRE-MATCH (winner, loser) e aggiorna
+    lo stato; dirty() gli stati modificati per famiglia dall'ultimo flush.
+    """
+
+    def __init__(self, states, names: Optional[Iterable[str]] = None):
+        self.states = as_states(states)
+        self.families = [cls(self.states) for cls in select_families(names)]
+
+    @property
+    def columns(self) -> List[str]:
+        return feature_columns(type(f) for f in self.families)
+
+    def step(self, m: MatchContext) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        row_a, row_b = m.base_rows()
+        for family in self.families:
+            family.emit(m, row_a, row_b)
+        for family in self.families:
+            family.update(m)
+        return row_a, row_b
+
+    def dirty(self) -> Dict[str, Dict[Any, Any]]:
+        return {family.name: family.dirty for family in self.families}
+
+    def pending(self) -> int:
+        return sum(len(family.dirty) for family in self.families)
+
+    def clear_dirty(self):
+        for family in self.families:
+            family.dirty.clear()
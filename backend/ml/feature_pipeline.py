@@ -7,22 +7,13 @@ Allineato con train_model.py per usare TUTTE le feature.
 
 import json
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, List, Sequence, Tuple, Union
 
 import pandas as pd
 
-from app.services.feature_service import (
-    get_player_id,
-    get_surface_state,
-    get_form,
-    get_h2h,
-    get_latest_rank,
-    get_days_since_last_match,
-    get_player_age,
-    get_matches_last_30_days,
-    get_serve_stats,
-    get_level_experience,
-)
+from app.services.feature_service import player_features
+from app.services.player_cache import player_cache
+from app.services.serving_snapshot import SERVING_MODE, current_snapshot
 
 # Carica la lista delle feature dal training (per consistency)
 FEATURES_PATH = Path("/data/ml/models/feature_columns.json")
@@ -60,76 +51,83 @@ def load_feature_columns():
 FEATURE_COLUMNS = load_feature_columns()
 
 
-def compute_player_features(player_name: str, opponent_name: str, surface: str, level: str = "A") -> Dict:
+def compute_match_features(player_a: str, player_b: str, surface: str, level: str = "A") -> Tuple[Dict, Dict]:
     """
-    Calcola tutte le feature per UN giocatore rispetto all'avversario.
-    
+    Feature raw di entrambi i giocatori di una partita, dallo snapshot in
+    memoria (FEATURE_SERVING=snapshot) o dalla cache di processo
+    (app.services.player_cache): il database è letto solo per i
+    giocatori non in cache o dopo un nuovo build del feature store.
+
     Returns:
-        Dict con tutte le feature raw del giocatore
+        Tuple di (features_a, features_b)
     """
-    player_id = get_player_id(player_name)
-    opponent_id = get_player_id(opponent_name)
-    
-    # Elo e win rate su superficie
-    elo, surface_wr = get_surface_state(player_id, surface)
-    
-    # Form recente
-    recent_5, recent_10 = get_form(player_id)
-    
-    # Head to head
-    h2h_wins = get_h2h(player_id, opponent_id)
-    
-    # Ranking
-    rank = get_latest_rank(player_id)
-    
-    # Nuove feature
-    days_rest = get_days_since_last_match(player_id)
-    age = get_player_age(player_id)
-    matches_30d = get_matches_last_30_days(player_id)
-    serve_stats = get_serve_stats(player_id)
-    level_wr = get_level_experience(player_id, level)
-    
-    return {
-        "elo": elo,
-        "surface_wr": surface_wr,
-        "recent_5": recent_5,
-        "recent_10": recent_10,
-        "h2h_wins": h2h_wins,
-        "rank": rank,
-        "days_rest": days_rest,
-        "age": age,
-        "matches_30d": matches_30d,
-        "ace_pct": serve_stats["ace_pct"],
-        "df_pct": serve_stats["df_pct"],
-        "first_serve_pct": serve_stats["first_serve_pct"],
-        "first_won_pct": serve_stats["first_won_pct"],
-        "bp_save_pct": serve_stats["bp_save_pct"],
-        "level_wr": level_wr,
-    }
+    if SERVING_MODE == "snapshot":
+        return current_snapshot().match_features(player_a, player_b, surface, level)
 
+    id_a, id_b = player_cache.resolve([player_a, player_b])
+    batch = player_cache.features_batch([id_a, id_b])
 
-def compute_features_row(
-    player_a: str,
-    player_b: str,
-    surface: str,
-    level: str = "A",
-) -> Dict:
+    return (
+        player_features(batch, id_a, id_b, surface, level),
+        player_features(batch, id_b, id_a, surface, level),
+    )
+
+
+def compute_batch_features(
+    matches: Sequence[Tuple[str, str, str, str]],
+) -> List[Union[Tuple[Dict, Dict], ValueError]]:
     """
-    Calcola le feature DIFFERENZIALI per una partita.
-    Usata da API /predict e odds pipeline.
-    
+    Feature raw di molte partite (player_a, player_b, surface, level):
+    nomi risolti con una sola query e stato letto in blocco per tutti i
+    giocatori e le coppie h2h (nessuna query con lo snapshot in memoria).
+
     Returns:
-        Dict con tutte le feature *_diff
+        Per ogni partita (features_a, features_b), oppure ValueError se un
+        giocatore non esiste
     """
+    snapshot = current_snapshot() if SERVING_MODE == "snapshot" else None
+    names = [name for m in matches for name in m[:2]]
+    ids = (snapshot or player_cache).lookup(names)
+
+    if snapshot is not None:
+        features = snapshot.player_features
+    else:
+        pairs = []
+        for player_a, player_b, _, _ in matches:
+            if player_a in ids and player_b in ids:
+                pairs += [(ids[player_a], ids[player_b]), (ids[player_b], ids[player_a])]
+        batch = player_cache.features_batch({pid for pair in pairs for pid in pair}, pairs)
+
+        def features(pid, opponent_id, surface, level):
+            return player_features(batch, pid, opponent_id, surface, level)
+
+    results = []
+    for player_a, player_b, surface, level in matches:
+        missing = next((name for name in (player_a, player_b) if name not in ids), None)
+        if missing is not None:
+            results.append(ValueError(f"Giocatore non trovato: {missing}"))
+            continue
+        id_a, id_b = ids[player_a], ids[player_b]
+        results.append((
+            features(id_a, id_b, surface, level),
+            features(id_b, id_a, surface, level),
+        ))
+    return results
+
+
+def compute_player_features(player_name: str, opponent_name: str, surface: str, level: str = "A") -> Dict:
+    """
+    Calcola tutte le feature per UN giocatore rispetto all'avversario.
     
-    # Feature giocatore A
-    feat_a = compute_player_features(player_a, player_b, surface, level)
-    
-    # Feature giocatore B
-    feat_b = compute_player_features(player_b, player_a, surface, level)
-    
-    # Calcola differenze (A - B)
-    features = {
+    Returns:
+        Dict con tutte le feature raw del giocatore
+    """
+    return compute_match_features(player_name, opponent_name, surface, level)[0]
+
+
+def diff_features(feat_a: Dict, feat_b: Dict) -> Dict:
+    """Feature DIFFERENZIALI (A - B) da due dict di feature raw."""
+    return {
         # Feature originali
         "elo_diff": feat_a["elo"] - feat_b["elo"],
         "ranking_diff": feat_a["rank"] - feat_b["rank"],
@@ -148,6 +146,23 @@ def compute_features_row(
         "bp_save_diff": feat_a["bp_save_pct"] - feat_b["bp_save_pct"],
         "level_exp_diff": feat_a["level_wr"] - feat_b["level_wr"],
     }
+
+
+def compute_features_row(
+    player_a: str,
+    player_b: str,
+    surface: str,
+    level: str = "A",
+) -> Dict:
+    """
+    Calcola le feature DIFFERENZIALI per una partita.
+    Usata da API /predict e odds pipeline.
+    
+    Returns:
+        Dict con tutte le feature *_diff
+    """
+    feat_a, feat_b = compute_match_features(player_a, player_b, surface, level)
+    features = diff_features(feat_a, feat_b)
     
     # Filtra solo le feature usate dal modello
     return {k: v for k, v in features.items() if k in FEATURE_COLUMNS}
@@ -202,28 +217,8 @@ def get_features_with_details(
         Tuple di (features_diff, features_a, features_b)
     """
     
-    feat_a = compute_player_features(player_a, player_b, surface, level)
-    feat_b = compute_player_features(player_b, player_a, surface, level)
-    
-    features_diff = {
-        # Feature originali
-        "elo_diff": feat_a["elo"] - feat_b["elo"],
-        "ranking_diff": feat_a["rank"] - feat_b["rank"],
-        "recent_5_diff": feat_a["recent_5"] - feat_b["recent_5"],
-        "recent_10_diff": feat_a["recent_10"] - feat_b["recent_10"],
-        "surface_diff": feat_a["surface_wr"] - feat_b["surface_wr"],
-        "h2h_diff": feat_a["h2h_wins"] - feat_b["h2h_wins"],
-        # Nuove feature
-        "fatigue_diff": feat_b["days_rest"] - feat_a["days_rest"],
-        "age_diff": feat_a["age"] - feat_b["age"],
-        "workload_diff": feat_a["matches_30d"] - feat_b["matches_30d"],
-        "ace_diff": feat_a["ace_pct"] - feat_b["ace_pct"],
-        "df_diff": feat_a["df_pct"] - feat_b["df_pct"],
-        "first_serve_diff": feat_a["first_serve_pct"] - feat_b["first_serve_pct"],
-        "first_won_diff": feat_a["first_won_pct"] - feat_b["first_won_pct"],
-        "bp_save_diff": feat_a["bp_save_pct"] - feat_b["bp_save_pct"],
-        "level_exp_diff": feat_a["level_wr"] - feat_b["level_wr"],
-    }
+    feat_a, feat_b = compute_match_features(player_a, player_b, surface, level)
+    features_diff = diff_features(feat_a, feat_b)
     
     return features_diff, feat_a, feat_b
 
@@ -232,7 +227,9 @@ def get_features_with_details(
 __all__ = [
     "FEATURE_COLUMNS",
     "compute_features_row",
+    "compute_batch_features",
     "compute_features_df",
     "get_feature_matrix",
     "get_features_with_details",
+    "diff_features",
 ]
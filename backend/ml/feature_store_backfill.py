@@ -0,0 +1,157 @@
+"""
+Feature Store Backfill
+=======================
+Popola le colonne di una o più famiglie di feature nelle righe esistenti
+di player_match_features, senza ricalcolare né riscrivere le altre.
+
+Il replay esegue solo le famiglie scelte su tutti i match fino al cursore
+del feature store; le colonne calcolate arrivano a blocchi in una tabella
+temporanea (COPY) e vengono unite con un solo UPDATE ... FROM per blocco.
+Alla fine vengono riscritte le tabelle stato delle famiglie e aggiornati
+il checkpoint locale e gli snapshot periodici.
+
+Eseguire a build fermo con:
+    python -m ml.feature_store_build backfill --families serve
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List
+
+from sqlalchemy import text
+
+from app.bulk_copy import AdaptiveBatch, copy_rows, create_staging_table, update_from_staging
+from app.database import engine
+from ml.feature_store_build import (
+    COPY_MAX_BATCH_FACTOR,
+    COPY_TARGET_SECONDS,
+    FEATURE_KEYS,
+    MATCHES_SELECT,
+    create_tables,
+    get_resume_cursor,
+    write_dirty_states,
+)
+from ml.feature_families import (
+    FeatureReplay,
+    MatchContext,
+    check_slots,
+    empty_states,
+    select_families,
+)
+from ml.feature_store_checkpoint import USE_CHECKPOINT, patch_checkpoint
+from ml.feature_store_snapshots import (
+    START_CURSOR,
+    snapshot_path,
+    snapshot_period,
+)
+
+BACKFILL_BATCH = 20000
+BACKFILL_STAGING = "player_match_features_backfill"
+
+# Match fino al cursore del feature store (incluso)
+BACKFILL_SQL = text(MATCHES_SELECT + """\
+      AND (m.match_date < :d OR (m.match_date = :d AND m.id <= :id))
+    ORDER BY m.match_date ASC, m.id ASC
+""")
+
+
+def update_columns(columns: List[str], rows: List[List[Any]]) -> int:
+    """Scrive un blocco di colonne (chiave + valori) nelle righe esistenti."""
+    with engine.begin() as conn:
+        create_staging_table(conn, BACKFILL_STAGING, "player_match_features", columns)
+        copy_rows(conn, BACKFILL_STAGING, columns, rows)
+        return update_from_staging(conn, "player_match_features", BACKFILL_STAGING,
+                                   columns, FEATURE_KEYS)
+
+
+def family_slots(replay: FeatureReplay) -> Dict[str, Any]:
+    """Campi di FeatureStates calcolati dal replay (solo famiglie scelte)."""
+    return {
+        slot: getattr(replay.states, slot)
+        for family in replay.families
+        for slot in family.slots()
+    }
+
+
+def backfill_families(names: List[str], use_checkpoint: bool = USE_CHECKPOINT):
+    """
+    Replay delle sole famiglie names e scrittura delle loro colonne
+    (e degli stati nel checkpoint locale, se use_checkpoint).
+    """
+
+    families = select_families(names)
+    # Prima di qualsiasi scrittura: un campo sconosciuto farebbe fallire
+    # patch_checkpoint() dopo i blocchi UPDATE già committati
+    check_slots(slot for f in families for slot in f.slots())
+
+    print("=" * 60)
+    print(f"🧩 FEATURE STORE BACKFILL: {', '.join(f.name for f in families)}")
+    print("=" * 60)
+
+    # Aggiunge le colonne e le tabelle stato delle famiglie nuove
+    create_tables()
+
+    cursor = get_resume_cursor()
+    if tuple(cursor) == START_CURSOR:
+        print("   Feature store vuoto: niente da aggiornare")
+        return
+    print(f"▶ Replay fino a ({cursor[0]}, {cursor[1]})")
+
+    replay = FeatureReplay(empty_states(), [f.name for f in families])
+    columns = FEATURE_KEYS + [c for f in families for c in f.columns]
+    batch = AdaptiveBatch(
+        BACKFILL_BATCH,
+        min_size=BACKFILL_BATCH,
+        max_size=BACKFILL_BATCH * COPY_MAX_BATCH_FACTOR,
+        target_seconds=COPY_TARGET_SECONDS,
+    )
+
+    buffer: List[List[Any]] = []
+    processed = updated = patched = 0
+    # Snapshot periodici: stessi confini del build
+    period = None
+    prev_cursor = START_CURSOR
+
+    with engine.connect().execution_options(stream_results=True) as conn_stream:
+        result = conn_stream.execute(BACKFILL_SQL, {"d": cursor[0], "id": cursor[1]})
+
+        for row in result:
+            m = MatchContext(row)
+
+            match_period = snapshot_period(m.match_date)
+            if match_period != period:
+                if period is not None and patch_checkpoint(
+                    prev_cursor, family_slots(replay), snapshot_path(prev_cursor)
+                ):
+                    patched += 1
+                period = match_period
+
+            for features in replay.step(m):
+                buffer.append([features[c] for c in columns])
+            replay.clear_dirty()
+            processed += 1
+            prev_cursor = (m.match_date.isoformat(), m.match_id)
+
+            if len(buffer) >= batch.size:
+                start = time.perf_counter()
+                updated += update_columns(columns, buffer)
+                batch.record(len(buffer), time.perf_counter() - start)
+                buffer.clear()
+                print(f"   Processati {processed} match...")
+
+    if buffer:
+        updated += update_columns(columns, buffer)
+
+    # Stato completo delle famiglie al cursore
+    with engine.begin() as conn:
+        full_state = {f.name: getattr(replay.states, f.state_slot) for f in families}
+        rows = write_dirty_states(conn, full_state, use_copy=True)
+    print(f"   Righe stato riscritte: {rows}")
+
+    if use_checkpoint and patch_checkpoint(tuple(cursor), family_slots(replay)):
+        print("📌 Checkpoint stato aggiornato")
+    if patched:
+        print(f"   📸 Snapshot aggiornati: {patched}")
+
+    print(f"\n✅ Backfill completato. Match: {processed}, righe feature aggiornate: {updated}")
@@ -3,7 +3,7 @@ Tennis Feature Store Builder
 =============================
 Costruisce e mantiene il feature store per le predizioni ML.
 
-Feature calcolate per ogni giocatore PRE-MATCH:
+Feature calcolate per ogni giocatore PRE-MATCH (famiglie in ml.feature_families):
 - Elo rating per superficie
 - Win rate su superficie
 - Form recente (ultimi 5 e 10 match)
@@ -13,284 +13,256 @@ Feature calcolate per ogni giocatore PRE-MATCH:
 - Match giocati negli ultimi 30 giorni
 - Statistiche servizio (ace%, df%, 1st serve %, bp saved %)
 - Esperienza tournament level (% vittorie per livello)
+
+Ad ogni flush aggiorna anche player_latest_state (una riga per giocatore
+con ranking, date recenti, form e servizio) letta dal serving live; l'età
+viene da players.birth_date, letta in join dal serving.
+
+Eseguire con: python -m ml.feature_store_build [--numpy] [--copy] [--no-checkpoint]
+(--numpy o FEATURE_ENGINE=numpy usa il motore array di feature_store_numpy,
+--copy o FEATURE_FLUSH=copy scrive feature e stati via COPY,
+--no-checkpoint ignora lo snapshot locale dello stato, vedi feature_store_checkpoint)
+
+Rebuild da una data: python -m ml.feature_store_build rebuild --from YYYY-MM-DD
+(riparte dallo snapshot periodico precedente, vedi feature_store_snapshots)
+
+Benchmark di singole famiglie: python -m ml.feature_store_build bench --families form,h2h
+Backfill delle colonne di una famiglia: python -m ml.feature_store_build backfill --families serve
+(vedi feature_store_backfill)
+Dataset ML in memoria, senza scritture su Postgres:
+python -m ml.feature_store_build dataset [--source db|staging] [--output PATH]
+(vedi feature_store_offline)
 """
 
 from __future__ import annotations
 
-from collections import defaultdict, deque
-from datetime import date, timedelta
+import argparse
+import os
+import time
+from datetime import date
 from typing import Dict, Tuple, List, Any, Optional
 
 from sqlalchemy import text
+from app.bulk_copy import AdaptiveBatch, copy_rows, create_staging_table, upsert_from_staging
 from app.database import engine
-
-SURFACES = ("Hard", "Clay", "Grass")
-TOURNAMENT_LEVELS = ("G", "M", "A", "B", "C", "D", "F")  # Grand Slam, Masters, etc.
-BASE_ELO = 1500.0
-K = 32.0
+from ml.feature_families import (
+    ACTIVITY_WINDOWS,
+    FAMILIES,
+    FeatureReplay,
+    FeatureStates,
+    MatchContext,
+    empty_states,
+    feature_columns,
+    select_families,
+)
 
 # Batch sizes
 FEATURES_BATCH = 2000
 STATE_BATCH = 5000
 
+# Flush via COPY + INSERT ... SELECT (--copy, default FEATURE_FLUSH=copy):
+# i batch si adattano al throughput misurato, fino a COPY_MAX_BATCH_FACTOR volte
+USE_COPY = os.environ.get("FEATURE_FLUSH", "").lower() == "copy"
+COPY_MAX_BATCH_FACTOR = 100
+COPY_TARGET_SECONDS = 2.0
+
+# Colonne dei match per il replay (nomi colonne minuscoli per PostgreSQL)
+MATCHES_SELECT = """
+    SELECT 
+        m.id, m.match_date, m.surface, m.tournament_level,
+        m.winner_id, m.loser_id, 
+        m.winner_rank, m.loser_rank,
+        m.winner_age, m.loser_age,
+        COALESCE(m.w_ace, 0) as w_ace, 
+        COALESCE(m.w_df, 0) as w_df, 
+        COALESCE(m.w_svpt, 0) as w_svpt, 
+        COALESCE(m.w_1stin, 0) as w_1stin, 
+        COALESCE(m.w_1stwon, 0) as w_1stwon, 
+        COALESCE(m.w_2ndwon, 0) as w_2ndwon,
+        COALESCE(m.w_bpfaced, 0) as w_bpfaced, 
+        COALESCE(m.w_bpsaved, 0) as w_bpsaved,
+        COALESCE(m.l_ace, 0) as l_ace, 
+        COALESCE(m.l_df, 0) as l_df, 
+        COALESCE(m.l_svpt, 0) as l_svpt, 
+        COALESCE(m.l_1stin, 0) as l_1stin, 
+        COALESCE(m.l_1stwon, 0) as l_1stwon, 
+        COALESCE(m.l_2ndwon, 0) as l_2ndwon,
+        COALESCE(m.l_bpfaced, 0) as l_bpfaced, 
+        COALESCE(m.l_bpsaved, 0) as l_bpsaved
+    FROM matches m
+    WHERE m.surface IN ('Hard', 'Clay', 'Grass')
+"""
 
-# =============================================================================
-# UTILITY FUNCTIONS
-# =============================================================================
-
-def expected_score(elo_a: float, elo_b: float) -> float:
-    return 1.0 / (1.0 + 10 ** ((elo_b - elo_a) / 400.0))
-
-
-def mean_last(dq: deque, n: int) -> float:
-    if not dq:
-        return 0.0
-    tail = list(dq)[-n:]
-    return float(sum(tail)) / float(len(tail)) if tail else 0.0
-
-
-def safe_ratio(numerator: int, denominator: int, default: float = 0.0) -> float:
-    """Calcola ratio evitando divisione per zero."""
-    if denominator is None or denominator == 0:
-        return default
-    if numerator is None:
-        return default
-    return float(numerator) / float(denominator)
+# Match da processare dopo il cursore
+MATCHES_SQL = text(MATCHES_SELECT + """\
+      AND (m.match_date > :d OR (m.match_date = :d AND m.id > :id))
+    ORDER BY m.match_date ASC, m.id ASC
+""")
 
 
 # =============================================================================
 # STATE MANAGEMENT
 # =============================================================================
 
-def load_states():
-    """Carica stati esistenti dal database."""
-    
-    # surface state: (player_id, surface) -> (elo, matches_cnt, wins_cnt)
-    surface_state: Dict[Tuple[int, str], Tuple[float, int, int]] = {}
-    # form state: player_id -> deque([0/1], maxlen=10)
-    form_state: Dict[int, deque] = {}
-    # h2h wins: (player_id, opponent_id) -> wins
-    h2h: Dict[Tuple[int, int], int] = {}
-    # last match date: player_id -> date
-    last_match: Dict[int, date] = {}
-    # matches last 30 days: player_id -> list of match dates
-    recent_matches: Dict[int, List[date]] = defaultdict(list)
-    # serve stats: player_id -> {ace_total, df_total, svpt_total, 1stIn_total, ...}
-    serve_stats: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
-    # tournament level experience: (player_id, level) -> (matches, wins)
-    level_exp: Dict[Tuple[int, str], Tuple[int, int]] = {}
+def load_states() -> FeatureStates:
+    """Carica stati esistenti dal database (tabelle stato di ogni famiglia)."""
 
+    states = empty_states()
     with engine.connect() as conn:
-        # Surface state
-        try:
-            for r in conn.execute(text("""
-                SELECT player_id, surface, elo, matches_cnt, wins_cnt
-                FROM player_surface_state
-            """)):
-                surface_state[(r.player_id, r.surface)] = (
-                    float(r.elo), int(r.matches_cnt), int(r.wins_cnt)
-                )
-        except Exception:
-            pass  # Tabella non esiste ancora
-
-        # Form state
-        try:
-            for r in conn.execute(text("""
-                SELECT player_id, last_results
-                FROM player_form_state
-            """)):
-                dq = deque((int(x) for x in r.last_results), maxlen=10)
-                form_state[int(r.player_id)] = dq
-        except Exception:
-            pass
-
-        # H2H
-        try:
-            for r in conn.execute(text("""
-                SELECT player_id, opponent_id, wins
-                FROM h2h_state
-            """)):
-                h2h[(int(r.player_id), int(r.opponent_id))] = int(r.wins)
-        except Exception:
-            pass
-
-        # Last match date
-        try:
-            for r in conn.execute(text("""
-                SELECT player_id, last_match_date
-                FROM player_activity_state
-            """)):
-                last_match[int(r.player_id)] = r.last_match_date
-        except Exception:
-            pass
-
-        # Serve stats
-        try:
-            for r in conn.execute(text("""
-                SELECT player_id, ace_total, df_total, svpt_total, 
-                       first_in_total, first_won_total, second_won_total,
-                       bp_faced_total, bp_saved_total
-                FROM player_serve_state
-            """)):
-                serve_stats[int(r.player_id)] = {
-                    "ace": int(r.ace_total or 0),
-                    "df": int(r.df_total or 0),
-                    "svpt": int(r.svpt_total or 0),
-                    "1stIn": int(r.first_in_total or 0),
-                    "1stWon": int(r.first_won_total or 0),
-                    "2ndWon": int(r.second_won_total or 0),
-                    "bpFaced": int(r.bp_faced_total or 0),
-                    "bpSaved": int(r.bp_saved_total or 0),
-                }
-        except Exception:
-            pass
-
-        # Tournament level experience
-        try:
-            for r in conn.execute(text("""
-                SELECT player_id, level, matches_cnt, wins_cnt
-                FROM player_level_state
-            """)):
-                level_exp[(int(r.player_id), r.level)] = (
-                    int(r.matches_cnt), int(r.wins_cnt)
-                )
-        except Exception:
-            pass
-
-    return surface_state, form_state, h2h, last_match, recent_matches, serve_stats, level_exp
+        for family in FAMILIES.values():
+            family.load(conn, states)
+    return states
 
 
 # =============================================================================
 # UPSERT FUNCTIONS
 # =============================================================================
 
-def upsert_surface_state(conn, rows: List[Dict[str, Any]]):
+def upsert_state_rows(conn, table: str, columns: List[str], keys: List[str],
+                      rows: List[Dict[str, Any]]):
+    """INSERT ... ON CONFLICT DO UPDATE (executemany) di una tabella stato."""
     if not rows:
         return
+    updates = ",\n                ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in keys)
     conn.execute(
-        text("""
-            INSERT INTO player_surface_state (player_id, surface, elo, matches_cnt, wins_cnt)
-            VALUES (:player_id, :surface, :elo, :matches_cnt, :wins_cnt)
-            ON CONFLICT (player_id, surface) DO UPDATE
-            SET elo = EXCLUDED.elo,
-                matches_cnt = EXCLUDED.matches_cnt,
-                wins_cnt = EXCLUDED.wins_cnt
+        text(f"""
+            INSERT INTO {table} ({", ".join(columns)})
+            VALUES ({", ".join(":" + c for c in columns)})
+            ON CONFLICT ({", ".join(keys)}) DO UPDATE
+            SET {updates}
         """),
         rows,
     )
 
 
-def upsert_form_state(conn, rows: List[Dict[str, Any]]):
+def insert_features(conn, rows: List[Dict[str, Any]]):
     if not rows:
         return
     conn.execute(
-        text("""
-            INSERT INTO player_form_state (player_id, last_results)
-            VALUES (:player_id, :last_results)
-            ON CONFLICT (player_id) DO UPDATE
-            SET last_results = EXCLUDED.last_results
+        text(f"""
+            INSERT INTO player_match_features ({", ".join(FEATURE_COLUMNS)})
+            VALUES ({", ".join(":" + c for c in FEATURE_COLUMNS)})
+            ON CONFLICT (match_id, player_id) DO NOTHING
         """),
         rows,
     )
 
 
-def upsert_h2h_state(conn, rows: List[Dict[str, Any]]):
-    if not rows:
-        return
-    conn.execute(
-        text("""
-            INSERT INTO h2h_state (player_id, opponent_id, wins)
-            VALUES (:player_id, :opponent_id, :wins)
-            ON CONFLICT (player_id, opponent_id) DO UPDATE
-            SET wins = EXCLUDED.wins
-        """),
-        rows,
-    )
+# =============================================================================
+# COPY FLUSH
+# =============================================================================
 
+FEATURE_COLUMNS = feature_columns()
+FEATURE_KEYS = ["match_id", "player_id"]
 
-def upsert_activity_state(conn, rows: List[Dict[str, Any]]):
-    if not rows:
-        return
-    conn.execute(
-        text("""
-            INSERT INTO player_activity_state (player_id, last_match_date)
-            VALUES (:player_id, :last_match_date)
-            ON CONFLICT (player_id) DO UPDATE
-            SET last_match_date = EXCLUDED.last_match_date
-        """),
-        rows,
-    )
+# Tabella stato -> (colonne, chiave primaria)
+STATE_TABLES = {
+    family.table: (family.table_columns, family.table_keys)
+    for family in FAMILIES.values()
+}
 
 
-def upsert_serve_state(conn, rows: List[Dict[str, Any]]):
+def copy_upsert(conn, table: str, columns: List[str], keys: List[str],
+                rows: List[Dict[str, Any]], update: bool = True):
+    """
+    Carica rows in una tabella temporanea via COPY e le unisce a table
+    con un solo INSERT ... SELECT ... ON CONFLICT.
+    """
     if not rows:
         return
-    conn.execute(
-        text("""
-            INSERT INTO player_serve_state (
-                player_id, ace_total, df_total, svpt_total,
-                first_in_total, first_won_total, second_won_total,
-                bp_faced_total, bp_saved_total
-            )
-            VALUES (
-                :player_id, :ace_total, :df_total, :svpt_total,
-                :first_in_total, :first_won_total, :second_won_total,
-                :bp_faced_total, :bp_saved_total
-            )
-            ON CONFLICT (player_id) DO UPDATE
-            SET ace_total = EXCLUDED.ace_total,
-                df_total = EXCLUDED.df_total,
-                svpt_total = EXCLUDED.svpt_total,
-                first_in_total = EXCLUDED.first_in_total,
-                first_won_total = EXCLUDED.first_won_total,
-                second_won_total = EXCLUDED.second_won_total,
-                bp_faced_total = EXCLUDED.bp_faced_total,
-                bp_saved_total = EXCLUDED.bp_saved_total
-        """),
-        rows,
+    staging = f"{table}_staging"
+    create_staging_table(conn, staging, table, columns)
+    copy_rows(conn, staging, columns, ([r[c] for c in columns] for r in rows))
+    upsert_from_staging(conn, table, staging, columns, keys, update=update)
+
+
+def new_batch(size: int, use_copy: bool = USE_COPY) -> AdaptiveBatch:
+    """Batch fisso in modalità executemany, adattivo in modalità COPY."""
+    if not use_copy:
+        return AdaptiveBatch(size)
+    return AdaptiveBatch(
+        size,
+        min_size=size,
+        max_size=size * COPY_MAX_BATCH_FACTOR,
+        target_seconds=COPY_TARGET_SECONDS,
     )
 
 
-def upsert_level_state(conn, rows: List[Dict[str, Any]]):
-    if not rows:
-        return
-    conn.execute(
-        text("""
-            INSERT INTO player_level_state (player_id, level, matches_cnt, wins_cnt)
-            VALUES (:player_id, :level, :matches_cnt, :wins_cnt)
-            ON CONFLICT (player_id, level) DO UPDATE
-            SET matches_cnt = EXCLUDED.matches_cnt,
-                wins_cnt = EXCLUDED.wins_cnt
-        """),
-        rows,
-    )
+def write_feature_rows(conn, rows: List[Dict[str, Any]], use_copy: bool = USE_COPY):
+    """Scrive un blocco di feature nella transazione di conn (via COPY se use_copy)."""
+    if use_copy:
+        copy_upsert(conn, "player_match_features", FEATURE_COLUMNS, FEATURE_KEYS,
+                    rows, update=False)
+    else:
+        insert_features(conn, rows)
 
 
-def insert_features(conn, rows: List[Dict[str, Any]]):
-    if not rows:
-        return
-    conn.execute(
-        text("""
-            INSERT INTO player_match_features (
-              match_id, player_id, opponent_id, match_date, surface,
-              elo, recent_5, recent_10, surface_wr, h2h_wins, rank,
-              days_since_last_match, age, matches_last_30d,
-              ace_pct, df_pct, first_serve_pct, first_serve_won_pct,
-              second_serve_won_pct, bp_save_pct,
-              level_win_rate
-            )
-            VALUES (
-              :match_id, :player_id, :opponent_id, :match_date, :surface,
-              :elo, :recent_5, :recent_10, :surface_wr, :h2h_wins, :rank,
-              :days_since_last_match, :age, :matches_last_30d,
-              :ace_pct, :df_pct, :first_serve_pct, :first_serve_won_pct,
-              :second_serve_won_pct, :bp_save_pct,
-              :level_win_rate
-            )
-            ON CONFLICT (match_id, player_id) DO NOTHING
-        """),
-        rows,
+# =============================================================================
+# LATEST STATE (SERVING)
+# =============================================================================
+
+# Totali servizio copiati da player_serve_state
+LATEST_SERVE_COLUMNS = FAMILIES["serve"].table_columns[1:]
+
+# Ultimo stato di ogni giocatore, una riga per giocatore: ranking, date
+# recenti, form e servizio letti dal serving con una lookup su PK (la data
+# di nascita resta in players, che l'importer aggiorna senza flush)
+LATEST_STATE_SQL = f"""
+    INSERT INTO player_latest_state (
+        player_id, rank, last_match_date, recent_match_dates,
+        last_results, {", ".join(LATEST_SERVE_COLUMNS)}, updated_at
     )
+    SELECT
+        a.player_id,
+        lr.rank,
+        a.last_match_date,
+        ARRAY(
+            SELECT f.match_date
+            FROM player_match_features f
+            WHERE f.player_id = a.player_id
+              AND f.match_date >= a.last_match_date - CAST(:window AS INTEGER)
+            ORDER BY f.match_date
+        ),
+        fs.last_results,
+        {", ".join(f"s.{c}" for c in LATEST_SERVE_COLUMNS)},
+        CURRENT_TIMESTAMP
+    FROM player_activity_state a
+    LEFT JOIN player_form_state fs ON fs.player_id = a.player_id
+    LEFT JOIN player_serve_state s ON s.player_id = a.player_id
+    LEFT JOIN LATERAL (
+        SELECT rank
+        FROM player_match_features
+        WHERE player_id = a.player_id AND rank IS NOT NULL
+        ORDER BY match_date DESC, match_id DESC
+        LIMIT 1
+    ) lr ON TRUE
+    {{where}}
+    ON CONFLICT (player_id) DO UPDATE
+    SET rank = EXCLUDED.rank,
+        last_match_date = EXCLUDED.last_match_date,
+        recent_match_dates = EXCLUDED.recent_match_dates,
+        last_results = EXCLUDED.last_results,
+        {", ".join(f"{c} = EXCLUDED.{c}" for c in LATEST_SERVE_COLUMNS)},
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def refresh_latest_state(conn, player_ids: Optional[List[int]] = None) -> int:
+    """
+    Ricalcola player_latest_state per player_ids (tutti se None) da feature
+    e tabelle stato già scritte nella transazione di conn.
+
+    Returns:
+        Numero di righe scritte
+    """
+    params = {"window": max(ACTIVITY_WINDOWS)}
+    where = ""
+    if player_ids is not None:
+        if not player_ids:
+            return 0
+        where = "WHERE a.player_id = ANY(:ids)"
+        params["ids"] = sorted(int(pid) for pid in player_ids)
+    return conn.execute(text(LATEST_STATE_SQL.format(where=where)), params).rowcount
 
 
 # =============================================================================
@@ -332,116 +304,117 @@ def create_tables():
         conn.execute(text("""
             CREATE INDEX IF NOT EXISTS idx_pmf_date ON player_match_features(match_date)
         """))
-        
-        # Tabelle stato
         conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS player_surface_state (
-                player_id INTEGER NOT NULL,
-                surface VARCHAR(10) NOT NULL,
-                elo FLOAT,
-                matches_cnt INTEGER,
-                wins_cnt INTEGER,
-                PRIMARY KEY (player_id, surface)
-            )
+            CREATE INDEX IF NOT EXISTS idx_pmf_player_date
+            ON player_match_features(player_id, match_date)
         """))
-        
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS player_form_state (
-                player_id INTEGER PRIMARY KEY,
-                last_results INTEGER[]
-            )
-        """))
-        
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS h2h_state (
-                player_id INTEGER NOT NULL,
-                opponent_id INTEGER NOT NULL,
-                wins INTEGER,
-                PRIMARY KEY (player_id, opponent_id)
-            )
-        """))
-        
+
+        # Colonne aggiunte da famiglie registrate dopo la creazione della tabella
+        for family in FAMILIES.values():
+            for column, sql_type in family.columns.items():
+                conn.execute(text(
+                    f"ALTER TABLE player_match_features ADD COLUMN IF NOT EXISTS {column} {sql_type}"
+                ))
+
+        # Tabelle stato
+        for family in FAMILIES.values():
+            conn.execute(text(family.table_ddl))
+
+        # Cursore di resume: una sola riga, aggiornata con feature e stati
         conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS player_activity_state (
-                player_id INTEGER PRIMARY KEY,
-                last_match_date DATE
+            CREATE TABLE IF NOT EXISTS feature_store_cursor (
+                id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                last_match_date DATE,
+                last_match_id INTEGER,
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """))
-        
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS player_serve_state (
+
+        # Stato di serving: una riga per giocatore (vedi refresh_latest_state)
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS player_latest_state (
                 player_id INTEGER PRIMARY KEY,
-                ace_total INTEGER DEFAULT 0,
-                df_total INTEGER DEFAULT 0,
-                svpt_total INTEGER DEFAULT 0,
-                first_in_total INTEGER DEFAULT 0,
-                first_won_total INTEGER DEFAULT 0,
-                second_won_total INTEGER DEFAULT 0,
-                bp_faced_total INTEGER DEFAULT 0,
-                bp_saved_total INTEGER DEFAULT 0
-            )
-        """))
-        
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS player_level_state (
-                player_id INTEGER NOT NULL,
-                level VARCHAR(1) NOT NULL,
-                matches_cnt INTEGER DEFAULT 0,
-                wins_cnt INTEGER DEFAULT 0,
-                PRIMARY KEY (player_id, level)
+                rank INTEGER,
+                last_match_date DATE,
+                recent_match_dates DATE[],
+                last_results INTEGER[],
+                {", ".join(f"{c} INTEGER" for c in LATEST_SERVE_COLUMNS)},
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """))
-    
+
+        # Feature store preesistente: popolamento iniziale completo
+        if not conn.execute(text("SELECT 1 FROM player_latest_state LIMIT 1")).fetchone():
+            rows = refresh_latest_state(conn)
+            if rows:
+                print(f"   player_latest_state popolata: {rows} giocatori")
+
     print("✅ Tabelle create/verificate")
 
 
 # =============================================================================
-# FEATURE CALCULATION
+# RESUME CURSOR
 # =============================================================================
 
-def calculate_serve_percentages(stats: Dict[str, int]) -> Dict[str, float]:
-    """Calcola percentuali servizio dai totali."""
-    svpt = stats.get("svpt", 0)
-    first_in = stats.get("1stIn", 0)
-    
-    return {
-        "ace_pct": safe_ratio(stats.get("ace", 0), svpt),
-        "df_pct": safe_ratio(stats.get("df", 0), svpt),
-        "first_serve_pct": safe_ratio(first_in, svpt),
-        "first_serve_won_pct": safe_ratio(stats.get("1stWon", 0), first_in),
-        "second_serve_won_pct": safe_ratio(
-            stats.get("2ndWon", 0), 
-            svpt - first_in if svpt > first_in else 0
-        ),
-        "bp_save_pct": safe_ratio(
-            stats.get("bpSaved", 0), 
-            stats.get("bpFaced", 0)
-        ),
-    }
-
-
 def get_resume_cursor() -> Tuple[str, int]:
-    """Ritorna l'ultimo match processato."""
+    """
+    Ritorna l'ultimo match processato.
+    Legge feature_store_cursor, scritto nella stessa transazione di feature
+    e stati (data NULL = feature store vuoto); senza cursore salvato
+    (feature store precedente) usa l'ultima riga di player_match_features.
+    """
     with engine.connect() as conn:
         row = conn.execute(text("""
-            SELECT match_date, match_id
-            FROM player_match_features
-            ORDER BY match_date DESC, match_id DESC
-            LIMIT 1
+            SELECT last_match_date AS match_date, last_match_id AS match_id
+            FROM feature_store_cursor
+            WHERE id = 1
         """)).fetchone()
 
-    if not row:
+        if not row:
+            row = conn.execute(text("""
+                SELECT match_date, match_id
+                FROM player_match_features
+                ORDER BY match_date DESC, match_id DESC
+                LIMIT 1
+            """)).fetchone()
+
+    if not row or row.match_date is None:
         return ("0001-01-01", 0)
 
     return (row.match_date.isoformat(), int(row.match_id))
 
 
+def save_cursor(conn, match_date, match_id: Optional[int]):
+    """
+    Aggiorna il cursore e incrementa la versione del feature store.
+    match_date None riporta il cursore all'inizio (feature store vuoto):
+    la riga resta, così la versione non torna mai indietro.
+    """
+    conn.execute(text("""
+        INSERT INTO feature_store_cursor (id, last_match_date, last_match_id, version, updated_at)
+        VALUES (1, :d, :id, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (id) DO UPDATE
+        SET last_match_date = EXCLUDED.last_match_date,
+            last_match_id = EXCLUDED.last_match_id,
+            version = feature_store_cursor.version + 1,
+            updated_at = EXCLUDED.updated_at
+    """), {"d": match_date, "id": int(match_id) if match_date is not None else None})
+
+
 # =============================================================================
 # MAIN BUILD FUNCTION
 # =============================================================================
 
-def build_feature_store():
-    """Costruisce/aggiorna il feature store."""
+def build_feature_store(states=None, use_copy: bool = USE_COPY,
+                        use_checkpoint: Optional[bool] = None):
+    """
+    Costruisce/aggiorna il feature store.
+    states: stati di partenza già ripristinati (rebuild), altrimenti
+    checkpoint locale o tabelle.
+    use_copy: flush via COPY (--copy), altrimenti executemany.
+    use_checkpoint: legge e scrive il checkpoint locale (default FEATURE_CHECKPOINT).
+    """
     
     print("=" * 60)
     print("🎾 FEATURE STORE BUILDER")
@@ -450,299 +423,184 @@ def build_feature_store():
     # Crea tabelle se necessario
     create_tables()
     
-    # Carica stati esistenti
-    print("\n📂 Caricamento stati...")
-    (surface_state, form_state, h2h, last_match, 
-     recent_matches, serve_stats, level_exp) = load_states()
-    
+    from ml.feature_store_checkpoint import load_build_states, save_build_checkpoint
+    from ml.feature_store_snapshots import cursor_period, snapshot_period, take_snapshot
+
     last_date, last_id = get_resume_cursor()
     print(f"▶ Resume from > ({last_date}, {last_id})")
 
-    # Query match con tutti i nuovi campi (nomi colonne minuscoli per PostgreSQL)
-    matches_sql = text("""
-        SELECT 
-            m.id, m.match_date, m.surface, m.tournament_level,
-            m.winner_id, m.loser_id, 
-            m.winner_rank, m.loser_rank,
-            m.winner_age, m.loser_age,
-            COALESCE(m.w_ace, 0) as w_ace, 
-            COALESCE(m.w_df, 0) as w_df, 
-            COALESCE(m.w_svpt, 0) as w_svpt, 
-            COALESCE(m.w_1stin, 0) as w_1stin, 
-            COALESCE(m.w_1stwon, 0) as w_1stwon, 
-            COALESCE(m.w_2ndwon, 0) as w_2ndwon,
-            COALESCE(m.w_bpfaced, 0) as w_bpfaced, 
-            COALESCE(m.w_bpsaved, 0) as w_bpsaved,
-            COALESCE(m.l_ace, 0) as l_ace, 
-            COALESCE(m.l_df, 0) as l_df, 
-            COALESCE(m.l_svpt, 0) as l_svpt, 
-            COALESCE(m.l_1stin, 0) as l_1stin, 
-            COALESCE(m.l_1stwon, 0) as l_1stwon, 
-            COALESCE(m.l_2ndwon, 0) as l_2ndwon,
-            COALESCE(m.l_bpfaced, 0) as l_bpfaced, 
-            COALESCE(m.l_bpsaved, 0) as l_bpsaved
-        FROM matches m
-        WHERE m.surface IN ('Hard', 'Clay', 'Grass')
-          AND (m.match_date > :d OR (m.match_date = :d AND m.id > :id))
-        ORDER BY m.match_date ASC, m.id ASC
-    """)
+    # Carica stati esistenti (checkpoint locale o tabelle)
+    print("\n📂 Caricamento stati...")
+    from_checkpoint = False
+    if states is None:
+        states, from_checkpoint = load_build_states((last_date, last_id), use_checkpoint)
+
+    # Tutte le famiglie: il cursore è comune a feature e stati
+    replay = FeatureReplay(states)
+    states = replay.states
 
     features_buffer: List[Dict[str, Any]] = []
-    
-    # Dirty state tracking
-    surface_dirty: Dict[Tuple[int, str], Tuple[float, int, int]] = {}
-    form_dirty: Dict[int, deque] = {}
-    h2h_dirty: Dict[Tuple[int, int], int] = {}
-    activity_dirty: Dict[int, date] = {}
-    serve_dirty: Dict[int, Dict[str, int]] = {}
-    level_dirty: Dict[Tuple[int, str], Tuple[int, int]] = {}
+    # Feature e stati vengono scritti insieme: soglia sulle righe pendenti
+    flush_batch = new_batch(FEATURES_BATCH + STATE_BATCH, use_copy)
 
     processed = 0
+    # Snapshot all'inizio di ogni periodo, con il cursore del match precedente
+    period = cursor_period((last_date, last_id))
+    prev_cursor = (last_date, last_id)
 
     with engine.connect().execution_options(stream_results=True) as conn_stream:
-        result = conn_stream.execute(matches_sql, {"d": last_date, "id": last_id})
-
-        for m in result:
-            match_id = int(m.id)
-            match_date = m.match_date
-            surface = m.surface
-            level = m.tournament_level or "A"
-
-            A = int(m.winner_id)  # Winner
-            B = int(m.loser_id)   # Loser
-            
-            rank_A = int(m.winner_rank) if m.winner_rank else None
-            rank_B = int(m.loser_rank) if m.loser_rank else None
-            
-            age_A = float(m.winner_age) if m.winner_age else None
-            age_B = float(m.loser_age) if m.loser_age else None
-
-            # === PRE-MATCH FEATURE: Player A (Winner) ===
-            elo_A, mcnt_A, wcnt_A = surface_state.get((A, surface), (BASE_ELO, 0, 0))
-            dq_A = form_state.get(A) or deque([], maxlen=10)
-            h2h_A = h2h.get((A, B), 0)
-            last_A = last_match.get(A)
-            days_since_A = (match_date - last_A).days if last_A else None
-            matches_30d_A = len([d for d in recent_matches.get(A, []) 
-                                if (match_date - d).days <= 30])
-            serve_pct_A = calculate_serve_percentages(serve_stats.get(A, {}))
-            level_m_A, level_w_A = level_exp.get((A, level), (0, 0))
-            level_wr_A = safe_ratio(level_w_A, level_m_A)
-
-            # === PRE-MATCH FEATURE: Player B (Loser) ===
-            elo_B, mcnt_B, wcnt_B = surface_state.get((B, surface), (BASE_ELO, 0, 0))
-            dq_B = form_state.get(B) or deque([], maxlen=10)
-            h2h_B = h2h.get((B, A), 0)
-            last_B = last_match.get(B)
-            days_since_B = (match_date - last_B).days if last_B else None
-            matches_30d_B = len([d for d in recent_matches.get(B, []) 
-                                if (match_date - d).days <= 30])
-            serve_pct_B = calculate_serve_percentages(serve_stats.get(B, {}))
-            level_m_B, level_w_B = level_exp.get((B, level), (0, 0))
-            level_wr_B = safe_ratio(level_w_B, level_m_B)
-
-            # === WRITE PRE-MATCH FEATURES ===
-            features_buffer.append({
-                "match_id": match_id,
-                "player_id": A,
-                "opponent_id": B,
-                "match_date": match_date,
-                "surface": surface,
-                "elo": float(elo_A),
-                "recent_5": mean_last(dq_A, 5),
-                "recent_10": mean_last(dq_A, 10),
-                "surface_wr": safe_ratio(wcnt_A, mcnt_A),
-                "h2h_wins": int(h2h_A),
-                "rank": rank_A,
-                "days_since_last_match": days_since_A,
-                "age": age_A,
-                "matches_last_30d": matches_30d_A,
-                **serve_pct_A,
-                "level_win_rate": level_wr_A,
-            })
-            
-            features_buffer.append({
-                "match_id": match_id,
-                "player_id": B,
-                "opponent_id": A,
-                "match_date": match_date,
-                "surface": surface,
-                "elo": float(elo_B),
-                "recent_5": mean_last(dq_B, 5),
-                "recent_10": mean_last(dq_B, 10),
-                "surface_wr": safe_ratio(wcnt_B, mcnt_B),
-                "h2h_wins": int(h2h_B),
-                "rank": rank_B,
-                "days_since_last_match": days_since_B,
-                "age": age_B,
-                "matches_last_30d": matches_30d_B,
-                **serve_pct_B,
-                "level_win_rate": level_wr_B,
-            })
-
-            # === UPDATE STATES (POST-MATCH) ===
-            
-            # Elo update
-            exp_A = expected_score(elo_A, elo_B)
-            elo_A_new = elo_A + K * (1.0 - exp_A)
-            elo_B_new = elo_B + K * (0.0 - (1.0 - exp_A))
-
-            surface_state[(A, surface)] = (elo_A_new, mcnt_A + 1, wcnt_A + 1)
-            surface_state[(B, surface)] = (elo_B_new, mcnt_B + 1, wcnt_B)
-            surface_dirty[(A, surface)] = surface_state[(A, surface)]
-            surface_dirty[(B, surface)] = surface_state[(B, surface)]
-
-            # Form update
-            dq_A.append(1)
-            dq_B.append(0)
-            form_state[A] = dq_A
-            form_state[B] = dq_B
-            form_dirty[A] = dq_A
-            form_dirty[B] = dq_B
-
-            # H2H update
-            h2h[(A, B)] = h2h_A + 1
-            h2h_dirty[(A, B)] = h2h[(A, B)]
-
-            # Activity update
-            last_match[A] = match_date
-            last_match[B] = match_date
-            activity_dirty[A] = match_date
-            activity_dirty[B] = match_date
-            
-            # Recent matches update
-            recent_matches[A].append(match_date)
-            recent_matches[B].append(match_date)
-            # Keep only last 60 days
-            cutoff = match_date - timedelta(days=60)
-            recent_matches[A] = [d for d in recent_matches[A] if d > cutoff]
-            recent_matches[B] = [d for d in recent_matches[B] if d > cutoff]
-
-            # Serve stats update (if available - check svpt > 0)
-            if m.w_svpt > 0:
-                ss = serve_stats[A]
-                ss["ace"] += m.w_ace
-                ss["df"] += m.w_df
-                ss["svpt"] += m.w_svpt
-                ss["1stIn"] += m.w_1stin
-                ss["1stWon"] += m.w_1stwon
-                ss["2ndWon"] += m.w_2ndwon
-                ss["bpFaced"] += m.w_bpfaced
-                ss["bpSaved"] += m.w_bpsaved
-                serve_dirty[A] = ss
-                
-            if m.l_svpt > 0:
-                ss = serve_stats[B]
-                ss["ace"] += m.l_ace
-                ss["df"] += m.l_df
-                ss["svpt"] += m.l_svpt
-                ss["1stIn"] += m.l_1stin
-                ss["1stWon"] += m.l_1stwon
-                ss["2ndWon"] += m.l_2ndwon
-                ss["bpFaced"] += m.l_bpfaced
-                ss["bpSaved"] += m.l_bpsaved
-                serve_dirty[B] = ss
-
-            # Level experience update
-            level_exp[(A, level)] = (level_m_A + 1, level_w_A + 1)
-            level_exp[(B, level)] = (level_m_B + 1, level_w_B)
-            level_dirty[(A, level)] = level_exp[(A, level)]
-            level_dirty[(B, level)] = level_exp[(B, level)]
+        result = conn_stream.execute(MATCHES_SQL, {"d": last_date, "id": last_id})
+
+        for row in result:
+            m = MatchContext(row)
+
+            match_period = snapshot_period(m.match_date)
+            if match_period != period:
+                if period is not None:
+                    take_snapshot(states, prev_cursor)
+                period = match_period
+
+            # Feature PRE-MATCH di winner e loser, poi update POST-MATCH
+            features_buffer.extend(replay.step(m))
 
             processed += 1
+            prev_cursor = (m.match_date.isoformat(), m.match_id)
 
-            # Flush periodically
-            if len(features_buffer) >= FEATURES_BATCH:
-                with engine.begin() as conn:
-                    insert_features(conn, features_buffer)
-                features_buffer.clear()
+            # Flush periodically (tra un match e l'altro: stato = cursore)
+            pending = len(features_buffer) + replay.pending()
+            if pending >= flush_batch.size:
+                commit_flush(features_buffer, replay, m.cursor, flush_batch, use_copy)
                 print(f"   Processati {processed} match...")
 
-            if (len(surface_dirty) + len(form_dirty) + len(h2h_dirty) + 
-                len(activity_dirty) + len(serve_dirty) + len(level_dirty)) >= STATE_BATCH:
-                flush_all_states(
-                    surface_dirty, form_dirty, h2h_dirty,
-                    activity_dirty, serve_dirty, level_dirty
-                )
-
         # Final flush
-        if features_buffer:
-            with engine.begin() as conn:
-                insert_features(conn, features_buffer)
-            features_buffer.clear()
+        if processed:
+            commit_flush(features_buffer, replay, m.cursor, use_copy=use_copy)
 
-        flush_all_states(
-            surface_dirty, form_dirty, h2h_dirty,
-            activity_dirty, serve_dirty, level_dirty
-        )
+    if processed or not from_checkpoint:
+        save_build_checkpoint(states, use_checkpoint)
 
     print(f"\n✅ Feature store aggiornato. Match processati: {processed}")
 
 
-def flush_all_states(surface_dirty, form_dirty, h2h_dirty, 
-                     activity_dirty, serve_dirty, level_dirty):
-    """Flush tutti gli stati dirty al database."""
-    
-    if not any([surface_dirty, form_dirty, h2h_dirty, 
-                activity_dirty, serve_dirty, level_dirty]):
-        return
-
-    surface_rows = [
-        {"player_id": pid, "surface": surf, "elo": elo, 
-         "matches_cnt": mcnt, "wins_cnt": wcnt}
-        for (pid, surf), (elo, mcnt, wcnt) in surface_dirty.items()
-    ]
-    
-    form_rows = [
-        {"player_id": pid, "last_results": list(dq)}
-        for pid, dq in form_dirty.items()
-    ]
-    
-    h2h_rows = [
-        {"player_id": a, "opponent_id": b, "wins": wins}
-        for (a, b), wins in h2h_dirty.items()
-    ]
-    
-    activity_rows = [
-        {"player_id": pid, "last_match_date": dt}
-        for pid, dt in activity_dirty.items()
-    ]
-    
-    serve_rows = [
-        {
-            "player_id": pid,
-            "ace_total": ss["ace"],
-            "df_total": ss["df"],
-            "svpt_total": ss["svpt"],
-            "first_in_total": ss["1stIn"],
-            "first_won_total": ss["1stWon"],
-            "second_won_total": ss["2ndWon"],
-            "bp_faced_total": ss["bpFaced"],
-            "bp_saved_total": ss["bpSaved"],
-        }
-        for pid, ss in serve_dirty.items()
-    ]
-    
-    level_rows = [
-        {"player_id": pid, "level": lvl, "matches_cnt": m, "wins_cnt": w}
-        for (pid, lvl), (m, w) in level_dirty.items()
-    ]
-
+def commit_flush(features: List[Dict[str, Any]], replay: FeatureReplay, cursor,
+                 batch: Optional[AdaptiveBatch] = None, use_copy: bool = USE_COPY):
+    """
+    Scrive in UNA transazione le feature, gli stati dirty e il cursore
+    (match_date, match_id) dell'ultimo match incluso, poi svuota i buffer.
+    Dopo un crash il build riparte dal cursore con stati coerenti:
+    nessun match contato due volte né perso.
+    """
+    start = time.perf_counter()
     with engine.begin() as conn:
-        upsert_surface_state(conn, surface_rows)
-        upsert_form_state(conn, form_rows)
-        upsert_h2h_state(conn, h2h_rows)
-        upsert_activity_state(conn, activity_rows)
-        upsert_serve_state(conn, serve_rows)
-        upsert_level_state(conn, level_rows)
+        if features:
+            write_feature_rows(conn, features, use_copy)
+        rows = write_dirty_states(conn, replay.dirty(), use_copy)
+        save_cursor(conn, *cursor)
+
+    if batch is not None:
+        batch.record(len(features) + rows, time.perf_counter() - start)
+    features.clear()
+    replay.clear_dirty()
+
+
+def write_dirty_states(conn, dirty: Dict[str, Dict[Any, Any]],
+                       use_copy: bool = USE_COPY) -> int:
+    """
+    Scrive gli stati dirty (nome famiglia -> voci del suo state_slot)
+    nella transazione di conn (via COPY se use_copy, default
+    FEATURE_FLUSH=copy), poi player_latest_state dei giocatori toccati.
+
+    Returns:
+        Numero di righe scritte nelle tabelle stato
+    """
+    written = 0
+    players = set()
+    for name, items in dirty.items():
+        family = FAMILIES[name]
+        rows = family.state_rows(items)
+        if use_copy:
+            copy_upsert(conn, family.table, family.table_columns, family.table_keys, rows)
+        else:
+            upsert_state_rows(conn, family.table, family.table_columns, family.table_keys, rows)
+        written += len(rows)
+        if family.table_keys == ["player_id"]:
+            players.update(items)
+    refresh_latest_state(conn, list(players))
+    return written
+
+
+def bench_families(names: Optional[List[str]] = None):
+    """
+    Replay in memoria di tutti i match con le sole famiglie selezionate,
+    senza scritture: misura il costo di ciascuna famiglia.
+    """
+    replay = FeatureReplay(empty_states(), names)
+    print(f"⏱  Replay famiglie: {', '.join(f.name for f in replay.families) or '-'}")
 
-    surface_dirty.clear()
-    form_dirty.clear()
-    h2h_dirty.clear()
-    activity_dirty.clear()
-    serve_dirty.clear()
-    level_dirty.clear()
+    processed = 0
+    start = time.perf_counter()
+    with engine.connect().execution_options(stream_results=True) as conn_stream:
+        for row in conn_stream.execute(MATCHES_SQL, {"d": "0001-01-01", "id": 0}):
+            replay.step(MatchContext(row))
+            replay.clear_dirty()
+            processed += 1
+    elapsed = time.perf_counter() - start
+
+    rate = processed / elapsed if elapsed else 0.0
+    print(f"✅ {processed} match in {elapsed:.1f}s ({rate:,.0f} match/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Feature store builder")
+    parser.add_argument("command", nargs="?", choices=("build", "rebuild", "bench", "backfill", "dataset"),
+                        default="build")
+    parser.add_argument("--from", dest="from_date", type=date.fromisoformat,
+                        help="rebuild: data (YYYY-MM-DD) da cui riprocessare i match")
+    parser.add_argument("--families",
+                        help=f"bench/backfill: famiglie separate da virgola ({', '.join(FAMILIES)})")
+    parser.add_argument("--source", choices=("db", "staging"), default="db",
+                        help="dataset: match dal database o dallo staging Parquet")
+    parser.add_argument("--staging-families", default=os.environ.get("IMPORT_FAMILIES", "main"),
+                        help="dataset: famiglie di file dello staging (main,qual_chall,...)")
+    parser.add_argument("--output", help="dataset: percorso del Parquet di output")
+    parser.add_argument("--numpy", action="store_true")
+    parser.add_argument("--copy", action="store_true")
+    parser.add_argument("--no-checkpoint", action="store_true")
+    args = parser.parse_args()
+
+    use_numpy = args.numpy or os.environ.get("FEATURE_ENGINE", "").lower() == "numpy"
+    use_copy = args.copy or USE_COPY
+    from ml.feature_store_checkpoint import USE_CHECKPOINT
+    use_checkpoint = USE_CHECKPOINT and not args.no_checkpoint
+
+    if args.command == "rebuild":
+        if args.from_date is None:
+            parser.error("rebuild richiede --from YYYY-MM-DD")
+        from ml.feature_store_snapshots import rebuild_from
+        rebuild_from(args.from_date, use_numpy, use_copy, use_checkpoint)
+    elif args.command in ("bench", "backfill"):
+        names = [f.strip() for f in args.families.split(",") if f.strip()] if args.families else None
+        if args.command == "backfill" and not names:
+            parser.error("backfill richiede --families")
+        try:
+            select_families(names)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.command == "bench":
+            bench_families(names)
+        else:
+            from ml.feature_store_backfill import backfill_families
+            backfill_families(names, use_checkpoint)
+    elif args.command == "dataset":
+        from ml.feature_store_offline import OUTPUT_PATH, build_offline_dataset
+        families = [f.strip() for f in args.staging_families.split(",") if f.strip()]
+        build_offline_dataset(args.source, args.output or OUTPUT_PATH, families)
+    elif use_numpy:
+        from ml.feature_store_numpy import build_feature_store_numpy
+        build_feature_store_numpy(use_copy=use_copy, use_checkpoint=use_checkpoint)
+    else:
+        build_feature_store(use_copy=use_copy, use_checkpoint=use_checkpoint)
 
 
 if __name__ == "__main__":
-    build_feature_store()
\ No newline at end of file
+    main()
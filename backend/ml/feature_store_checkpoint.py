@@ -0,0 +1,227 @@
+"""
+Feature Store Checkpoint
+=========================
+Snapshot binario locale di tutto lo stato del feature store, scritto a
+fine build e riletto all'avvio del build successivo al posto delle
+tabelle stato.
+
+Formato: una directory con un file .npy per colonna (scritte e lette da
+encode() / decode() di ogni famiglia di ml.feature_families) e meta.json
+con versione, cursore di resume (match_date, match_id), metadati per
+famiglia e SHA-256 di ogni file:
+
+    /data/ml/feature_state/
+        meta.json
+        surface_elo.player.npy, surface_elo.code.npy, surface_elo.elo.npy, ...
+        h2h.player.npy, h2h.opponent.npy, h2h.wins.npy
+        activity.recent_player.npy, activity.recent_offsets.npy, ...
+        ...
+
+Lo snapshot vale solo se il cursore coincide con quello del feature store,
+le famiglie sono quelle registrate e tutti i checksum tornano; altrimenti
+si ricarica dal DB con load_states().
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from ml.feature_families import FAMILIES, as_states, check_slots, empty_states
+from ml.feature_store_build import get_resume_cursor, load_states
+
+CHECKPOINT_DIR = os.environ.get("FEATURE_CHECKPOINT_DIR", "/data/ml/feature_state")
+# Default di use_checkpoint (--no-checkpoint lo disattiva da riga di comando)
+USE_CHECKPOINT = os.environ.get("FEATURE_CHECKPOINT", "true").lower() != "false"
+CHECKPOINT_VERSION = 2
+META_FILE = "meta.json"
+HASH_CHUNK = 1 << 20
+
+
+# =============================================================================
+# ENCODING
+# =============================================================================
+
+def encode_states(states) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    Stati nel formato di load_states() -> colonne NumPy, con encode() di
+    ogni famiglia registrata (file <famiglia>.<colonna>).
+    Include le date dei match recenti, che le tabelle stato non hanno.
+
+    Returns:
+        Tuple di (nome file -> array, metadati extra)
+    """
+    states = as_states(states)
+    arrays: Dict[str, np.ndarray] = {}
+    families: Dict[str, Dict] = {}
+    for name, family in FAMILIES.items():
+        columns, families[name] = family.encode(states)
+        for column, array in columns.items():
+            arrays[f"{name}.{column}"] = array
+    return arrays, {"families": families}
+
+
+def decode_states(arrays: Dict[str, np.ndarray], meta: Dict):
+    """Colonne dello snapshot -> stati nel formato di load_states()."""
+    slots = {}
+    for name, family in FAMILIES.items():
+        prefix = f"{name}."
+        columns = {key[len(prefix):]: array for key, array in arrays.items() if key.startswith(prefix)}
+        slots.update(family.decode(columns, meta["families"][name]))
+    return empty_states()._replace(**slots)
+
+
+# =============================================================================
+# READ / WRITE
+# =============================================================================
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_checkpoint(states, cursor: Tuple[str, int], directory: str = CHECKPOINT_DIR):
+    """
+    Scrive lo snapshot in una directory temporanea e la sostituisce
+    a quella corrente, così un crash non lascia snapshot a metà.
+    """
+    arrays, extra = encode_states(states)
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = directory + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    files = {}
+    for name, array in arrays.items():
+        path = os.path.join(tmp, f"{name}.npy")
+        np.save(path, np.ascontiguousarray(array), allow_pickle=False)
+        files[name] = _sha256(path)
+
+    meta = {
+        "version": CHECKPOINT_VERSION,
+        "cursor": [cursor[0], int(cursor[1])],
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "files": files,
+        **extra,
+    }
+    with open(os.path.join(tmp, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old = directory + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old)
+    os.replace(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def load_checkpoint(cursor: Tuple[str, int], directory: str = CHECKPOINT_DIR):
+    """
+    Carica lo snapshot se è valido per il cursore dato.
+
+    Returns:
+        Stati nel formato di load_states(), oppure None se lo snapshot
+        manca, è di un'altra versione, ha altre famiglie, un altro cursore
+        o un checksum errato
+    """
+    meta_path = os.path.join(directory, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        print("⚠️  Checkpoint: meta.json non leggibile")
+        return None
+
+    if meta.get("version") != CHECKPOINT_VERSION:
+        print("⚠️  Checkpoint: versione diversa")
+        return None
+    if sorted(meta.get("families", {})) != sorted(FAMILIES):
+        print("⚠️  Checkpoint: famiglie diverse da quelle registrate")
+        return None
+    if meta.get("cursor") != [cursor[0], int(cursor[1])]:
+        print(f"⚠️  Checkpoint: cursore {meta.get('cursor')} != feature store {list(cursor)}")
+        return None
+
+    arrays = {}
+    for name, digest in meta.get("files", {}).items():
+        path = os.path.join(directory, f"{name}.npy")
+        if not os.path.exists(path):
+            print(f"⚠️  Checkpoint: file mancante {name}")
+            return None
+        # Una sola lettura per checksum e decodifica: gli array sono
+        # comunque convertiti in stati Python da decode_states()
+        with open(path, "rb") as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != digest:
+            print(f"⚠️  Checkpoint: checksum errato per {name}")
+            return None
+        arrays[name] = np.load(io.BytesIO(data), allow_pickle=False)
+
+    return decode_states(arrays, meta)
+
+
+def patch_checkpoint(cursor: Tuple[str, int], slots: Dict[str, object],
+                     directory: str = CHECKPOINT_DIR) -> bool:
+    """
+    Sostituisce alcuni campi di FeatureStates in uno snapshot valido per
+    il cursore (es. dopo il backfill di una famiglia). ValueError, prima
+    di leggere lo snapshot, se un campo non esiste.
+
+    Returns:
+        True se lo snapshot è stato riscritto
+    """
+    check_slots(slots)
+    states = load_checkpoint(cursor, directory)
+    if states is None:
+        return False
+    write_checkpoint(states._replace(**slots), cursor, directory)
+    return True
+
+
+# =============================================================================
+# BUILD INTEGRATION
+# =============================================================================
+
+def load_build_states(cursor: Tuple[str, int], use_checkpoint: Optional[bool] = None):
+    """
+    Stati di partenza di un build: dal checkpoint se valido per il cursore
+    (e use_checkpoint, default FEATURE_CHECKPOINT), altrimenti dalle tabelle stato.
+
+    Returns:
+        Tuple di (stati nel formato di load_states(), True se dal checkpoint)
+    """
+    if use_checkpoint is None:
+        use_checkpoint = USE_CHECKPOINT
+    if use_checkpoint:
+        states = load_checkpoint(cursor)
+        if states is not None:
+            print(f"   Stato dal checkpoint {CHECKPOINT_DIR}")
+            return states, True
+    states = load_states()
+    print("   Stato dalle tabelle")
+    return states, False
+
+
+def save_build_checkpoint(states, use_checkpoint: Optional[bool] = None):
+    """Scrive il checkpoint dello stato completo con il cursore corrente (se use_checkpoint)."""
+    if use_checkpoint is None:
+        use_checkpoint = USE_CHECKPOINT
+    if not use_checkpoint:
+        return
+    cursor = get_resume_cursor()
+    write_checkpoint(states, cursor)
+    print(f"📌 Checkpoint stato salvato ({cursor[0]}, {cursor[1]})")
@@ -0,0 +1,671 @@
+"""
+Feature Store Builder - NumPy engine
+=====================================
+Motore alternativo per il replay di build_feature_store().
+
+- indici densi dei giocatori calcolati al caricamento dei match
+- stato in array NumPy preallocati (Elo, match e vittorie per superficie,
+  totali servizio, esperienza per livello, data ultimo match); form e
+  match recenti nelle finestre mobili di ml.rolling_windows
+- feature pre-match scritte in un array strutturato preallocato
+
+I match vengono letti in forma colonnare con una sola query; le colonne
+che non dipendono dallo stato (id, date, rank, età) sono scritte in blocco,
+il loop calcola solo Elo, contatori e date; rapporti e totali servizio
+sono calcolati in modo vettoriale alla fine.
+Elo segue le stesse operazioni float del loop originale e i rapporti la
+stessa divisione di safe_ratio(): l'output (feature e stati) è identico
+bit a bit. Il motore calcola sempre tutte le famiglie di NUMPY_FAMILIES
+(la selezione delle famiglie vale per FeatureReplay); se nel registro di
+ml.feature_families ci sono altre famiglie il build usa il replay a dict.
+
+Eseguire con: python -m ml.feature_store_numpy
+"""
+
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.bulk_copy import copy_dataframe, create_staging_table, upsert_from_staging
+from app.database import engine
+from ml.feature_families import (
+    ACTIVITY_COLUMNS,
+    ACTIVITY_WINDOWS,
+    BASE_COLUMNS,
+    BASE_ELO,
+    FAMILIES,
+    FORM_COLUMNS,
+    FORM_HISTORY,
+    FORM_WINDOWS,
+    K,
+    SURFACES,
+    as_states,
+    empty_states,
+    expected_score,
+)
+from ml.feature_store_build import (
+    FEATURE_KEYS,
+    FEATURES_BATCH,
+    MATCHES_SQL,
+    USE_COPY,
+    build_feature_store,
+    create_tables,
+    get_resume_cursor,
+    insert_features,
+    new_batch,
+    save_cursor,
+    write_dirty_states,
+)
+from ml.feature_store_checkpoint import load_build_states, save_build_checkpoint
+from ml.feature_store_snapshots import snapshot_boundaries, take_snapshot
+from ml.rolling_windows import RollingDates, RollingResults
+
+PROGRESS_EVERY = 50000
+
+# Valori mancanti nelle colonne intere dell'array feature (-> NULL)
+NULL_INT = -1
+NO_DATE = np.iinfo(np.int64).min
+
+SERVE_KEYS = ("ace", "df", "svpt", "1stIn", "1stWon", "2ndWon", "bpFaced", "bpSaved")
+W_SERVE_COLUMNS = ["w_ace", "w_df", "w_svpt", "w_1stin", "w_1stwon", "w_2ndwon", "w_bpfaced", "w_bpsaved"]
+L_SERVE_COLUMNS = ["l_ace", "l_df", "l_svpt", "l_1stin", "l_1stwon", "l_2ndwon", "l_bpfaced", "l_bpsaved"]
+
+# Famiglie di ml.feature_families calcolate dal replay (chiavi di dirty_states())
+NUMPY_FAMILIES = ("surface_elo", "form", "h2h", "activity", "serve", "level")
+
+# Tipo SQL di player_match_features -> dtype dell'array feature
+SQL_DTYPES = {"INTEGER": np.int64, "FLOAT": np.float64, "DATE": "datetime64[D]"}
+
+
+def feature_dtype() -> np.dtype:
+    """
+    Una riga per (match, giocatore), con le colonne di player_match_features
+    delle famiglie di NUMPY_FAMILIES (surface come indice in SURFACES).
+    """
+    columns = dict(BASE_COLUMNS)
+    for name in NUMPY_FAMILIES:
+        columns.update(FAMILIES[name].columns)
+    return np.dtype([
+        (name, np.int8 if name == "surface" else SQL_DTYPES[sql_type])
+        for name, sql_type in columns.items()
+    ])
+
+
+FEATURE_DTYPE = feature_dtype()
+
+
+# =============================================================================
+# UTILITY FUNCTIONS
+# =============================================================================
+
+def to_day(d: date) -> int:
+    """Data -> giorni dall'epoch (stessa aritmetica di date - date)."""
+    return int(np.datetime64(d, "D").astype(np.int64))
+
+
+# =============================================================================
+# MATCH LOADING
+# =============================================================================
+
+def load_matches(last_date: str, last_id: int) -> pd.DataFrame:
+    """Carica in forma colonnare i match successivi al cursore."""
+    with engine.connect() as conn:
+        return pd.read_sql(MATCHES_SQL, conn, params={"d": last_date, "id": last_id})
+
+
+def prepare_matches(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Converte i match in array NumPy pronti per il replay.
+    Rank e età seguono le regole del loop originale (0/NULL -> mancante).
+    """
+    n = len(df)
+    if n == 0:
+        empty = np.zeros(0, np.int64)
+        return {"n": 0, "match_id": empty, "winner_id": empty, "loser_id": empty,
+                "day": empty, "surface": empty.astype(np.int8), "level": np.array([], object),
+                "winner_rank": empty, "loser_rank": empty,
+                "winner_age": empty.astype(np.float64), "loser_age": empty.astype(np.float64),
+                "w_serve": np.zeros((0, len(SERVE_KEYS)), np.int64),
+                "l_serve": np.zeros((0, len(SERVE_KEYS)), np.int64)}
+
+    surface_codes = {s: i for i, s in enumerate(SURFACES)}
+
+    def rank(col):
+        values = pd.to_numeric(df[col]).fillna(0).astype(np.int64).to_numpy()
+        return np.where(values != 0, values, NULL_INT)
+
+    def age(col):
+        values = pd.to_numeric(df[col]).astype(np.float64).to_numpy()
+        return np.where(values != 0, values, np.nan)
+
+    level = df["tournament_level"].where(df["tournament_level"].fillna("") != "", "A")
+
+    return {
+        "n": n,
+        "match_id": df["id"].to_numpy(np.int64),
+        "winner_id": df["winner_id"].to_numpy(np.int64),
+        "loser_id": df["loser_id"].to_numpy(np.int64),
+        "day": pd.to_datetime(df["match_date"]).to_numpy().astype("datetime64[D]").astype(np.int64),
+        "surface": df["surface"].map(surface_codes).to_numpy(np.int8),
+        "level": level.to_numpy(object),
+        "winner_rank": rank("winner_rank"),
+        "loser_rank": rank("loser_rank"),
+        "winner_age": age("winner_age"),
+        "loser_age": age("loser_age"),
+        "w_serve": df[W_SERVE_COLUMNS].to_numpy(np.int64),
+        "l_serve": df[L_SERVE_COLUMNS].to_numpy(np.int64),
+    }
+
+
+# =============================================================================
+# ARRAY STATE
+# =============================================================================
+
+class ArrayState:
+    """
+    Stato del feature store in array densi indicizzati per giocatore.
+    Le flag *_dirty marcano le righe da riscrivere negli state table.
+    """
+
+    def __init__(self, player_ids: np.ndarray, levels: List[str]):
+        n = len(player_ids)
+        self.player_ids = player_ids
+        self.levels = list(levels)
+        self.level_index = {lvl: i for i, lvl in enumerate(self.levels)}
+
+        # (player, surface)
+        self.elo = np.full((n, len(SURFACES)), BASE_ELO, dtype=np.float64)
+        self.matches = np.zeros((n, len(SURFACES)), dtype=np.int64)
+        self.wins = np.zeros((n, len(SURFACES)), dtype=np.int64)
+        self.form = [RollingResults(FORM_WINDOWS, FORM_HISTORY) for _ in range(n)]
+        self.last_day = np.full(n, NO_DATE, dtype=np.int64)
+        # Date (giorni dall'epoch) dei match recenti, solo in checkpoint/snapshot
+        self.recent = [RollingDates(ACTIVITY_WINDOWS) for _ in range(n)]
+        self.serve = np.zeros((n, len(SERVE_KEYS)), dtype=np.int64)
+        # (player, level) -> [matches, wins]
+        self.level = np.zeros((n, len(self.levels), 2), dtype=np.int64)
+        # (player_id, opponent_id) -> wins, sparso
+        self.h2h: Dict[Tuple[int, int], int] = {}
+
+        self.surface_dirty = np.zeros((n, len(SURFACES)), dtype=bool)
+        self.player_dirty = np.zeros(n, dtype=bool)
+        self.serve_dirty = np.zeros(n, dtype=bool)
+        self.level_dirty = np.zeros((n, len(self.levels)), dtype=bool)
+        self.h2h_dirty: set = set()
+
+    def index_of(self, ids) -> np.ndarray:
+        return np.searchsorted(self.player_ids, ids)
+
+    @classmethod
+    def from_states(cls, states, matches: Dict[str, np.ndarray]) -> "ArrayState":
+        """Costruisce lo stato dai dict di load_states() e dai match da processare."""
+        states = as_states(states)
+        surface_state, form_state, h2h = states.surface, states.form, states.h2h
+        last_match, recent, serve_stats = states.last_match, states.recent, states.serve
+        level_exp = states.level
+
+        ids = [matches["winner_id"], matches["loser_id"]]
+        ids.append(np.fromiter((pid for pid, _ in surface_state), np.int64))
+        ids.append(np.fromiter(form_state.keys(), np.int64))
+        ids.append(np.fromiter(last_match.keys(), np.int64))
+        ids.append(np.fromiter(recent.keys(), np.int64))
+        ids.append(np.fromiter(serve_stats.keys(), np.int64))
+        ids.append(np.fromiter((pid for pid, _ in level_exp), np.int64))
+        player_ids = np.unique(np.concatenate(ids))
+
+        levels = sorted(set(matches["level"].tolist()) | {lvl for _, lvl in level_exp})
+        state = cls(player_ids, levels)
+        surface_codes = {s: i for i, s in enumerate(SURFACES)}
+
+        for (pid, surface), (elo, mcnt, wcnt) in surface_state.items():
+            s = surface_codes.get(surface)
+            if s is None:
+                continue
+            i = state.index_of(pid)
+            state.elo[i, s] = elo
+            state.matches[i, s] = mcnt
+            state.wins[i, s] = wcnt
+
+        for pid, form in form_state.items():
+            state.form[state.index_of(pid)] = RollingResults.from_values(
+                form, FORM_WINDOWS, FORM_HISTORY
+            )
+
+        for pid, d in last_match.items():
+            if d is not None:
+                state.last_day[state.index_of(pid)] = to_day(d)
+
+        for pid, days in recent.items():
+            state.recent[state.index_of(pid)] = RollingDates.from_days(days, ACTIVITY_WINDOWS)
+
+        for pid, ss in serve_stats.items():
+            state.serve[state.index_of(pid)] = [ss.get(k, 0) for k in SERVE_KEYS]
+
+        for (pid, lvl), (m, w) in level_exp.items():
+            state.level[state.index_of(pid), state.level_index[lvl]] = (m, w)
+
+        state.h2h = dict(h2h)
+        return state
+
+    def to_states(self):
+        """
+        Stato nel formato di load_states() (per il checkpoint): gli altri
+        campi del registro restano vuoti.
+        """
+        pids = self.player_ids.tolist()
+
+        surface_state = {}
+        for i, s in zip(*np.nonzero((self.matches > 0) | (self.elo != BASE_ELO))):
+            surface_state[(pids[i], SURFACES[s])] = (
+                float(self.elo[i, s]), int(self.matches[i, s]), int(self.wins[i, s])
+            )
+
+        form_state = {pids[i]: form for i, form in enumerate(self.form) if len(form)}
+
+        active = np.flatnonzero(self.last_day != NO_DATE)
+        last_match = dict(zip(
+            self.player_ids[active].tolist(),
+            self.last_day[active].astype("datetime64[D]").astype(object).tolist(),
+        ))
+
+        serve_stats = defaultdict(lambda: defaultdict(int))
+        for i in np.flatnonzero(self.serve.any(axis=1)).tolist():
+            serve_stats[pids[i]] = dict(zip(SERVE_KEYS, self.serve[i].tolist()))
+
+        level_exp = {}
+        for i, lv in zip(*np.nonzero(self.level[:, :, 0] > 0)):
+            level_exp[(pids[i], self.levels[lv])] = (
+                int(self.level[i, lv, 0]), int(self.level[i, lv, 1])
+            )
+
+        recent = {pids[i]: days for i, days in enumerate(self.recent) if len(days)}
+
+        return empty_states()._replace(
+            surface=surface_state, form=form_state, h2h=dict(self.h2h),
+            last_match=last_match, recent=recent, serve=serve_stats, level=level_exp,
+        )
+
+    def dirty_states(self) -> Dict[str, Dict]:
+        """Stati modificati nel formato di write_dirty_states() (famiglia -> voci)."""
+        pids = self.player_ids.tolist()
+
+        surface_dirty = {}
+        for i, s in zip(*np.nonzero(self.surface_dirty)):
+            surface_dirty[(pids[i], SURFACES[s])] = (
+                float(self.elo[i, s]), int(self.matches[i, s]), int(self.wins[i, s])
+            )
+
+        form_dirty = {}
+        activity_dirty = {}
+        for i in np.flatnonzero(self.player_dirty).tolist():
+            form_dirty[pids[i]] = self.form[i]
+            activity_dirty[pids[i]] = self.last_day[i].astype("datetime64[D]").astype(object)
+
+        h2h_dirty = {key: self.h2h[key] for key in self.h2h_dirty}
+
+        serve_dirty = {}
+        for i in np.flatnonzero(self.serve_dirty).tolist():
+            serve_dirty[pids[i]] = dict(zip(SERVE_KEYS, self.serve[i].tolist()))
+
+        level_dirty = {}
+        for i, lv in zip(*np.nonzero(self.level_dirty)):
+            level_dirty[(pids[i], self.levels[lv])] = (
+                int(self.level[i, lv, 0]), int(self.level[i, lv, 1])
+            )
+
+        return {
+            "surface_elo": surface_dirty,
+            "form": form_dirty,
+            "h2h": h2h_dirty,
+            "activity": activity_dirty,
+            "serve": serve_dirty,
+            "level": level_dirty,
+        }
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """safe_ratio() vettoriale: numerator / denominator, 0.0 se denominator == 0."""
+    num = numerator.astype(np.float64)
+    den = denominator.astype(np.float64)
+    return np.divide(num, den, out=np.zeros(len(num)), where=denominator != 0)
+
+
+def serve_prematch(matches: Dict[str, np.ndarray], state: ArrayState) -> np.ndarray:
+    """
+    Totali servizio PRE-MATCH per ogni riga feature, in modo vettoriale:
+    stato iniziale + somma cumulativa esclusiva dei match precedenti
+    del giocatore (solo match con svpt > 0). Aggiorna state.serve.
+
+    Returns:
+        Array (2 * n, len(SERVE_KEYS)) di interi
+    """
+    n = matches["n"]
+    players = np.empty(2 * n, dtype=np.int64)
+    players[0::2] = state.index_of(matches["winner_id"])
+    players[1::2] = state.index_of(matches["loser_id"])
+
+    contrib = np.empty((2 * n, len(SERVE_KEYS)), dtype=np.int64)
+    contrib[0::2] = matches["w_serve"]
+    contrib[1::2] = matches["l_serve"]
+    has_stats = contrib[:, SERVE_KEYS.index("svpt")] > 0
+    contrib[~has_stats] = 0
+
+    # Ordine stabile per giocatore: le righe di ciascuno restano cronologiche
+    order = np.argsort(players, kind="stable")
+    grouped = contrib[order]
+    cumulative = np.cumsum(grouped, axis=0) - grouped
+    group_players = players[order]
+    starts = np.flatnonzero(np.r_[True, group_players[1:] != group_players[:-1]])
+    offsets = np.repeat(cumulative[starts], np.diff(np.r_[starts, len(order)]), axis=0)
+
+    totals = np.empty_like(contrib)
+    totals[order] = cumulative - offsets + state.serve[group_players]
+    # winner == loser: entrambe le righe leggono lo stato prima del match
+    same = players[0::2] == players[1::2]
+    totals[1::2][same] = totals[0::2][same]
+
+    np.add.at(state.serve, players, contrib)
+    state.serve_dirty[players[has_stats]] = True
+    return totals
+
+
+def replay(matches: Dict[str, np.ndarray], state: ArrayState) -> np.ndarray:
+    """
+    Processa i match in ordine, aggiornando state.
+
+    Il loop scrive nell'array solo contatori interi PRE-MATCH; i rapporti
+    (win rate, servizio) sono calcolati alla fine in modo vettoriale,
+    con la stessa divisione float di safe_ratio().
+
+    Returns:
+        Array strutturato FEATURE_DTYPE con 2 righe per match (winner, loser)
+    """
+    n = matches["n"]
+    feats = np.zeros(2 * n, dtype=FEATURE_DTYPE)
+
+    # Colonne indipendenti dallo stato: scritte in blocco
+    for col, a_src, b_src in (
+        ("match_id", "match_id", "match_id"),
+        ("player_id", "winner_id", "loser_id"),
+        ("opponent_id", "loser_id", "winner_id"),
+        ("surface", "surface", "surface"),
+        ("rank", "winner_rank", "loser_rank"),
+        ("age", "winner_age", "loser_age"),
+    ):
+        feats[col][0::2] = matches[a_src]
+        feats[col][1::2] = matches[b_src]
+    feats["match_date"][0::2] = matches["day"].astype("datetime64[D]")
+    feats["match_date"][1::2] = matches["day"].astype("datetime64[D]")
+
+    # Contatori PRE-MATCH per riga feature
+    surface_m = np.zeros(2 * n, dtype=np.int64)
+    surface_w = np.zeros(2 * n, dtype=np.int64)
+    level_m = np.zeros(2 * n, dtype=np.int64)
+    level_w = np.zeros(2 * n, dtype=np.int64)
+
+    f_elo = feats["elo"]
+    f_form = [feats[column] for column in FORM_COLUMNS]
+    f_h2h = feats["h2h_wins"]
+    f_days = feats["days_since_last_match"]
+    f_activity = [feats[column] for column in ACTIVITY_COLUMNS]
+
+    # Liste Python per l'accesso scalare nel loop
+    idx_a = state.index_of(matches["winner_id"]).tolist()
+    idx_b = state.index_of(matches["loser_id"]).tolist()
+    ids_a = matches["winner_id"].tolist()
+    ids_b = matches["loser_id"].tolist()
+    days = matches["day"].tolist()
+    surfaces = matches["surface"].tolist()
+    levels = [state.level_index[lvl] for lvl in matches["level"].tolist()]
+
+    elo, mcnt, wcnt = state.elo, state.matches, state.wins
+    form = state.form
+    last_day, recent, level = state.last_day, state.recent, state.level
+    h2h = state.h2h
+
+    for i in range(n):
+        a, b = idx_a[i], idx_b[i]
+        A, B = ids_a[i], ids_b[i]
+        s, lv, day = surfaces[i], levels[i], days[i]
+        ra, rb = 2 * i, 2 * i + 1
+
+        # === PRE-MATCH FEATURE ===
+        elo_A, elo_B = float(elo[a, s]), float(elo[b, s])
+        mcnt_A, wcnt_A = int(mcnt[a, s]), int(wcnt[a, s])
+        mcnt_B, wcnt_B = int(mcnt[b, s]), int(wcnt[b, s])
+        h2h_A = h2h.get((A, B), 0)
+        h2h_B = h2h.get((B, A), 0)
+        level_m_A, level_w_A = level[a, lv].tolist()
+        level_m_B, level_w_B = level[b, lv].tolist()
+
+        f_elo[ra], f_elo[rb] = elo_A, elo_B
+        surface_m[ra], surface_w[ra] = mcnt_A, wcnt_A
+        surface_m[rb], surface_w[rb] = mcnt_B, wcnt_B
+        level_m[ra], level_w[ra] = level_m_A, level_w_A
+        level_m[rb], level_w[rb] = level_m_B, level_w_B
+        f_h2h[ra], f_h2h[rb] = h2h_A, h2h_B
+
+        for r, p in ((ra, a), (rb, b)):
+            for f, value in zip(f_form, form[p].means()):
+                f[r] = value
+            last = int(last_day[p])
+            f_days[r] = day - last if last != NO_DATE else NULL_INT
+            for f, count in zip(f_activity, recent[p].counts(day)):
+                f[r] = count
+
+        # === UPDATE STATES (POST-MATCH) ===
+        # Prima A poi B, come il path a dict: con winner == loser
+        # (righe sporche del dataset) vince la scrittura del perdente
+        exp_A = expected_score(elo_A, elo_B)
+        elo[a, s] = elo_A + K * (1.0 - exp_A)
+        mcnt[a, s] = mcnt_A + 1
+        wcnt[a, s] = wcnt_A + 1
+        elo[b, s] = elo_B + K * (0.0 - (1.0 - exp_A))
+        mcnt[b, s] = mcnt_B + 1
+        wcnt[b, s] = wcnt_B
+
+        # Il path a dict parte da una form nuova per ciascun lato se quella
+        # del giocatore è vuota: con winner == loser resta solo la sconfitta
+        if a != b or form[a]:
+            form[a].push(1)
+        form[b].push(0)
+
+        h2h[(A, B)] = h2h_A + 1
+        state.h2h_dirty.add((A, B))
+
+        last_day[a] = day
+        last_day[b] = day
+
+        recent[a].push(day)
+        recent[b].push(day)
+
+        level[a, lv] = (level_m_A + 1, level_w_A + 1)
+        level[b, lv] = (level_m_B + 1, level_w_B)
+
+        if (i + 1) % PROGRESS_EVERY == 0:
+            print(f"   Processati {i + 1} match...")
+
+    # Stato toccato dal replay
+    for side in ("winner_id", "loser_id"):
+        rows = state.index_of(matches[side])
+        state.surface_dirty[rows, matches["surface"]] = True
+        state.player_dirty[rows] = True
+        state.level_dirty[rows, levels] = True
+
+    # Rapporti vettoriali (stessa divisione di safe_ratio)
+    feats["surface_wr"] = ratio(surface_w, surface_m)
+    feats["level_win_rate"] = ratio(level_w, level_m)
+
+    serve = serve_prematch(matches, state)
+    ace, df, svpt, first_in, first_won, second_won, bp_faced, bp_saved = serve.T
+    feats["ace_pct"] = ratio(ace, svpt)
+    feats["df_pct"] = ratio(df, svpt)
+    feats["first_serve_pct"] = ratio(first_in, svpt)
+    feats["first_serve_won_pct"] = ratio(first_won, first_in)
+    feats["second_serve_won_pct"] = ratio(second_won, np.where(svpt > first_in, svpt - first_in, 0))
+    feats["bp_save_pct"] = ratio(bp_saved, bp_faced)
+
+    return feats
+
+
+# =============================================================================
+# OUTPUT
+# =============================================================================
+
+def feature_rows(feats: np.ndarray) -> List[Dict[str, Any]]:
+    """Righe per insert_features() (NULL per i valori mancanti)."""
+    columns = {name: feats[name].tolist() for name in FEATURE_DTYPE.names}
+    columns["match_date"] = feats["match_date"].astype(object).tolist()
+    columns["surface"] = [SURFACES[s] for s in columns["surface"]]
+    columns["rank"] = [None if v == NULL_INT else v for v in columns["rank"]]
+    columns["days_since_last_match"] = [
+        None if v == NULL_INT else v for v in columns["days_since_last_match"]
+    ]
+    columns["age"] = [None if v != v else v for v in columns["age"]]
+
+    names = FEATURE_DTYPE.names
+    return [dict(zip(names, values)) for values in zip(*(columns[n] for n in names))]
+
+
+def feature_frame(feats: np.ndarray) -> pd.DataFrame:
+    """DataFrame per copy_dataframe(), con NA per i valori mancanti."""
+    df = pd.DataFrame({name: feats[name] for name in FEATURE_DTYPE.names})
+    df["surface"] = np.asarray(SURFACES, dtype=object)[feats["surface"]]
+    for col in ("rank", "days_since_last_match"):
+        df[col] = pd.array(feats[col], dtype="Int64")
+        df.loc[feats[col] == NULL_INT, col] = pd.NA
+    return df
+
+
+def copy_features(conn, feats: np.ndarray):
+    """Scrive un blocco di feature via COPY + INSERT ... SELECT."""
+    columns = list(FEATURE_DTYPE.names)
+    create_staging_table(conn, "player_match_features_staging", "player_match_features", columns)
+    copy_dataframe(conn, "player_match_features_staging", feature_frame(feats), columns)
+    upsert_from_staging(
+        conn, "player_match_features", "player_match_features_staging",
+        columns, FEATURE_KEYS, update=False,
+    )
+
+
+def write_features(conn, feats: np.ndarray, use_copy: bool = USE_COPY):
+    """
+    Scrive le feature nella transazione di conn, a blocchi
+    (via COPY con dimensione adattiva se use_copy).
+    """
+    batch = new_batch(FEATURES_BATCH, use_copy)
+    start = 0
+    while start < len(feats):
+        chunk = feats[start:start + batch.size]
+        began = time.perf_counter()
+        if use_copy:
+            copy_features(conn, chunk)
+        else:
+            insert_features(conn, feature_rows(chunk))
+        batch.record(len(chunk), time.perf_counter() - began)
+        start += len(chunk)
+
+
+# =============================================================================
+# MAIN BUILD FUNCTION
+# =============================================================================
+
+def slice_matches(matches: Dict[str, np.ndarray], start: int, stop: int) -> Dict[str, np.ndarray]:
+    """Match nell'intervallo [start, stop) nello stesso formato di prepare_matches()."""
+    part = {key: values[start:stop] for key, values in matches.items() if key != "n"}
+    part["n"] = stop - start
+    return part
+
+
+def replay_with_snapshots(matches: Dict[str, np.ndarray], state: ArrayState,
+                          cursor: Tuple[str, int]) -> np.ndarray:
+    """
+    replay() a segmenti tra i confini di periodo, con uno snapshot dello
+    stato prima di ogni segmento che apre un nuovo periodo.
+    Lo stato passa da un segmento all'altro: l'output è lo stesso di replay().
+    """
+    bounds = snapshot_boundaries(matches["day"], cursor)
+    if not bounds:
+        return replay(matches, state)
+
+    parts = []
+    start = 0
+    for stop in bounds + [matches["n"]]:
+        if stop > start:
+            parts.append(replay(slice_matches(matches, start, stop), state))
+        if stop < matches["n"]:
+            if stop > 0:
+                cursor = (
+                    matches["day"][stop - 1].astype("datetime64[D]").astype(object).isoformat(),
+                    int(matches["match_id"][stop - 1]),
+                )
+            take_snapshot(state.to_states(), cursor)
+        start = stop
+    return np.concatenate(parts)
+
+
+def build_feature_store_numpy(states=None, use_copy: bool = USE_COPY,
+                              use_checkpoint: Optional[bool] = None):
+    """
+    Costruisce/aggiorna il feature store con il motore NumPy.
+    states: stati di partenza già ripristinati (rebuild), altrimenti
+    checkpoint locale o tabelle.
+    use_copy: flush via COPY (--copy), altrimenti executemany.
+    use_checkpoint: legge e scrive il checkpoint locale (default FEATURE_CHECKPOINT).
+    """
+    others = [name for name in FAMILIES if name not in NUMPY_FAMILIES]
+    if others:
+        print(f"⚠️  Famiglie non supportate dal motore NumPy ({', '.join(others)}): replay a dict")
+        return build_feature_store(states, use_copy, use_checkpoint)
+
+    print("=" * 60)
+    print("🎾 FEATURE STORE BUILDER (NumPy)")
+    print("=" * 60)
+
+    create_tables()
+
+    last_date, last_id = get_resume_cursor()
+    print(f"▶ Resume from > ({last_date}, {last_id})")
+
+    print("\n📂 Caricamento stati...")
+    from_checkpoint = False
+    if states is None:
+        states, from_checkpoint = load_build_states((last_date, last_id), use_checkpoint)
+
+    matches = prepare_matches(load_matches(last_date, last_id))
+    print(f"📊 Match da processare: {matches['n']}")
+    if matches["n"] == 0:
+        if not from_checkpoint:
+            save_build_checkpoint(states, use_checkpoint)
+        print("\n✅ Feature store già aggiornato")
+        return
+
+    state = ArrayState.from_states(states, matches)
+    print(f"   Giocatori: {len(state.player_ids)}, livelli: {''.join(state.levels)}")
+
+    feats = replay_with_snapshots(matches, state, (last_date, last_id))
+
+    # Feature, stati e cursore in una sola transazione
+    print("\n💾 Scrittura feature...")
+    last_date = matches["day"][-1].astype("datetime64[D]").astype(object)
+    with engine.begin() as conn:
+        write_features(conn, feats, use_copy)
+        write_dirty_states(conn, state.dirty_states(), use_copy)
+        save_cursor(conn, last_date, matches["match_id"][-1])
+    save_build_checkpoint(state.to_states(), use_checkpoint)
+
+    print(f"\n✅ Feature store aggiornato. Match processati: {matches['n']}")
+
+
+if __name__ == "__main__":
+    build_feature_store_numpy()
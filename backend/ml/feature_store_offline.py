@@ -0,0 +1,203 @@
+"""
+Feature Store Offline
+======================
+Build del feature store in memoria, senza scritture su Postgres: le
+feature PRE-MATCH calcolate dal motore NumPy diventano direttamente il
+dataset differenziale di ml.build_dataset (stesse colonne, default e
+arrotondamenti, più le differenze dei rating di ml.rating_engine),
+salvato in /data/ml/tennis_dataset.parquet.
+
+I match arrivano dal database (sola lettura) o dallo staging Parquet
+dell'importer. Dallo staging:
+- i giocatori sono identificati per nome, come nel PlayerRegistry
+- i match seguono l'ordine dell'importer (file, poi data stabile) e
+  ricevono id progressivi locali, non gli id della tabella matches
+
+Eseguire con:
+    python -m ml.feature_store_build dataset [--source staging] [--output PATH]
+"""
+
+from __future__ import annotations
+
+import time
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from importer.import_csv import build_match_keys
+from importer.sources import LEVEL_ALIASES, MATCH_CSV_COLUMNS
+from importer.staging import read_staged
+from ml.build_dataset import OUTPUT_PATH, differential_dataset, save_dataset, verify_dataset
+from ml.feature_families import SURFACES, empty_states
+from ml.feature_store_numpy import (
+    L_SERVE_COLUMNS,
+    NULL_INT,
+    W_SERVE_COLUMNS,
+    ArrayState,
+    load_matches,
+    prepare_matches,
+    replay,
+)
+from ml.feature_store_snapshots import START_CURSOR
+from ml.rating_engine import rate_matches
+
+# Feature del dataset (winner_<nome>/loser_<nome>) -> colonna del feature store
+DATASET_FEATURES = {
+    "elo": "elo",
+    "recent_5": "recent_5",
+    "recent_10": "recent_10",
+    "surface_wr": "surface_wr",
+    "h2h": "h2h_wins",
+    "rank": "rank",
+    "days_rest": "days_since_last_match",
+    "age": "age",
+    "matches_30d": "matches_last_30d",
+    "ace_pct": "ace_pct",
+    "df_pct": "df_pct",
+    "first_serve_pct": "first_serve_pct",
+    "first_won_pct": "first_serve_won_pct",
+    "bp_save_pct": "bp_save_pct",
+    "level_wr": "level_win_rate",
+}
+
+# Feature del dataset -> colonna di RATING_DTYPE (ml.rating_engine)
+DATASET_RATINGS = {
+    "elo_overall": "elo",
+    "elo_blend": "blend_elo",
+    "elo_kdecay": "kdecay_elo",
+    "glicko": "glicko",
+    "glicko_rd": "glicko_rd",
+}
+
+# Colonne CSV servizio nello staging -> colonne di MATCHES_SQL
+STAGED_SERVE_COLUMNS = {
+    source: source.lower()
+    for source in MATCH_CSV_COLUMNS.values()
+    if source.lower() in W_SERVE_COLUMNS + L_SERVE_COLUMNS
+}
+
+STAGED_COLUMNS = [
+    "tourney_id", "match_num", "tourney_date", "surface", "tourney_level",
+    "round", "score", "winner_name", "loser_name",
+    "winner_rank", "loser_rank", "winner_age", "loser_age",
+    *STAGED_SERVE_COLUMNS,
+]
+
+
+# =============================================================================
+# MATCH LOADING
+# =============================================================================
+
+def load_staged_matches(families: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Match dallo staging Parquet nello stesso formato di load_matches().
+    Stesse regole dell'importer: righe senza nomi o data scartate, una
+    riga per match_key (vale l'ultima), ordine cronologico stabile.
+    """
+    df = read_staged(families, columns=STAGED_COLUMNS)
+    df = df[df["winner_name"].notna() & df["loser_name"].notna() & df["tourney_date"].notna()]
+    df = df.assign(match_key=build_match_keys(df)).drop_duplicates("match_key", keep="last")
+    df = df[df["surface"].isin(SURFACES)]
+    df = df.sort_values("tourney_date", kind="stable").reset_index(drop=True)
+
+    # Id giocatore per nome, in ordine di prima apparizione
+    n = len(df)
+    codes, _ = pd.factorize(pd.concat([df["winner_name"], df["loser_name"]], ignore_index=True))
+
+    matches = pd.DataFrame({
+        "id": np.arange(1, n + 1, dtype=np.int64),
+        "match_date": df["tourney_date"],
+        "surface": df["surface"],
+        "tournament_level": df["tourney_level"].replace(LEVEL_ALIASES),
+        "winner_id": codes[:n] + 1,
+        "loser_id": codes[n:] + 1,
+        "winner_rank": df["winner_rank"],
+        "loser_rank": df["loser_rank"],
+        "winner_age": df["winner_age"],
+        "loser_age": df["loser_age"],
+    })
+    for staged, column in STAGED_SERVE_COLUMNS.items():
+        matches[column] = pd.to_numeric(df[staged]).fillna(0).astype(np.int64)
+    return matches
+
+
+def load_offline_matches(source: str, families: Optional[List[str]] = None) -> pd.DataFrame:
+    """Tutti i match, in ordine di replay, dalla sorgente scelta."""
+    if source == "staging":
+        return load_staged_matches(families)
+    return load_matches(*START_CURSOR)
+
+
+# =============================================================================
+# DATASET
+# =============================================================================
+
+def match_features(feats: np.ndarray, ratings: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Una riga per match con le feature di winner e loser, nel formato della
+    query di ml.build_dataset (NULL -> NaN, poi sostituiti dai default),
+    più i rating pre-match di ratings (stesso ordine di righe di feats).
+    """
+    winner, loser = feats[0::2], feats[1::2].copy()
+    # winner == loser: player_match_features tiene solo la prima riga
+    # (vincitore), letta dalla query di ml.build_dataset per entrambi i lati
+    same = winner["player_id"] == loser["player_id"]
+    loser[same] = winner[same]
+    df = pd.DataFrame({
+        "match_id": winner["match_id"],
+        "match_date": winner["match_date"].astype(object),
+        "surface": np.asarray(SURFACES, dtype=object)[winner["surface"]],
+    })
+    for side, rows in (("winner", winner), ("loser", loser)):
+        for feature, column in DATASET_FEATURES.items():
+            values = rows[column]
+            if column in ("rank", "days_since_last_match"):
+                values = np.where(values == NULL_INT, np.nan, values)
+            df[f"{side}_{feature}"] = values
+    if ratings is not None:
+        for side, rows in (("winner", ratings[0::2]), ("loser", ratings[1::2])):
+            for feature, column in DATASET_RATINGS.items():
+                df[f"{side}_{feature}"] = rows[column]
+    return df
+
+
+def build_offline_dataset(
+    source: str = "db",
+    output_path: str = OUTPUT_PATH,
+    families: Optional[List[str]] = None,
+) -> Optional[pd.DataFrame]:
+    """
+    Replay di tutti i match da stato vuoto e scrittura del dataset ML.
+    Nessuna tabella del feature store viene letta o scritta.
+    """
+
+    print("=" * 60)
+    print(f"🧪 FEATURE STORE OFFLINE ({source})")
+    print("=" * 60)
+
+    start = time.perf_counter()
+    matches = prepare_matches(load_offline_matches(source, families))
+    print(f"📊 Match da processare: {matches['n']:,}")
+    if matches["n"] == 0:
+        print("❌ Nessun match trovato")
+        return None
+
+    state = ArrayState.from_states(empty_states(), matches)
+    print(f"   Giocatori: {len(state.player_ids)}, livelli: {''.join(state.levels)}")
+    feats = replay(matches, state)
+    print(f"   Replay: {time.perf_counter() - start:.1f}s")
+
+    # Elo overall/misto/K decrescente e Glicko-2 sugli stessi array
+    ratings = rate_matches(matches)
+    print(f"   Rating: {time.perf_counter() - start:.1f}s")
+
+    print("🔧 Costruzione feature differenziali...")
+    dataset = differential_dataset(match_features(feats, ratings))
+    save_dataset(dataset, output_path)
+    verify_dataset(output_path)
+    return dataset
+
+
+if __name__ == "__main__":
+    build_offline_dataset()
@@ -0,0 +1,217 @@
+"""
+Feature Store Snapshots
+========================
+Snapshot periodici dello stato completo del feature store, scritti dal
+build all'inizio di ogni stagione (anno) o mese, per ricostruire il
+feature store da una data qualsiasi senza ripartire dal 1968.
+
+Ogni snapshot è un checkpoint (stesso formato di feature_store_checkpoint,
+date dei match recenti incluse) con il cursore dell'ultimo match del
+periodo precedente:
+
+    /data/ml/feature_state_snapshots/
+        2019-12-29_154321/meta.json, *.npy
+        2020-12-20_160002/...
+
+rebuild --from YYYY-MM-DD:
+1. sceglie lo snapshot più recente con data cursore < from
+2. in una transazione: cancella le feature successive al cursore dello
+   snapshot, riscrive le tabelle stato e il cursore
+3. cancella gli snapshot successivi (il replay li riscrive)
+4. riprocessa solo la coda dei match
+
+Eseguire con: python -m ml.feature_store_build rebuild --from 2020-01-01 [--numpy]
+(FEATURE_SNAPSHOT_EVERY=year|month|off, FEATURE_SNAPSHOT_DIR per la directory)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from datetime import date
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from app.database import engine
+from ml.feature_families import FAMILIES, as_states, empty_states
+from ml.feature_store_build import (
+    STATE_TABLES,
+    USE_COPY,
+    build_feature_store,
+    create_tables,
+    save_cursor,
+    write_dirty_states,
+)
+from ml.feature_store_checkpoint import META_FILE, load_checkpoint, write_checkpoint
+
+SNAPSHOT_DIR = os.environ.get("FEATURE_SNAPSHOT_DIR", "/data/ml/feature_state_snapshots")
+SNAPSHOT_EVERY = os.environ.get("FEATURE_SNAPSHOT_EVERY", "year").lower()
+
+# Periodo -> unità datetime64 per il calcolo vettoriale dei confini
+SNAPSHOT_UNITS = {"year": "Y", "month": "M"}
+
+START_CURSOR = ("0001-01-01", 0)
+
+
+# =============================================================================
+# PERIODS
+# =============================================================================
+
+def snapshot_period(d: date):
+    """Periodo di snapshot di una data (None se gli snapshot sono disattivati)."""
+    if SNAPSHOT_EVERY == "year":
+        return d.year
+    if SNAPSHOT_EVERY == "month":
+        return d.year, d.month
+    return None
+
+
+def cursor_period(cursor: Tuple[str, int]):
+    """Periodo del cursore di resume (None per il feature store vuoto)."""
+    if tuple(cursor) == START_CURSOR:
+        return None
+    return snapshot_period(date.fromisoformat(cursor[0]))
+
+
+def snapshot_boundaries(days: np.ndarray, cursor: Tuple[str, int]) -> List[int]:
+    """
+    Indici dei match (giorni dall'epoch, ordinati) che aprono un nuovo periodo:
+    prima di ciascuno va scritto uno snapshot. Anche l'indice 0 se il primo
+    match è in un periodo diverso da quello del cursore.
+    """
+    unit = SNAPSHOT_UNITS.get(SNAPSHOT_EVERY)
+    if unit is None or len(days) == 0:
+        return []
+
+    periods = days.astype("datetime64[D]").astype(f"datetime64[{unit}]")
+    starts = (np.flatnonzero(periods[1:] != periods[:-1]) + 1).tolist()
+
+    if cursor_period(cursor) is not None:
+        first = days[0].astype("datetime64[D]").astype(object)
+        if snapshot_period(first) != cursor_period(cursor):
+            starts.insert(0, 0)
+    return starts
+
+
+# =============================================================================
+# READ / WRITE
+# =============================================================================
+
+def snapshot_path(cursor: Tuple[str, int]) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"{cursor[0]}_{int(cursor[1])}")
+
+
+def take_snapshot(states, cursor: Tuple[str, int]):
+    """Scrive lo snapshot dello stato completo dopo il match del cursore."""
+    write_checkpoint(states, cursor, snapshot_path(cursor))
+    print(f"   📸 Snapshot stato ({cursor[0]}, {cursor[1]})")
+
+
+def list_snapshots() -> List[Tuple[str, int]]:
+    """Cursori degli snapshot presenti, in ordine cronologico."""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+
+    cursors = []
+    for name in os.listdir(SNAPSHOT_DIR):
+        meta_path = os.path.join(SNAPSHOT_DIR, name, META_FILE)
+        if not os.path.exists(meta_path):
+            continue
+        try:
+            with open(meta_path) as f:
+                d, match_id = json.load(f)["cursor"]
+        except (OSError, ValueError, KeyError):
+            continue
+        cursors.append((d, int(match_id)))
+    return sorted(cursors)
+
+
+def drop_snapshots_from(from_date: date) -> int:
+    """Cancella gli snapshot con data cursore >= from_date."""
+    dropped = 0
+    for cursor in list_snapshots():
+        if date.fromisoformat(cursor[0]) >= from_date:
+            shutil.rmtree(snapshot_path(cursor), ignore_errors=True)
+            dropped += 1
+    return dropped
+
+
+def find_snapshot(from_date: date):
+    """
+    Snapshot valido più recente con data cursore < from_date.
+
+    Returns:
+        Tuple di (cursore, stati), oppure (START_CURSOR, stati vuoti)
+    """
+    for cursor in reversed(list_snapshots()):
+        if date.fromisoformat(cursor[0]) >= from_date:
+            continue
+        states = load_checkpoint(cursor, snapshot_path(cursor))
+        if states is not None:
+            return cursor, states
+    return START_CURSOR, empty_states()
+
+
+# =============================================================================
+# REBUILD
+# =============================================================================
+
+def restore_snapshot(cursor: Tuple[str, int], states):
+    """
+    Riporta il feature store al cursore in UNA transazione: feature
+    successive cancellate, tabelle stato riscritte (via COPY) insieme a
+    player_latest_state, cursore.
+    """
+    states = as_states(states)
+    full_state = {name: getattr(states, family.state_slot) for name, family in FAMILIES.items()}
+
+    with engine.begin() as conn:
+        deleted = conn.execute(text("""
+            DELETE FROM player_match_features
+            WHERE match_date > :d OR (match_date = :d AND match_id > :id)
+        """), {"d": cursor[0], "id": int(cursor[1])}).rowcount
+
+        for table in STATE_TABLES:
+            conn.execute(text(f"DELETE FROM {table}"))
+        conn.execute(text("DELETE FROM player_latest_state"))
+        rows = write_dirty_states(conn, full_state, use_copy=True)
+
+        # Il cursore resta e la versione cresce anche tornando all'inizio:
+        # cache e snapshot di serving non rivedono mai una versione già usata
+        if tuple(cursor) == START_CURSOR:
+            save_cursor(conn, None, None)
+        else:
+            save_cursor(conn, date.fromisoformat(cursor[0]), cursor[1])
+
+    print(f"   Feature cancellate: {deleted}, righe stato ripristinate: {rows}")
+
+
+def rebuild_from(from_date: date, use_numpy: bool = False, use_copy: bool = USE_COPY,
+                 use_checkpoint: Optional[bool] = None):
+    """Ricostruisce il feature store dai match con data >= from_date."""
+
+    print("=" * 60)
+    print(f"⏪ FEATURE STORE REBUILD da {from_date.isoformat()}")
+    print("=" * 60)
+
+    create_tables()
+
+    cursor, states = find_snapshot(from_date)
+    if tuple(cursor) == START_CURSOR:
+        print("   Nessuno snapshot precedente: replay completo")
+    else:
+        print(f"   Snapshot ({cursor[0]}, {cursor[1]})")
+
+    restore_snapshot(cursor, states)
+    dropped = drop_snapshots_from(from_date)
+    if dropped:
+        print(f"   Snapshot successivi rimossi: {dropped}")
+
+    if use_numpy:
+        from ml.feature_store_numpy import build_feature_store_numpy
+        build_feature_store_numpy(states, use_copy, use_checkpoint)
+    else:
+        build_feature_store(states, use_copy, use_checkpoint)
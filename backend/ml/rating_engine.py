@@ -0,0 +1,329 @@
+"""
+Rating Engine
+==============
+Più sistemi di rating calcolati in un solo passaggio cronologico sui match:
+
+- Elo overall (K fisso, come build_elo.py)
+- Elo per superficie (stesse operazioni float del feature store)
+- Elo misto superficie/overall (solo pre-match, peso BLEND_WEIGHT)
+- Elo con K decrescente nel numero di match giocati:
+  K = KDECAY_SCALE / (match + KDECAY_OFFSET) ** KDECAY_SHAPE
+- Glicko-2 con rating deviation e volatilità; la RD cresce con
+  l'inattività (un periodo ogni GLICKO_PERIOD_DAYS giorni)
+
+Lo stato è in array densi indicizzati per giocatore (come ArrayState di
+feature_store_numpy); l'output è un array strutturato RATING_DTYPE con
+2 righe per match (winner, loser), nello stesso ordine delle righe feature.
+
+Uso:
+    ratings = rate_matches(prepare_rating_matches(load_rating_matches()))
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from app.database import engine
+from ml.feature_families import BASE_ELO, K, SURFACES, expected_score
+
+# Peso dell'Elo superficie nell'Elo misto (il resto è Elo overall)
+BLEND_WEIGHT = 0.5
+
+# K decrescente (forma FiveThirtyEight)
+KDECAY_SCALE = 250.0
+KDECAY_OFFSET = 5.0
+KDECAY_SHAPE = 0.4
+
+# Glicko-2
+GLICKO_SCALE = 173.7178
+GLICKO_RD = 350.0
+GLICKO_VOLATILITY = 0.06
+GLICKO_TAU = 0.5
+GLICKO_PERIOD_DAYS = 30
+GLICKO_EPSILON = 1e-6
+
+NO_SURFACE = -1
+NO_DATE = np.iinfo(np.int64).min
+
+# Una riga per (match, giocatore): rating PRE-MATCH, più i valori
+# POST-MATCH di Elo overall e superficie per lo storico player_elo
+RATING_DTYPE = np.dtype([
+    ("match_id", np.int64),
+    ("player_id", np.int64),
+    ("elo", np.float64),
+    ("elo_post", np.float64),
+    ("surface_elo", np.float64),
+    ("surface_elo_post", np.float64),
+    ("blend_elo", np.float64),
+    ("kdecay_elo", np.float64),
+    ("glicko", np.float64),
+    ("glicko_rd", np.float64),
+])
+
+
+RATING_MATCHES_SELECT = """
+    SELECT id, match_date, surface, winner_id, loser_id
+    FROM matches
+"""
+RATING_MATCHES_ORDER = """
+    ORDER BY match_date ASC, id ASC
+"""
+
+# Tutti i match in ordine di replay (anche superfici fuori da SURFACES)
+RATING_MATCHES_SQL = text(RATING_MATCHES_SELECT + RATING_MATCHES_ORDER)
+
+# Match successivi a un cursore (match_date, id)
+RATING_MATCHES_AFTER_SQL = text(RATING_MATCHES_SELECT + """\
+    WHERE match_date > :d OR (match_date = :d AND id > :id)""" + RATING_MATCHES_ORDER)
+
+# Righe per blocco nella lettura in streaming
+RATING_CHUNK = 100000
+
+
+# =============================================================================
+# MATCH LOADING
+# =============================================================================
+
+def load_rating_matches() -> pd.DataFrame:
+    """Carica in forma colonnare tutti i match da processare."""
+    with engine.connect() as conn:
+        return pd.read_sql(RATING_MATCHES_SQL, conn)
+
+
+def iter_rating_matches(cursor: Optional[Tuple[Any, int]] = None, chunksize: int = RATING_CHUNK):
+    """
+    Match in ordine di replay a blocchi di chunksize righe (DataFrame),
+    con un cursore lato server; solo quelli dopo cursor se dato.
+    """
+    if cursor is None:
+        sql, params = RATING_MATCHES_SQL, {}
+    else:
+        sql, params = RATING_MATCHES_AFTER_SQL, {"d": cursor[0], "id": int(cursor[1])}
+    with engine.connect().execution_options(stream_results=True) as conn:
+        yield from pd.read_sql(sql, conn, params=params, chunksize=chunksize)
+
+
+def prepare_rating_matches(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Array per rate_matches() da un DataFrame con id, match_date, surface,
+    winner_id, loser_id (in ordine di replay). Superfici fuori da
+    SURFACES -> NO_SURFACE: contano solo per i rating overall.
+    """
+    surface_codes = {s: i for i, s in enumerate(SURFACES)}
+    return {
+        "n": len(df),
+        "match_id": df["id"].to_numpy(np.int64),
+        "winner_id": df["winner_id"].to_numpy(np.int64),
+        "loser_id": df["loser_id"].to_numpy(np.int64),
+        "day": pd.to_datetime(df["match_date"]).to_numpy().astype("datetime64[D]").astype(np.int64),
+        "surface": df["surface"].map(surface_codes).fillna(NO_SURFACE).to_numpy(np.int8),
+    }
+
+
+# =============================================================================
+# GLICKO-2
+# =============================================================================
+
+def glicko_g(phi: float) -> float:
+    return 1.0 / math.sqrt(1.0 + 3.0 * phi * phi / (math.pi * math.pi))
+
+
+def glicko_volatility(phi: float, sigma: float, delta: float, v: float) -> float:
+    """Nuova volatilità (algoritmo di Illinois, passo 5 di Glickman)."""
+    a = math.log(sigma * sigma)
+    phi2 = phi * phi
+
+    def f(x):
+        ex = math.exp(x)
+        return (ex * (delta * delta - phi2 - v - ex)) / (2.0 * (phi2 + v + ex) ** 2) \
+            - (x - a) / (GLICKO_TAU * GLICKO_TAU)
+
+    A = a
+    if delta * delta > phi2 + v:
+        B = math.log(delta * delta - phi2 - v)
+    else:
+        k = 1
+        while f(a - k * GLICKO_TAU) < 0:
+            k += 1
+        B = a - k * GLICKO_TAU
+
+    fA, fB = f(A), f(B)
+    while abs(B - A) > GLICKO_EPSILON:
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        if fC * fB <= 0:
+            A, fA = B, fB
+        else:
+            fA /= 2.0
+        B, fB = C, fC
+    return math.exp(A / 2.0)
+
+
+def glicko_update(mu: float, phi: float, sigma: float,
+                  mu_opp: float, phi_opp: float, score: float):
+    """Aggiornamento Glicko-2 dopo un singolo match (scala Glicko-2)."""
+    g = glicko_g(phi_opp)
+    e = 1.0 / (1.0 + math.exp(-g * (mu - mu_opp)))
+    v = 1.0 / (g * g * e * (1.0 - e))
+    delta = v * g * (score - e)
+
+    sigma_new = glicko_volatility(phi, sigma, delta, v)
+    phi_star = math.sqrt(phi * phi + sigma_new * sigma_new)
+    phi_new = 1.0 / math.sqrt(1.0 / (phi_star * phi_star) + 1.0 / v)
+    mu_new = mu + phi_new * phi_new * g * (score - e)
+    return mu_new, phi_new, sigma_new
+
+
+# =============================================================================
+# RATING STATE
+# =============================================================================
+
+class RatingState:
+    """Stato di tutti i sistemi di rating, indicizzato per giocatore."""
+
+    def __init__(self, player_ids: np.ndarray):
+        n = len(player_ids)
+        self.player_ids = player_ids
+
+        self.elo = np.full(n, BASE_ELO, dtype=np.float64)
+        self.surface_elo = np.full((n, len(SURFACES)), BASE_ELO, dtype=np.float64)
+        self.kdecay_elo = np.full(n, BASE_ELO, dtype=np.float64)
+        self.matches = np.zeros(n, dtype=np.int64)
+
+        # Glicko-2 in scala interna (mu, phi)
+        self.mu = np.zeros(n, dtype=np.float64)
+        self.phi = np.full(n, GLICKO_RD / GLICKO_SCALE, dtype=np.float64)
+        self.sigma = np.full(n, GLICKO_VOLATILITY, dtype=np.float64)
+        self.last_day = np.full(n, NO_DATE, dtype=np.int64)
+
+    @classmethod
+    def for_matches(cls, matches: Dict[str, np.ndarray]) -> "RatingState":
+        return cls(np.unique(np.concatenate([matches["winner_id"], matches["loser_id"]])))
+
+    def extend(self, player_ids: np.ndarray):
+        """
+        Aggiunge giocatori nuovi con i rating iniziali, mantenendo lo stato
+        degli altri (replay a blocchi con uno stato che cresce).
+        """
+        merged = np.union1d(self.player_ids, player_ids)
+        if len(merged) == len(self.player_ids):
+            return
+        rows = np.searchsorted(merged, self.player_ids)
+        fresh = RatingState(merged)
+        for name in ("elo", "surface_elo", "kdecay_elo", "matches", "mu", "phi", "sigma", "last_day"):
+            getattr(fresh, name)[rows] = getattr(self, name)
+        self.__dict__.update(fresh.__dict__)
+
+    def extend_for(self, matches: Dict[str, np.ndarray]):
+        self.extend(np.concatenate([matches["winner_id"], matches["loser_id"]]))
+
+    def index_of(self, ids) -> np.ndarray:
+        return np.searchsorted(self.player_ids, ids)
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+def rate_matches(matches: Dict[str, np.ndarray], state: RatingState = None) -> np.ndarray:
+    """
+    Processa i match in ordine aggiornando tutti i rating in state
+    (nuovo stato vuoto se None).
+
+    Returns:
+        Array strutturato RATING_DTYPE con 2 righe per match (winner, loser)
+    """
+    if state is None:
+        state = RatingState.for_matches(matches)
+
+    n = matches["n"]
+    ratings = np.zeros(2 * n, dtype=RATING_DTYPE)
+    ratings["match_id"][0::2] = matches["match_id"]
+    ratings["match_id"][1::2] = matches["match_id"]
+    ratings["player_id"][0::2] = matches["winner_id"]
+    ratings["player_id"][1::2] = matches["loser_id"]
+
+    r_elo, r_elo_post = ratings["elo"], ratings["elo_post"]
+    r_surface, r_surface_post = ratings["surface_elo"], ratings["surface_elo_post"]
+    r_kdecay = ratings["kdecay_elo"]
+    r_glicko, r_rd = ratings["glicko"], ratings["glicko_rd"]
+
+    # Liste Python per l'accesso scalare nel loop
+    idx_a = state.index_of(matches["winner_id"]).tolist()
+    idx_b = state.index_of(matches["loser_id"]).tolist()
+    days = matches["day"].tolist()
+    surfaces = matches["surface"].tolist()
+
+    elo, surface_elo = state.elo, state.surface_elo
+    kdecay_elo, played = state.kdecay_elo, state.matches
+    mu, phi, sigma, last_day = state.mu, state.phi, state.sigma, state.last_day
+    phi_max = GLICKO_RD / GLICKO_SCALE
+
+    for i in range(n):
+        a, b = idx_a[i], idx_b[i]
+        s, day = surfaces[i], days[i]
+        ra, rb = 2 * i, 2 * i + 1
+
+        # === ELO OVERALL ===
+        elo_A, elo_B = float(elo[a]), float(elo[b])
+        exp_A = expected_score(elo_A, elo_B)
+        elo[a] = elo_A + K * (1.0 - exp_A)
+        elo[b] = elo_B + K * (0.0 - (1.0 - exp_A))
+        r_elo[ra], r_elo[rb] = elo_A, elo_B
+        r_elo_post[ra], r_elo_post[rb] = elo[a], elo[b]
+
+        # === ELO SUPERFICIE ===
+        if s != NO_SURFACE:
+            surf_A, surf_B = float(surface_elo[a, s]), float(surface_elo[b, s])
+            exp_A = expected_score(surf_A, surf_B)
+            surface_elo[a, s] = surf_A + K * (1.0 - exp_A)
+            surface_elo[b, s] = surf_B + K * (0.0 - (1.0 - exp_A))
+            r_surface[ra], r_surface[rb] = surf_A, surf_B
+            r_surface_post[ra], r_surface_post[rb] = surface_elo[a, s], surface_elo[b, s]
+        else:
+            r_surface[ra] = r_surface[rb] = np.nan
+            r_surface_post[ra] = r_surface_post[rb] = np.nan
+
+        # === ELO K DECRESCENTE ===
+        kd_A, kd_B = float(kdecay_elo[a]), float(kdecay_elo[b])
+        n_A, n_B = int(played[a]), int(played[b])
+        exp_A = expected_score(kd_A, kd_B)
+        kdecay_elo[a] = kd_A + KDECAY_SCALE / (n_A + KDECAY_OFFSET) ** KDECAY_SHAPE * (1.0 - exp_A)
+        kdecay_elo[b] = kd_B - KDECAY_SCALE / (n_B + KDECAY_OFFSET) ** KDECAY_SHAPE * (1.0 - exp_A)
+        played[a] = n_A + 1
+        played[b] = n_B + 1
+        r_kdecay[ra], r_kdecay[rb] = kd_A, kd_B
+
+        # === GLICKO-2 ===
+        pre = []
+        for p in (a, b):
+            phi_p, sigma_p, last = float(phi[p]), float(sigma[p]), int(last_day[p])
+            if last != NO_DATE and day > last:
+                # RD cresce con i periodi di inattività
+                periods = (day - last) / GLICKO_PERIOD_DAYS
+                phi_p = min(math.sqrt(phi_p * phi_p + sigma_p * sigma_p * periods), phi_max)
+            pre.append((float(mu[p]), phi_p, sigma_p))
+        (mu_A, phi_A, sigma_A), (mu_B, phi_B, sigma_B) = pre
+
+        r_glicko[ra] = GLICKO_SCALE * mu_A + BASE_ELO
+        r_glicko[rb] = GLICKO_SCALE * mu_B + BASE_ELO
+        r_rd[ra], r_rd[rb] = GLICKO_SCALE * phi_A, GLICKO_SCALE * phi_B
+
+        mu[a], phi[a], sigma[a] = glicko_update(mu_A, phi_A, sigma_A, mu_B, phi_B, 1.0)
+        mu[b], phi[b], sigma[b] = glicko_update(mu_B, phi_B, sigma_B, mu_A, phi_A, 0.0)
+        last_day[a] = day
+        last_day[b] = day
+
+    # Elo misto (pre-match): solo Elo overall senza superficie
+    surface_known = ~np.isnan(r_surface)
+    ratings["blend_elo"] = np.where(
+        surface_known,
+        BLEND_WEIGHT * np.where(surface_known, r_surface, 0.0) + (1.0 - BLEND_WEIGHT) * r_elo,
+        r_elo,
+    )
+    return ratings
@@ -0,0 +1,153 @@
+"""
+Rolling Windows
+================
+Finestre mobili per giocatore con aggiornamento in tempo costante,
+usate dal feature store al posto di liste ricostruite a ogni match.
+
+- RollingDates: ring buffer delle date dei match (in giorni) con un
+  puntatore di coda per ogni finestra -> match negli ultimi N giorni
+- RollingResults: ring buffer degli ultimi risultati (0/1) con una somma
+  corrente per ogni finestra -> win rate negli ultimi N match
+
+Le finestre sono configurabili (es. 7, 14, 30, 90 giorni; 5, 10, 20 match):
+ogni finestra in più costa un puntatore o una somma, non una scansione.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+from typing import Iterable, List, Sequence
+
+DATES_CAPACITY = 16
+EPOCH = date(1970, 1, 1)
+
+
+def day_number(d: date) -> int:
+    """Data -> giorni dall'1/1/1970, l'unità delle date in RollingDates."""
+    return (d - EPOCH).days
+
+
+class RollingDates:
+    """
+    Date dei match recenti di un giocatore, in giorni (interi crescenti).
+
+    Il ring è indicizzato con posizioni assolute (posizione % capacità):
+    head è il numero di date inserite, tails[k] la prima data ancora
+    dentro la finestra k. Le date devono arrivare in ordine non decrescente.
+    """
+
+    __slots__ = ("windows", "days", "head", "tails")
+
+    def __init__(self, windows: Sequence[int] = (30,), capacity: int = DATES_CAPACITY):
+        self.windows = tuple(windows)
+        self.days: List[int] = [0] * capacity
+        self.head = 0
+        self.tails = [0] * len(self.windows)
+
+    @classmethod
+    def from_days(cls, days: Iterable[int], windows: Sequence[int] = (30,)) -> "RollingDates":
+        """Ricostruisce le finestre da date salvate (ordine cronologico)."""
+        dates = cls(windows)
+        for d in days:
+            dates.push(int(d))
+        return dates
+
+    def __len__(self):
+        return self.head - min(self.tails, default=self.head)
+
+    def __iter__(self):
+        """Date ancora nel ring, dalla più vecchia alla più recente."""
+        cap = len(self.days)
+        for pos in range(self.head - len(self), self.head):
+            yield self.days[pos % cap]
+
+    def counts(self, day: int) -> List[int]:
+        """Match con data in [day - w, day] per ogni finestra w."""
+        days = self.days
+        cap = len(days)
+        head = self.head
+        out = []
+        for k, window in enumerate(self.windows):
+            cutoff = day - window
+            t = self.tails[k]
+            while t < head and days[t % cap] < cutoff:
+                t += 1
+            self.tails[k] = t
+            out.append(head - t)
+        return out
+
+    def push(self, day: int):
+        """Aggiunge la data di un match (ammortizzato O(1))."""
+        cap = len(self.days)
+        oldest = min(self.tails, default=self.head)
+        if self.head - oldest >= cap:
+            self._grow(oldest)
+            cap = len(self.days)
+        self.days[self.head % cap] = day
+        self.head += 1
+
+    def _grow(self, oldest: int):
+        old, cap = self.days, len(self.days)
+        new_cap = cap * 2
+        days = [0] * new_cap
+        for pos in range(oldest, self.head):
+            days[pos % new_cap] = old[pos % cap]
+        self.days = days
+
+
+class RollingResults:
+    """
+    Ultimi risultati di un giocatore (1 = vittoria, 0 = sconfitta)
+    con somme correnti per le finestre configurate.
+
+    La capacità è la finestra più lunga (almeno min_capacity): è anche
+    la storia persistita in player_form_state.last_results.
+    """
+
+    __slots__ = ("windows", "buf", "count", "sums")
+
+    def __init__(self, windows: Sequence[int] = (5, 10), min_capacity: int = 0):
+        self.windows = tuple(windows)
+        self.buf: List[int] = [0] * max(max(self.windows, default=1), min_capacity)
+        self.count = 0
+        self.sums = [0] * len(self.windows)
+
+    @classmethod
+    def from_values(cls, values: Iterable[int], windows: Sequence[int] = (5, 10),
+                    min_capacity: int = 0) -> "RollingResults":
+        """Ricostruisce le finestre da una storia salvata (ordine cronologico)."""
+        results = cls(windows, min_capacity)
+        for v in values:
+            results.push(int(v))
+        return results
+
+    def __len__(self):
+        return min(self.count, len(self.buf))
+
+    def __iter__(self):
+        """Risultati conservati, dal più vecchio al più recente."""
+        cap = len(self.buf)
+        for pos in range(self.count - len(self), self.count):
+            yield self.buf[pos % cap]
+
+    def push(self, value: int):
+        """Aggiunge un risultato aggiornando tutte le somme in O(finestre)."""
+        buf, count = self.buf, self.count
+        cap = len(buf)
+        for k, window in enumerate(self.windows):
+            self.sums[k] += value
+            if count >= window:
+                # Esce dalla finestra il risultato di window match fa
+                self.sums[k] -= buf[(count - window) % cap]
+        buf[count % cap] = value
+        self.count = count + 1
+
+    def means(self) -> List[float]:
+        """Win rate per ogni finestra (0.0 senza match)."""
+        count = self.count
+        if count == 0:
+            return [0.0] * len(self.windows)
+        return [
+            float(total) / float(window if count >= window else count)
+            for total, window in zip(self.sums, self.windows)
+        ]